@@ -0,0 +1,163 @@
+"""HTTP сервис генерации: очередь задач с приоритетами поверх тёплых пайплайнов
+
+Запуск без интерфейса: python api.py (или uvicorn api:app --host 127.0.0.1 --port 8000)
+"""
+import base64
+import binascii
+import io
+import threading
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response
+from PIL import Image
+from pydantic import BaseModel, Field
+
+from config import NEGATIVE_PROMPT, SERVICE_HOST, SERVICE_PORT
+from imggenerator import BreakcoreGenerator, Settings
+from input_queue import load_resized
+from jobs import Job, JobQueue
+from output_writer import FORMAT_EXTENSIONS
+from tracing import tracer
+
+MEDIA_TYPES = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+class JobRequest(BaseModel):
+    mode: Literal["txt2img", "img2img"] = "txt2img"
+    prompts: List[str] = Field(min_length=1)
+    negative_prompts: Optional[List[str]] = None
+    settings: Settings = Field(default_factory=Settings)
+    n_per_prompt: int = Field(1, ge=1, le=64)
+    image: Optional[str] = Field(None, description="исходник img2img в base64 (PNG/JPEG/WEBP)")
+    priority: int = 0
+
+
+class OutputRequest(BaseModel):
+    format: Literal["png", "webp", "jpeg"]
+    quality: int = Field(90, ge=1, le=100)
+
+
+def decode_image(data: str, size) -> Image.Image:
+    try:
+        raw = base64.b64decode(data, validate=True)
+        return load_resized(io.BytesIO(raw), size)
+    except (binascii.Error, OSError, ValueError) as e:
+        raise HTTPException(400, f"Не удалось прочитать исходник: {e}")
+
+
+def job_info(queue: JobQueue, job: Job) -> dict:
+    info = job.info()
+    info["position"] = queue.position(job)
+    return info
+
+
+def create_app(generator: Optional[BreakcoreGenerator] = None) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        app.state.jobs = JobQueue(generator or BreakcoreGenerator())
+        yield
+        app.state.jobs.stop()
+
+    app = FastAPI(title="Breakcore Generator", lifespan=lifespan)
+
+    def jobs_of(request: Request) -> JobQueue:
+        return request.app.state.jobs
+
+    def find(request: Request, job_id: str) -> Job:
+        job = jobs_of(request).get(job_id)
+        if job is None:
+            raise HTTPException(404, f"Нет задачи {job_id}")
+        return job
+
+    @app.post("/jobs", status_code=202)
+    def submit(body: JobRequest, request: Request):
+        negative = body.negative_prompts or [NEGATIVE_PROMPT] * len(body.prompts)
+        if len(negative) != len(body.prompts):
+            raise HTTPException(422, "Количество негативных промптов не совпадает с количеством промптов")
+        init_image = None
+        if body.image is not None:
+            init_image = decode_image(body.image, (body.settings.width, body.settings.height))
+        job = Job(
+            mode=body.mode, prompts=body.prompts, negative_prompts=negative, settings=body.settings,
+            n_per_prompt=body.n_per_prompt, init_image=init_image, priority=body.priority,
+        )
+        queue = jobs_of(request)
+        queue.submit(job)
+        return job_info(queue, job)
+
+    @app.get("/jobs")
+    def list_jobs(request: Request):
+        queue = jobs_of(request)
+        return [job_info(queue, job) for job in queue.jobs()]
+
+    @app.get("/jobs/{job_id}")
+    def status(job_id: str, request: Request):
+        return job_info(jobs_of(request), find(request, job_id))
+
+    @app.delete("/jobs/{job_id}")
+    def cancel(job_id: str, request: Request):
+        find(request, job_id)
+        queue = jobs_of(request)
+        return job_info(queue, queue.cancel(job_id))
+
+    @app.get("/jobs/{job_id}/images/{index}")
+    def download_image(job_id: str, index: int, request: Request, format: Literal["png", "webp", "jpeg"] = "png"):
+        job = find(request, job_id)
+        if job.status != "done":
+            raise HTTPException(409, f"Задача в статусе {job.status}")
+        if not 0 <= index < len(job.images):
+            raise HTTPException(404, f"У задачи {len(job.images)} изображений")
+        buffer = io.BytesIO()
+        job.images[index].save(buffer, format=format.upper())
+        filename = f"{job.id}_{index}.{FORMAT_EXTENSIONS[format]}"
+        headers = {"Content-Disposition": f'inline; filename="{filename}"'}
+        seed = job.images[index].info.get("seed")
+        if seed is not None:
+            headers["X-Seed"] = str(seed)
+        return Response(buffer.getvalue(), media_type=MEDIA_TYPES[format], headers=headers)
+
+    @app.put("/output")
+    def set_output(body: OutputRequest, request: Request):
+        options = jobs_of(request).generator.writer.options
+        options.format = body.format
+        options.quality = body.quality
+        return {"format": options.format, "quality": options.quality}
+
+    @app.get("/stats")
+    def stats(request: Request):
+        generator = jobs_of(request).generator
+        return {
+            "jobs": jobs_of(request).stats(),
+            "writer": generator.writer.stats(),
+            "latent_cache": generator.latent_cache.stats(),
+            "result_cache": generator.result_cache.stats(),
+            "prompt_cache": generator.prompt_cache.stats(),
+            "pipelines": generator.pipelines.stats(),
+        }
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics():
+        return tracer.prometheus()
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
+
+    return app
+
+
+app = create_app()
+
+
+def serve_in_thread(host: str = SERVICE_HOST, port: int = SERVICE_PORT) -> uvicorn.Server:
+    """Поднимает сервис в фоновом потоке текущего процесса"""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="service", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=SERVICE_HOST, port=SERVICE_PORT)
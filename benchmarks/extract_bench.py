@@ -0,0 +1,156 @@
+"""Бенчмарк извлечения pinimg URL: старый BeautifulSoup против потокового парсера
+
+Корпус - сохранённые страницы Pinterest (*.html), например записанные через
+Options(record_dir=...). Без корпуса можно сгенерировать синтетическую страницу.
+
+Запуск: python -m benchmarks.extract_bench --pages benchmarks/pages --repeat 5
+        python -m benchmarks.extract_bench --synthetic 3
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import time
+import tracemalloc
+from typing import List
+
+from bs4 import BeautifulSoup
+
+from config import PINIMG_HOSTS
+from parsers.extract import extract_image_urls
+
+
+def legacy_extract_image_urls(html: str) -> List[str]:
+    """Исходная реализация PinterestDownloader.extract_image_urls - эталон для сверки"""
+    soup = BeautifulSoup(html, "html.parser")
+    urls: List[str] = []
+    data_script = soup.find("script", {"id": "__PWS_DATA__"})
+    if data_script and data_script.string:
+        data = json.loads(data_script.string)
+        pins = data.get("props", {}).get("initialReduxState", {}).get("pins", {})
+        for _, pin_data in pins.items():
+            images = pin_data.get("images", {})
+            for size in images.values():
+                if isinstance(size, dict) and "url" in size:
+                    urls.append(size["url"])
+    for img in soup.find_all("img"):
+        if img.has_attr("src"):
+            src = img["src"]
+            if any(host in src for host in PINIMG_HOSTS):
+                urls.append(src)
+        if img.has_attr("data-src"):
+            data_src = img["data-src"]
+            if any(host in data_src for host in PINIMG_HOSTS):
+                urls.append(data_src)
+        if img.has_attr("srcset"):
+            for candidate in img["srcset"].split(","):
+                u = candidate.strip().split(" ")[0]
+                if any(host in u for host in PINIMG_HOSTS):
+                    urls.append(u)
+    for element in soup.find_all(attrs={"data-pin-media": True}):
+        media_url = element.get("data-pin-media")
+        if media_url and any(host in media_url for host in PINIMG_HOSTS):
+            urls.append(media_url)
+    unique_urls = list(set(urls))
+    filtered_urls = []
+    for url in unique_urls:
+        if re.search(r'/\d{2,3}x\d{2,3}/', url):
+            continue
+        if any(word in url.lower() for word in ['avatar', 'icon', 'logo']):
+            continue
+        filtered_urls.append(url)
+    return filtered_urls
+
+
+def synthetic_page(pins: int, seed: int = 0) -> str:
+    """Страница, похожая на выдачу поиска: большой __PWS_DATA__ и сетка <img>"""
+    rng = random.Random(seed)
+    sizes = ["236x", "474x", "564x", "736x", "originals", "75x75_RS", "170x"]
+    data = {"props": {"initialReduxState": {"pins": {}}}}
+    body = []
+    for i in range(pins):
+        h = f"{rng.getrandbits(64):016x}"
+        path = f"{h[:2]}/{h[2:4]}/{h[4:6]}/{h}.jpg"
+        images = {s: {"url": f"https://i.pinimg.com/{s}/{path}", "width": 236, "height": 420} for s in sizes}
+        data["props"]["initialReduxState"]["pins"][str(i)] = {
+            "images": images,
+            "description": "breakcore anime " * rng.randint(5, 40),
+        }
+        srcset = ", ".join(f"https://i.pinimg.com/{s}/{path} {n}x" for n, s in enumerate(sizes[:4], 1))
+        wrappers = "".join(f'<div class="Jea gjz zI7 iyn Hsu" data-test-id="w{k}" style="width: 236px">' for k in range(6))
+        body.append(
+            f'<div class="pin" data-pin-media="https://i.pinimg.com/originals/{path}">{wrappers}'
+            f'<a href="/pin/{h}/" aria-label="pin"><span class="tBJ dyH iFc">breakcore</span></a>'
+            f'<img src="https://i.pinimg.com/236x/{path}" srcset="{srcset}" alt="pin &amp; {i}">'
+            f'<img src="https://s.pinimg.com/images/user/default_avatar.png">{"</div>" * 6}</div>'
+        )
+    script = json.dumps(data)
+    return (
+        "<!DOCTYPE html><html><head><title>Pinterest</title>"
+        f'<script id="__PWS_DATA__" type="application/json">{script}</script>'
+        "</head><body>" + "".join(body) + "</body></html>"
+    )
+
+
+def measure(fn, html: str, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(html)
+        times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    fn(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"best_s": min(times), "mean_s": sum(times) / len(times), "peak_mb": peak / 2**20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default="benchmarks/pages", help="папка с сохранёнными *.html")
+    parser.add_argument("--synthetic", type=int, default=0, help="добавить N синтетических страниц")
+    parser.add_argument("--pins", type=int, default=400, help="пинов на синтетической странице")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", dest="json_path", help="куда записать результаты")
+    args = parser.parse_args()
+
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(args.pages, "*.html"))):
+        with open(path, "r", encoding="utf-8") as f:
+            corpus.append((os.path.basename(path), f.read()))
+    for i in range(args.synthetic):
+        corpus.append((f"synthetic_{i}", synthetic_page(args.pins, seed=i)))
+    if not corpus:
+        parser.error(f"нет страниц в {args.pages}, используйте --synthetic N")
+
+    results = []
+    for name, html in corpus:
+        legacy = legacy_extract_image_urls(html)
+        fast = extract_image_urls(html)
+        row = {
+            "page": name,
+            "size_mb": len(html.encode("utf-8")) / 2**20,
+            "urls": len(fast),
+            "identical": legacy == fast,
+            "legacy": measure(legacy_extract_image_urls, html, args.repeat),
+            "streaming": measure(extract_image_urls, html, args.repeat),
+        }
+        row["speedup"] = row["legacy"]["best_s"] / row["streaming"]["best_s"]
+        results.append(row)
+        print(
+            f"{name}: {row['size_mb']:.1f} MB, {row['urls']} URL, identical={row['identical']}, "
+            f"{row['legacy']['best_s'] * 1000:.1f} -> {row['streaming']['best_s'] * 1000:.1f} ms "
+            f"(x{row['speedup']:.1f}), peak {row['legacy']['peak_mb']:.1f} -> {row['streaming']['peak_mb']:.1f} MB"
+        )
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if not all(r["identical"] for r in results):
+        raise SystemExit("Результаты потокового парсера отличаются от эталона")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Бенчмарк генерации: загрузка, энкод промпта, шаги UNet, VAE, сохранение, end-to-end
+
+Прогоны идут через BreakcoreGenerator.generate_batch, то есть настоящим путём:
+кэши промптов и латентов, план памяти и батчинг, фоновый OutputWriter.
+Стадии берутся из спанов tracer (pipeline_load, encode, vae_encode, denoise,
+decode, save). Промпт у каждого прогона свой, поэтому энкод меряется всегда,
+а исходник img2img один на конфигурацию, поэтому тёплые прогоны попадают в
+кэш латентов. Кэш результатов выключен, иначе повтор отдавался бы с диска.
+save_s - время записи в фоновых потоках, e2e_s включает ожидание flush().
+
+По умолчанию собирает крошечный случайный SDXL (и LoRA к нему) и гоняет на CPU,
+поэтому запускается где угодно. Сетка: режимы x разрешения x шаги x батч x LoRA.
+С --baseline сравнивает с сохранённым JSON и завершается с ошибкой при регрессии.
+
+Запуск: python -m benchmarks.generation_bench --json bench.json
+        python -m benchmarks.generation_bench --baseline bench.json --threshold 0.25
+        python -m benchmarks.generation_bench --model stabilityai/stable-diffusion-xl-base-1.0 \\
+            --device cuda --sizes 512 1024 --steps 20 40 --batch 1 4
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import diffusers
+import torch
+import transformers
+from PIL import Image
+
+from benchmarks.tiny_sdxl import build_tiny_lora, build_tiny_sdxl
+from config import LORA_PATH, NEGATIVE_PROMPT, TEST_PROMPT
+from imggenerator import BreakcoreGenerator
+from output_writer import OutputWriter
+from pipeline_manager import PipelineManager
+from result_cache import ResultCache
+from settings import Settings
+from tracing import tracer
+
+LATENCY_METRICS = ("load_s", "encode_s", "step_s", "vae_encode_s", "vae_decode_s", "save_s", "e2e_s")
+# абсолютный допуск, чтобы шум в доли миллисекунды не считался регрессией
+MIN_REGRESSION_S = 0.002
+# метрика -> спан tracer, из которого она берётся
+STAGE_SPANS = {
+    "load_s": "pipeline_load",
+    "encode_s": "encode",
+    "vae_encode_s": "vae_encode",
+    "vae_decode_s": "decode",
+    "save_s": "save",
+}
+
+
+def sync(device: str):
+    if device.startswith("cuda") and torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def stage_totals() -> Dict[str, Tuple[int, float]]:
+    return {name: (s["count"], s["total_s"]) for name, s in tracer.summary()["stages"].items()}
+
+
+def stage_delta(before: dict, after: dict, name: str) -> Tuple[int, float]:
+    count, total = after.get(name, (0, 0.0))
+    old_count, old_total = before.get(name, (0, 0.0))
+    return count - old_count, total - old_total
+
+
+def steps_run(config: dict) -> int:
+    # img2img пропускает начало расписания: шагов int(steps * strength), как в get_timesteps
+    if config["mode"] == "img2img":
+        return int(min(config["steps"] * config["strength"], config["steps"]))
+    return config["steps"]
+
+
+def config_key(config: dict) -> str:
+    lora = "lora" if config["lora"] else "nolora"
+    return f"{config['mode']}/{config['size']}px/{config['steps']}st/b{config['batch']}/{lora}"
+
+
+def run_once(generator: BreakcoreGenerator, config: dict, source, device: str, run: int) -> Dict[str, float]:
+    batch = config["batch"]
+    settings = Settings(
+        height=config["size"], width=config["size"], num_inference_steps=config["steps"],
+        strength=config["strength"], lora_scale=config["lora_scale"], batch_size=batch, seed=0,
+    )
+    prompts = [f"{TEST_PROMPT}, take {run}"] * batch
+
+    before = stage_totals()
+    sync(device)
+    started = time.perf_counter()
+    generator.generate_batch(prompts, [NEGATIVE_PROMPT] * batch, mode=config["mode"], init_image=source,
+                             settings=settings)
+    sync(device)
+    generated = time.perf_counter()
+    generator.writer.flush()
+    ended = time.perf_counter()
+    after = stage_totals()
+
+    metrics = {name: stage_delta(before, after, span)[1] for name, span in STAGE_SPANS.items()}
+    calls, denoise_s = stage_delta(before, after, "denoise")
+    metrics["steps_run"] = steps_run(config)
+    metrics["step_s"] = denoise_s / (calls * metrics["steps_run"]) if calls and metrics["steps_run"] else 0.0
+    metrics["flush_s"] = ended - generated
+    metrics["e2e_s"] = ended - started
+    metrics["images_per_s"] = batch / metrics["e2e_s"]
+    return metrics
+
+
+def measure(generator: BreakcoreGenerator, config: dict, device: str, repeat: int, runs: List[int]) -> dict:
+    source = None
+    if config["mode"] == "img2img":
+        source = Image.effect_noise((config["size"], config["size"]), 64).convert("RGB")
+
+    def once():
+        runs[0] += 1
+        return run_once(generator, config, source, device, runs[0])
+
+    cold = once()
+    # прогресс-бар денойзинга на каждый вызов только мешает выводу
+    generator.pipelines.get(config["mode"], generator.lora_path).set_progress_bar_config(disable=True)
+    warm = [once() for _ in range(repeat)]
+    metrics = {name: statistics.median(run[name] for run in warm) for name in warm[0]}
+    # load_s тёплых прогонов ~0, холодная загрузка считается отдельно
+    metrics["cold_load_s"] = cold["load_s"]
+    return metrics
+
+
+def compare(results: List[dict], baseline: dict, threshold: float) -> List[str]:
+    """Список регрессий относительно baseline (тот же формат JSON)"""
+    base = {row["key"]: row["metrics"] for row in baseline.get("results", [])}
+    regressions = []
+    for row in results:
+        old = base.get(row["key"])
+        if old is None:
+            continue
+        for name in LATENCY_METRICS:
+            cur, ref = row["metrics"].get(name), old.get(name)
+            if cur is None or ref is None:
+                continue
+            if cur > ref * (1 + threshold) and cur - ref > MIN_REGRESSION_S:
+                regressions.append(f"{row['key']}: {name} {ref * 1000:.1f} -> {cur * 1000:.1f} ms")
+        cur, ref = row["metrics"].get("images_per_s"), old.get("images_per_s")
+        if cur is not None and ref and cur < ref * (1 - threshold):
+            regressions.append(f"{row['key']}: images_per_s {ref:.2f} -> {cur:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="модель или папка; по умолчанию крошечный случайный SDXL")
+    parser.add_argument("--lora-path", default=None, help=f"LoRA для --model (по умолчанию {LORA_PATH})")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--modes", nargs="+", default=["txt2img", "img2img"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[64, 128])
+    parser.add_argument("--steps", nargs="+", type=int, default=[2, 4])
+    parser.add_argument("--batch", nargs="+", type=int, default=[1, 2])
+    parser.add_argument("--lora", nargs="+", choices=["off", "on"], default=["off", "on"])
+    parser.add_argument("--lora-scale", type=float, default=0.8)
+    parser.add_argument("--strength", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, help="torch.set_num_threads для стабильных замеров на CPU")
+    parser.add_argument("--json", dest="json_path", help="куда записать результаты")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.25, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    # посимвольный токенайзер крошечной модели режет TEST_PROMPT и предупреждает об этом на каждом вызове
+    transformers.logging.set_verbosity_error()
+    diffusers.logging.set_verbosity_error()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.model:
+            model_id, lora_path = args.model, args.lora_path or LORA_PATH
+            manager = PipelineManager(model_id=model_id, device=args.device)
+        else:
+            model_id = build_tiny_sdxl(os.path.join(tmp, "model"))
+            lora_path = build_tiny_lora(model_id, os.path.join(tmp, "lora", "tiny_lora.safetensors"))
+            manager = PipelineManager(model_id=model_id, device=args.device, cache_dir=None, variant=None)
+        out_dir = os.path.join(tmp, "out")
+
+        # один менеджер пайплайнов на оба генератора, как у сервиса
+        generators = {}
+        for lora in args.lora:
+            generator = BreakcoreGenerator(pipelines=manager, lora_path=lora_path if lora == "on" else None)
+            generator.result_cache = ResultCache(max_mb=0)
+            generator.output_dir = out_dir
+            generator.writer = OutputWriter(out_dir)
+            generators[lora] = generator
+
+        results, runs = [], [0]
+        grid = itertools.product(args.lora, args.modes, args.sizes, args.steps, args.batch)
+        for lora, mode, size, steps, batch in grid:
+            config = {
+                "mode": mode, "size": size, "steps": steps, "batch": batch, "lora": lora == "on",
+                "lora_scale": args.lora_scale, "strength": args.strength,
+            }
+            metrics = measure(generators[lora], config, args.device, args.repeat, runs)
+            row = {"key": config_key(config), "config": config, "metrics": metrics}
+            results.append(row)
+            print(
+                f"{row['key']}: e2e {metrics['e2e_s'] * 1000:.1f} ms, {metrics['images_per_s']:.2f} img/s, "
+                f"encode {metrics['encode_s'] * 1000:.1f}, step {metrics['step_s'] * 1000:.1f}, "
+                f"vae enc/dec {metrics['vae_encode_s'] * 1000:.1f}/{metrics['vae_decode_s'] * 1000:.1f}, "
+                f"save {metrics['save_s'] * 1000:.1f} ms"
+            )
+        for generator in generators.values():
+            generator.writer.close()
+        pipeline_stats = manager.stats()
+        caches = {
+            lora: {"prompt_cache": g.prompt_cache.stats(), "latent_cache": g.latent_cache.stats()}
+            for lora, g in generators.items()
+        }
+
+    report = {
+        "meta": {
+            "model": args.model or "tiny-random-sdxl",
+            "device": args.device,
+            "torch": torch.__version__,
+            "diffusers": diffusers.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "threads": torch.get_num_threads(),
+            "repeat": args.repeat,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "load": {"loads": pipeline_stats["loads"], "load_time_s": pipeline_stats["load_time_s"]},
+        "caches": caches,
+        "results": results,
+    }
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("Регрессии относительно baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            raise SystemExit(1)
+        print(f"Регрессий нет (порог {args.threshold:.0%})")
+
+
+if __name__ == "__main__":
+    main()
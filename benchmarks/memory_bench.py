@@ -0,0 +1,142 @@
+"""Пик памяти и пропускная способность по режимам MEMORY_MODES
+
+Каждый режим гоняется в отдельном процессе (пиковый RSS не сбрасывается):
+пиковый RSS, пик VRAM на cuda и изображений в секунду. По умолчанию -
+крошечный случайный SDXL на CPU, режимы с выгрузкой на CPU там пропускаются.
+Таблица --plan показывает выбор auto для весов SDXL fp16 при разных бюджетах.
+
+Запуск: python -m benchmarks.memory_bench --size 512 --batch 4
+        python -m benchmarks.memory_bench --model stabilityai/stable-diffusion-xl-base-1.0 --device cuda --size 1024
+        python -m benchmarks.memory_bench --plan
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from settings import MEMORY_MODES, Settings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# размеры весов SDXL base в fp16, байт
+SDXL_FP16_SIZES = {
+    "text_encoder": 246 * 2**20,
+    "text_encoder_2": 1390 * 2**20,
+    "unet": 5135 * 2**20,
+    "vae": 167 * 2**20,
+    "largest_layer": 126 * 2**20,
+}
+PLAN_BUDGETS_GB = (4, 6, 8, 12, 16, 24)
+
+
+def worker(args):
+    """Один режим: загрузка, два прогона, печать JSON с пиками и скоростью"""
+    import torch
+
+    from pipeline_manager import PipelineManager
+    from tracing import peak_rss_bytes, rss_bytes
+
+    # крошечная модель из папки без fp16 варианта
+    kwargs = dict(cache_dir=None, variant=None) if os.path.isdir(args.model) else {}
+    manager = PipelineManager(model_id=args.model, device=args.device, **kwargs)
+    pipe = manager.get("txt2img", lora_path=None)
+    manager.apply_memory(args.worker, lora_path=None)
+    cuda = args.device.startswith("cuda")
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    rss_before = rss_bytes()
+
+    times = []
+    for _ in range(2):
+        started = time.perf_counter()
+        pipe(
+            prompt=["breakcore"] * args.batch, negative_prompt=["blurry"] * args.batch,
+            height=args.size, width=args.size, num_inference_steps=args.steps,
+            generator=torch.Generator(device="cpu").manual_seed(0),
+        )
+        if cuda:
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - started)
+
+    print(json.dumps({
+        "mode": args.worker,
+        "rss_before_mb": round(rss_before / 2**20, 1),
+        "peak_rss_mb": round(peak_rss_bytes() / 2**20, 1),
+        "peak_vram_mb": round(torch.cuda.max_memory_allocated() / 2**20, 1) if cuda else None,
+        "images_per_s": round(args.batch / min(times), 3),
+    }))
+
+
+def plan_table(batch: int, steps: int):
+    from memory_policy import plan_memory
+
+    rows = []
+    for size in (512, 768, 1024):
+        for budget_gb in PLAN_BUDGETS_GB:
+            settings = Settings(height=size, width=size, num_inference_steps=steps, batch_size=batch)
+            plan = plan_memory(SDXL_FP16_SIZES, settings, "cuda", batch, budget_gb * 2**30, tile=1024)
+            rows.append({
+                "size": size, "budget_gb": budget_gb, "mode": plan.mode, "batch": plan.batch_size,
+                "estimated_peak_gb": round(plan.peak_bytes / 2**30, 2),
+            })
+            print(f"{size}x{size}, бюджет {budget_gb} GB: {plan.mode}, батч {plan.batch_size}, "
+                  f"оценка {plan.peak_bytes / 2**30:.2f} GB")
+    return rows
+
+
+def run_modes(args) -> list:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        model = args.model
+        if model is None:
+            from benchmarks.tiny_sdxl import build_tiny_sdxl
+            model = build_tiny_sdxl(os.path.join(tmp, "model"))
+        for mode in args.modes:
+            if MEMORY_MODES[mode].offload != "none" and not args.device.startswith("cuda"):
+                print(f"{mode}: пропущен, выгрузка работает только на cuda")
+                continue
+            cmd = [sys.executable, "-m", "benchmarks.memory_bench", "--worker", mode, "--model", model,
+                   "--device", args.device, "--size", str(args.size), "--batch", str(args.batch),
+                   "--steps", str(args.steps)]
+            proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"{mode}: упал\n{proc.stderr[-2000:]}")
+                continue
+            row = json.loads(proc.stdout.strip().splitlines()[-1])
+            results.append(row)
+            vram = f", пик VRAM {row['peak_vram_mb']:.0f} MB" if row["peak_vram_mb"] is not None else ""
+            print(f"{mode}: пик RSS {row['peak_rss_mb']:.0f} MB (до генерации {row['rss_before_mb']:.0f}){vram}, "
+                  f"{row['images_per_s']:.2f} изобр/с")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="модель или папка; по умолчанию крошечный случайный SDXL")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=2)
+    parser.add_argument("--modes", nargs="+", default=list(MEMORY_MODES))
+    parser.add_argument("--plan", action="store_true", help="только таблица выбора auto для SDXL fp16")
+    parser.add_argument("--json", dest="json_path", help="куда записать результаты")
+    parser.add_argument("--worker", choices=list(MEMORY_MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+    if args.plan:
+        report = {"plan": plan_table(args.batch, args.steps)}
+    else:
+        report = {"results": run_modes(args)}
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
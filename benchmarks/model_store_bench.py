@@ -0,0 +1,116 @@
+"""Холодная и тёплая загрузка: снапшот + LoRA против готового бандла ModelStore
+
+Каждый вариант грузится в отдельном процессе: первая загрузка - холодная
+(импорты, первое чтение файлов), следующие --repeats - тёплые. Выход
+бандла сравнивается с выходом снапшота с той же LoRA.
+
+Запуск: python -m benchmarks.model_store_bench --repeats 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def worker(source: str, model_dir: str, lora_path: str, store_root: str, scale: float, repeats: int, out: str):
+    """Грузит пайплайн repeats + 1 раз, печатает времена и сохраняет картинку в out (.npy)"""
+    started = time.perf_counter()
+    import numpy as np
+    import torch
+
+    from config import LORA_NAME
+    from lora_manager import LoraManager
+    from model_store import ModelStore
+    from pipeline_manager import PIPELINE_CLASSES
+    import_s = time.perf_counter() - started
+
+    store = ModelStore(root=store_root, cache_dir=None)
+    times = []
+    for _ in range(repeats + 1):
+        started = time.perf_counter()
+        pipe, bundle = store.load(PIPELINE_CLASSES["txt2img"], model_dir, torch.float32, None,
+                                  lora_path if source == "bundle" else None)
+        lora = LoraManager(pipe)
+        if bundle is not None:
+            lora.set_baked(bundle["lora_contributions"])
+        lora.add(LORA_NAME, lora_path)
+        lora.prepare(scale)
+        times.append(time.perf_counter() - started)
+
+    image = pipe(
+        prompt="breakcore", negative_prompt="blurry", height=64, width=64, num_inference_steps=2,
+        generator=torch.Generator(device="cpu").manual_seed(0), output_type="np",
+    ).images
+    np.save(out, image)
+    print(json.dumps({"import_s": import_s, "times": times, "adapter_loads": lora.metrics["adapter_loads"]}))
+
+
+def run_worker(source: str, args, model_dir: str, lora_path: str, store_root: str, out: str) -> dict:
+    cmd = [sys.executable, "-m", "benchmarks.model_store_bench", "--worker", source,
+           "--model-dir", model_dir, "--lora", lora_path, "--store", store_root,
+           "--scale", str(args.scale), "--repeats", str(args.repeats), "--out", out]
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{source} упал:\n{proc.stderr[-3000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    times = result.pop("times")
+    result["cold_load_s"] = round(times[0], 4)
+    result["warm_load_s"] = round(statistics.median(times[1:]), 4) if len(times) > 1 else None
+    result["import_s"] = round(result["import_s"], 4)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=3, help="тёплых загрузок после холодной")
+    parser.add_argument("--scale", type=float, default=0.8)
+    parser.add_argument("--worker", choices=["snapshot", "bundle"], help=argparse.SUPPRESS)
+    parser.add_argument("--model-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--lora", help=argparse.SUPPRESS)
+    parser.add_argument("--store", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.model_dir, args.lora, args.store, args.scale, args.repeats, args.out)
+        return
+
+    import numpy as np
+
+    from benchmarks.tiny_sdxl import build_tiny_lora, build_tiny_sdxl
+    from model_store import ModelStore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = build_tiny_sdxl(os.path.join(tmp, "model"))
+        lora_path = build_tiny_lora(model_dir, os.path.join(tmp, "lora", "tiny_lora.safetensors"))
+        store_root = os.path.join(tmp, "store")
+
+        started = time.perf_counter()
+        ModelStore(root=store_root, cache_dir=None).build_bundle(model_dir, lora_path, args.scale, variant=None)
+        bundle_build_s = time.perf_counter() - started
+
+        results = {}
+        for source in ("snapshot", "bundle"):
+            results[source] = run_worker(source, args, model_dir, lora_path, store_root,
+                                         os.path.join(tmp, f"{source}.npy"))
+        diff = np.abs(np.load(os.path.join(tmp, "snapshot.npy")) - np.load(os.path.join(tmp, "bundle.npy")))
+
+    snapshot, bundle = results["snapshot"], results["bundle"]
+    print(json.dumps({
+        "bundle_build_s": round(bundle_build_s, 4),
+        "snapshot_with_lora": snapshot,
+        "bundle": bundle,
+        "cold_speedup": round(snapshot["cold_load_s"] / bundle["cold_load_s"], 2),
+        "warm_speedup": round(snapshot["warm_load_s"] / bundle["warm_load_s"], 2) if bundle["warm_load_s"] else None,
+        "max_abs_diff": float(diff.max()),
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
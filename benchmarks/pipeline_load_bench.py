@@ -0,0 +1,75 @@
+"""Сравнение: загрузка пайплайна на каждый вызов против PipelineManager
+
+Запуск: python -m benchmarks.pipeline_load_bench --iterations 5
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import torch
+
+from benchmarks.tiny_sdxl import build_tiny_sdxl
+from pipeline_manager import PIPELINE_CLASSES, PipelineManager
+
+
+def run_once(pipe, mode, steps):
+    kwargs = dict(
+        prompt="breakcore",
+        negative_prompt="blurry",
+        num_inference_steps=steps,
+        generator=torch.Generator(device="cpu").manual_seed(0),
+        output_type="np",
+    )
+    if mode == "img2img":
+        kwargs["image"] = torch.rand(1, 3, 64, 64)
+        kwargs["strength"] = 0.5
+    else:
+        kwargs["height"] = 64
+        kwargs["width"] = 64
+    pipe(**kwargs)
+
+
+def bench_cold(model_dir, modes, iterations, steps):
+    started = time.perf_counter()
+    for i in range(iterations):
+        mode = modes[i % len(modes)]
+        pipe = PIPELINE_CLASSES[mode].from_pretrained(model_dir, torch_dtype=torch.float32, use_safetensors=True)
+        run_once(pipe, mode, steps)
+        del pipe
+    return time.perf_counter() - started
+
+
+def bench_warm(model_dir, modes, iterations, steps):
+    manager = PipelineManager(model_id=model_dir, device="cpu", cache_dir=None, variant=None)
+    started = time.perf_counter()
+    for i in range(iterations):
+        mode = modes[i % len(modes)]
+        run_once(manager.get(mode, lora_path=None), mode, steps)
+    elapsed = time.perf_counter() - started
+    return elapsed, manager.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--steps", type=int, default=2)
+    parser.add_argument("--modes", nargs="+", default=["txt2img", "img2img"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = build_tiny_sdxl(tmp)
+        cold = bench_cold(model_dir, args.modes, args.iterations, args.steps)
+        warm, stats = bench_warm(model_dir, args.modes, args.iterations, args.steps)
+
+    print(json.dumps({
+        "iterations": args.iterations,
+        "reload_every_call_s": round(cold, 4),
+        "pipeline_manager_s": round(warm, 4),
+        "speedup": round(cold / warm, 2) if warm else None,
+        "manager": stats,
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Планировщики: задержка против похожести на эталон (планировщик модели, 40 шагов)
+
+Для каждого пресета SCHEDULERS (по умолчанию на рекомендуемом числе шагов)
+генерируется та же картинка с тем же seed и сравнивается с эталоном по SSIM
+и PSNR. На крошечной случайной модели это проверка сходимости, а не
+качества; для реальных цифр нужен --model. Пресет lcm требует --lcm-lora.
+Предковые (_a) планировщики добавляют шум на каждом шаге и с эталоном
+совпадают хуже по построению.
+
+Запуск: python -m benchmarks.scheduler_bench
+        python -m benchmarks.scheduler_bench --model stabilityai/stable-diffusion-xl-base-1.0 \\
+            --device cuda --size 1024 --steps 8 15 20 30 --lcm-lora lora_models/lcm_lora_sdxl.safetensors
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import diffusers
+import numpy as np
+import torch
+import transformers
+from numpy.lib.stride_tricks import sliding_window_view
+
+from benchmarks.tiny_sdxl import build_tiny_sdxl
+from config import NEGATIVE_PROMPT, TEST_PROMPT
+from pipeline_manager import PipelineManager
+from settings import SCHEDULERS
+
+REFERENCE_STEPS = 40
+
+
+def ssim(a: np.ndarray, b: np.ndarray, window: int = 7) -> float:
+    """SSIM по яркости с равномерным окном"""
+    a, b = a.mean(axis=-1), b.mean(axis=-1)
+    c1, c2 = 0.01 ** 2, 0.03 ** 2
+
+    def mean(x):
+        return sliding_window_view(x, (window, window)).mean(axis=(-1, -2))
+
+    mu_a, mu_b = mean(a), mean(b)
+    var_a = mean(a * a) - mu_a ** 2
+    var_b = mean(b * b) - mu_b ** 2
+    cov = mean(a * b) - mu_a * mu_b
+    s = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(s.mean())
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = float(np.mean((a - b) ** 2))
+    return float("inf") if mse == 0 else 10 * np.log10(1.0 / mse)
+
+
+def generate(manager: PipelineManager, scheduler: str, steps: int, guidance: float, size: int, repeat: int):
+    pipe = manager.get("txt2img", lora_path=None)
+    manager.set_scheduler(scheduler, lora_path=None)
+    times, image = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        image = pipe(
+            prompt=TEST_PROMPT, negative_prompt=NEGATIVE_PROMPT, height=size, width=size,
+            num_inference_steps=steps, guidance_scale=guidance, output_type="np",
+            generator=torch.Generator(device="cpu").manual_seed(0),
+        ).images[0]
+        times.append(time.perf_counter() - started)
+    return statistics.median(times), image
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="модель или папка; по умолчанию крошечный случайный SDXL")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--schedulers", nargs="+", default=list(SCHEDULERS))
+    parser.add_argument("--steps", nargs="+", type=int, help="вместо рекомендуемого числа шагов")
+    parser.add_argument("--lcm-lora", help="LoRA для пресета lcm")
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--json", dest="json_path", help="куда записать результаты")
+    args = parser.parse_args()
+
+    transformers.logging.set_verbosity_error()
+    diffusers.logging.set_verbosity_error()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.model:
+            manager = PipelineManager(model_id=args.model, device=args.device)
+        else:
+            model_dir = build_tiny_sdxl(os.path.join(tmp, "model"))
+            manager = PipelineManager(model_id=model_dir, device=args.device, cache_dir=None, variant=None)
+        manager.get("txt2img", lora_path=None)
+        manager.apply_memory("fast", lora_path=None)
+        lora = manager.lora(lora_path=None)
+
+        ref_s, reference = generate(manager, "default", REFERENCE_STEPS, SCHEDULERS["default"].guidance_scale,
+                                    args.size, args.repeat)
+        print(f"эталон default x {REFERENCE_STEPS}: {ref_s:.3f} с")
+        results = []
+        for name in args.schedulers:
+            preset = SCHEDULERS[name]
+            if preset.lora is not None:
+                if not args.lcm_lora:
+                    print(f"{name}: пропущен, нужна --lcm-lora")
+                    continue
+                lora.add(name, args.lcm_lora, scaled=False)
+                lora.prepare(1.0)
+            for steps in args.steps or [preset.steps]:
+                latency, image = generate(manager, name, steps, preset.guidance_scale, args.size, args.repeat)
+                row = {
+                    "scheduler": name,
+                    "steps": steps,
+                    "latency_s": round(latency, 4),
+                    "speedup": round(ref_s / latency, 2),
+                    "ssim": round(ssim(image, reference), 4),
+                    "psnr_db": round(psnr(image, reference), 2),
+                }
+                results.append(row)
+                print(f"{name} x {steps}: {latency:.3f} с (x{row['speedup']:.1f}), "
+                      f"SSIM {row['ssim']:.3f}, PSNR {row['psnr_db']:.1f} дБ")
+            if preset.lora is not None:
+                lora.set_weight(name, 0.0)
+                lora.prepare(1.0)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"reference_s": ref_s, "results": results}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Бенчмарк старта интерфейса: python -X importtime и время до первого ответа Gradio сервера
+
+Импорт interface.py не должен тянуть torch/diffusers/openai/selenium - они грузятся
+в фоне или при первом использовании. Бюджет --budget проверяет собственный вклад
+интерфейса сверх самого gradio: импорт gradio (с его fastapi/pydantic) стоит
+секунды на любой машине, и в бюджет его включить нельзя.
+
+Запуск: python -m benchmarks.startup_bench
+        python -m benchmarks.startup_bench --budget 0.5 --no-launch
+"""
+import argparse
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("torch", "diffusers", "transformers", "peft", "openai", "selenium", "bs4")
+IMPORTTIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def importtime(module: str) -> Dict[str, float]:
+    """Кумулятивное время импорта (с) прямых зависимостей module по выводу -X importtime
+
+    Под ключом module - полное время его импорта.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, env=dict(os.environ, GRADIO_ANALYTICS_ENABLED="False"),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} упал:\n{proc.stderr[-2000:]}")
+    # дочерние модули печатаются раньше родителя: копим их, пока не встретим сам module
+    children = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if match is None:
+            continue
+        _, cumulative, indent, name = match.groups()
+        seconds = int(cumulative) / 1e6
+        if len(indent) == 3:
+            children[name] = children.get(name, 0.0) + seconds
+        elif len(indent) == 1:
+            if name == module:
+                children[module] = seconds
+                return children
+            children = {}
+    raise RuntimeError(f"В выводе -X importtime нет {module}")
+
+
+def loaded_modules(module: str) -> set:
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    proc = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True,
+        env=dict(os.environ, GRADIO_ANALYTICS_ENABLED="False"),
+    )
+    return set(proc.stdout.split())
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_serve(timeout: float) -> float:
+    """Запускает python interface.py и ждёт первого HTTP 200 от Gradio"""
+    port = free_port()
+    env = dict(os.environ, GRADIO_SERVER_PORT=str(port), GRADIO_ANALYTICS_ENABLED="False")
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "interface.py"], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"interface.py завершился с кодом {proc.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as r:
+                    if r.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError(f"Gradio не ответил за {timeout:.0f} с")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=1.0, help="импорт interface сверх gradio, с")
+    parser.add_argument("--top", type=int, default=12)
+    parser.add_argument("--no-launch", action="store_true", help="не замерять время до ответа сервера")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    # прогрев: байткод и файловый кэш, иначе первый замер меряет диск
+    importtime("interface")
+    times = importtime("interface")
+    total_s = times.pop("interface")
+    gradio_s = times.get("gradio", 0.0)
+    own_s = total_s - gradio_s
+    print(f"import interface: {total_s:.2f} с, из них gradio {gradio_s:.2f} с, остальное {own_s:.2f} с")
+    for name, seconds in sorted(times.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {name}: {seconds * 1000:.0f} ms")
+
+    failures = []
+    heavy = sorted(m for m in HEAVY_MODULES if m in loaded_modules("interface"))
+    if heavy:
+        failures.append(f"при импорте interface загружены тяжёлые модули: {', '.join(heavy)}")
+    if own_s > args.budget:
+        failures.append(f"импорт сверх gradio {own_s:.2f} с больше бюджета {args.budget:.2f} с")
+
+    if not args.no_launch:
+        serve_s = time_to_serve(args.timeout)
+        print(f"Gradio отвечает через {serve_s:.2f} с после запуска python interface.py "
+              f"(gradio - {gradio_s / serve_s:.0%} этого времени)")
+
+    if failures:
+        for line in failures:
+            print(f"FAIL: {line}")
+        raise SystemExit(1)
+    print(f"OK: тяжёлые модули не импортируются, бюджет {args.budget:.2f} с соблюдён")
+
+
+if __name__ == "__main__":
+    main()
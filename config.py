@@ -1,19 +1,76 @@
 OUT_DIR = "pin_downloads" #аутпут пинтереста
 OUTPUT_DIR = "ready_img" #аутпут генератора
+INPUT_FOLDER = "input_folder"
 INPUT_PATH = "input_folder/input.png"
+INPUT_PREFETCH = 2 #сколько следующих исходников декодировать заранее
 READY_FOLDER = "ready_img"
+OUTPUT_FORMAT = "png" #png / webp / jpeg
+OUTPUT_QUALITY = 90 #качество для webp и jpeg
+PNG_COMPRESS_LEVEL = 6 #0-9, меньше - быстрее и больше файл
+WEBP_LOSSLESS = False
 CACHE_DIR = "huggingface_cache"
 LORA_PATH = "lora_models/breakcore_sdxl.safetensors"
+LORA_NAME = "breakcore"
+LCM_LORA_PATH = "lora_models/lcm_lora_sdxl.safetensors" #latent-consistency/lcm-lora-sdxl для пресета lcm
+FUSED_LORA_DIR = "lora_models/fused" #чекпоинты с вшитой LoRA
+PROMPT_CACHE_SIZE = 64 #сколько закодированных промптов держать в памяти
+LATENT_CACHE_MB = 256 #потолок памяти под закэшированные латенты VAE исходников img2img
+RESULT_CACHE_DIR = "result_cache" #готовые изображения по хэшу параметров генерации
+RESULT_CACHE_MB = 1024 #квота диска под кэш результатов; 0 - не кэшировать
+BATCH_MEMORY_PER_PIXEL = 2000 #активации UNet на пиксель одного изображения в батче (fp16), байт
+VAE_MEMORY_PER_PIXEL = 3000 #пик декода VAE на пиксель одного изображения (fp16), байт
+ATTENTION_SLICING_FACTOR = 0.6 #активации UNet с attention slicing без SDPA; с SDPA (torch 2) экономии нет
+MEMORY_HEADROOM = 0.9 #какую долю бюджета памяти можно занять по оценке
+DEVICE = "auto" #cpu / cuda / auto (cuda, если доступна)
+TRACE_PATH = "traces/trace.jsonl" #JSONL спанов по стадиям; None - не писать
+TRACE_MAX_MB = 64 #после этого размера трейс переезжает в .1 и пишется заново
+TRACE_WINDOW = 200 #по скольким последним спанам стадии считать p50/p95
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464 #эндпоинт /metrics для Prometheus; 0 - не поднимать
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8000
+SERVICE_URL = "http://127.0.0.1:8000" #куда ходит интерфейс; если там никто не отвечает - сервис поднимается внутри интерфейса
+SERVICE_START_TIMEOUT = 300 #сколько UI ждёт фоновый старт сервиса (импорт torch/diffusers)
+JOB_HISTORY = 100 #сколько завершённых задач (вместе с картинками) держать для скачивания
+BATCH_MAX_IMAGES = 8 #потолок изображений в одном склеенном вызове пайплайна
+BATCH_MAX_WAIT_S = 0.25 #сколько первая задача ждёт совместимых попутчиков
+MODEL_ID = "stabilityai/stable-diffusion-xl-base-1.0"
+MODEL_VARIANT = "fp16"
+MODEL_STORE_DIR = "model_store" #manifest.json закреплённых снапшотов и бандлы с вшитой LoRA
+MODEL_OFFLINE = True #грузить модели только с диска; скачать снапшот - python model_store.py pin
 
+OPENAI_MODEL = "gpt-4o-mini"
+OPENAI_MAX_RETRIES = 3
+PROMPT_POOL_SIZE = 8 #сколько промптов просить у LLM за один запрос
+PROMPT_POOL_LOW_WATER = 3 #ниже этого остатка пул пополняется в фоне
+PROMPT_POOL_CACHE = "prompt_pool.json" #неиспользованные промпты между перезапусками
+PROMPT_TOKEN_BUDGET = 75 #CLIP видит 77 токенов, 2 из них служебные
+PROMPT_DEDUPE_WINDOW = 200 #столько последних локальных промптов не повторяются
 
 NEGATIVE_PROMPT = "blurry, low quality, distorted, ugly"
 
+ESSENTIAL_TAGS = [
+    "glitch art", "datamosh", "chromatic aberration",
+    "high contrast", "neon colors", "digital corruption"
+]
+
 USER_AGENT = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
     "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
 )
 
 PINIMG_HOSTS = ("i.pinimg.com", "s.pinimg.com", "v.pinimg.com")
+MIN_HTTP_PINS = 5 #меньше пинов в __PWS_DATA__ из простого GET - идём через Selenium
+DRIVER_POOL_SIZE = 1 #сколько Chrome держать запущенными
+DRIVER_MAX_PAGES = 20 #после стольких страниц драйвер перезапускается
+BULK_MAX_WORKERS = 8 #параллельных загрузок в массовом режиме
+BULK_RATE_PER_HOST = 10.0 #запросов в секунду на один хост
+BULK_MAX_RETRIES = 3 #повторов на 429/5xx/обрыв соединения
+PIN_VARIANT_WIDTHS = (236, 474, 564, 736) #ширины размеров pinimg, больше - только /originals/
+BULK_LIMIT = 200 #сколько пинов качать за раз по умолчанию
+DOWNLOAD_INDEX_NAME = "index.sqlite3" #индекс скачанных пинов внутри OUT_DIR
+DEDUP_MAX_DISTANCE = 6 #dHash расстояние (из 64 бит), до которого картинки считаются одинаковыми
+DEDUP_MIN_CONTRAST = 12 #СКО яркости миниатюры, ниже которого dHash не сравнивается (однотонные картинки дают один хэш)
 
 
 TEST_OUTPUT = "test_results"
@@ -1,112 +1,315 @@
 import os
-from diffusers import StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline
+import random
+import threading
+import time
 import torch
 from PIL import Image
-from huggingface_hub import login
-from datetime import datetime
-from dataclasses import dataclass
-from typing import Optional
-from dotenv import load_dotenv
-
-from config import LORA_PATH, CACHE_DIR, INPUT_PATH, OUTPUT_DIR
-
-load_dotenv()
-api_key = os.getenv("HUGGINGFACE_TOKEN")
-login(token=api_key)
-
-@dataclass
-class Settings:    
-    height: int = 512
-    width: int = 512
-    num_inference_steps: int = 40
-    guidance_scale: float = 7.5
-    strength: float = 0.3
-    lora_scale: float = 0.8
+from typing import Callable, List, Optional, Tuple
+
+from config import INPUT_PATH, OUTPUT_DIR, LORA_PATH, NEGATIVE_PROMPT
+from input_queue import REDUCING_GAP, load_resized
+from lora_manager import fused_checkpoint_path
+from memory_policy import MemoryPlan, plan_memory, resident_bytes, weight_bytes
+from pipeline_manager import PipelineManager
+from prompt_cache import PromptEmbeddingCache
+from latent_cache import LatentCache, image_digest
+from output_writer import OutputWriter
+from result_cache import ResultCache
+from settings import SCHEDULERS, GenerationCancelled, Settings
+from tracing import tracer
+
+def available_memory(device: str) -> Optional[int]:
+    """Свободная память устройства в байтах (None, если узнать нельзя)"""
+    if device.startswith("cuda") and torch.cuda.is_available():
+        free, _ = torch.cuda.mem_get_info(torch.device(device))
+        return free
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+class StepTimer:
+    """Колбэк шагов пайплайна: делит вызов на денойзинг и декод VAE для трейса,
+    сообщает прогресс и прерывает денойзинг, если выставлен cancel"""
+
+    def __init__(self, device: str, cancel: Optional[threading.Event] = None,
+                 progress: Optional[Callable[[float], None]] = None):
+        self.device = device
+        self.cancel = cancel
+        self.progress = progress
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.last_step = None
+        self.steps = 0
+
+    def __call__(self, pipeline, step, timestep, callback_kwargs):
+        self.steps = step + 1
+        if self.cancel is not None and self.cancel.is_set():
+            pipeline._interrupt = True
+        if self.progress is not None:
+            self.progress(self.steps / pipeline.num_timesteps)
+        if step == pipeline.num_timesteps - 1:
+            if self.device.startswith("cuda"):
+                torch.cuda.synchronize()
+            self.last_step = time.perf_counter()
+        return callback_kwargs
+
+    def finish(self, **attrs):
+        ended = time.perf_counter()
+        last_step = self.last_step or ended
+        tracer.record("denoise", last_step - self.started, started_at=self.started_at, steps=self.steps, **attrs)
+        tracer.record("decode", ended - last_step, started_at=self.started_at + last_step - self.started, **attrs)
 
 class BreakcoreGenerator:
-    def __init__(self, settings: Optional[Settings] = None):
+    def __init__(self, settings: Optional[Settings] = None, pipelines: Optional[PipelineManager] = None,
+                 lora_path: Optional[str] = LORA_PATH):
         if settings is None:
             settings = Settings()
+        if pipelines is None:
+            pipelines = PipelineManager()
         
         self.settings = settings
+        self.pipelines = pipelines
+        self.lora_path = lora_path  # стилевая LoRA; None - без неё
+        self.prompt_cache = PromptEmbeddingCache()
+        self.latent_cache = LatentCache()
+        self.result_cache = ResultCache()
         self.output_dir = OUTPUT_DIR
+        self.writer = OutputWriter(self.output_dir)
+        self._weight_sizes = {}
+        self._seed_rng = random.Random()
 
-    def generate_text2img(self, prompt, neg_prompt):
-        
-        pipe = StableDiffusionXLPipeline.from_pretrained(
-            "stabilityai/stable-diffusion-xl-base-1.0",
-            torch_dtype=torch.float16,
-            use_safetensors=True,
-            cache_dir=CACHE_DIR,
-            variant="fp16"
-        ).to("cuda")
-        
-        pipe.safety_checker = None
-        pipe.load_lora_weights(LORA_PATH)
-        
-        seed = torch.seed()
-        generator = torch.Generator(device="cuda").manual_seed(seed)
-        
-        result = pipe(
-            prompt=prompt,
-            negative_prompt=neg_prompt,
-            height=self.settings.height,
-            width=self.settings.width,
-            num_inference_steps=self.settings.num_inference_steps,
-            guidance_scale=self.settings.guidance_scale,
-            generator=generator,
-            cross_attention_kwargs={"scale": self.settings.lora_scale}
+    def apply_lora(self, settings: Optional[Settings] = None):
+        """Выставляет масштаб LoRA на тёплом пайплайне без перезагрузки весов"""
+        settings = settings or self.settings
+        lora = self.pipelines.lora(self.lora_path)
+        if lora is None:
+            return
+        # служебные LoRA пресетов планировщика (LCM) включены только со своим планировщиком
+        for name, preset in SCHEDULERS.items():
+            if preset.lora is None:
+                continue
+            if name == settings.scheduler:
+                if not os.path.exists(preset.lora):
+                    raise FileNotFoundError(f"Для планировщика {name} нужна LoRA {preset.lora}")
+                lora.add(name, preset.lora, scaled=False)
+            elif name in lora.adapters:
+                lora.set_weight(name, 0.0)
+        lora.prepare(settings.lora_scale, fuse=settings.fuse_lora)
+
+    def export_fused_lora(self, path: Optional[str] = None) -> str:
+        """Сохраняет чекпоинт с LoRA, вшитой при текущем lora_scale"""
+        self.pipelines.get("txt2img", self.lora_path)
+        if path is None:
+            path = fused_checkpoint_path(self.pipelines.model_id, self.lora_path)
+        return self.pipelines.lora(self.lora_path).export_fused(path, self.settings.lora_scale)
+
+    def seeds(self, seed: Optional[int], count: int) -> List[int]:
+        """seed, seed + 1, ... для count изображений; без seed первый выбирается случайно"""
+        if seed is None:
+            seed = self._seed_rng.randrange(2**32)
+        return [seed + i for i in range(count)]
+
+    def memory_plan(self, pipe, settings: Optional[Settings] = None, n_images: int = 1) -> MemoryPlan:
+        """Режим памяти и батч для n_images при текущем разрешении (settings.memory_mode)
+
+        Бюджет - settings.memory_budget_mb или свободная память устройства
+        плюс веса пайплайна, которые уже на нём лежат.
+        """
+        settings = settings or self.settings
+        device = self.pipelines.device
+        vae_key = self.pipelines.vae_identity(self.lora_path)
+        sizes = self._weight_sizes.get(vae_key)
+        if sizes is None:
+            sizes = self._weight_sizes[vae_key] = weight_bytes(pipe)
+        budget = settings.memory_budget_mb * 2**20 or None
+        if budget is None:
+            free = available_memory(device)
+            if free is not None:
+                budget = free + resident_bytes(pipe, sizes, device)
+        dtype_bytes = next(pipe.unet.parameters()).element_size()
+        sdpa = hasattr(torch.nn.functional, "scaled_dot_product_attention")
+        return plan_memory(sizes, settings, device, n_images, budget, dtype_bytes, pipe.vae.tile_sample_min_size, sdpa)
+
+    def generate_batch(self, prompts, neg_prompts=None, n_per_prompt: int = 1, mode: str = "txt2img",
+                       init_image: Optional[Image.Image] = None, save: bool = True,
+                       settings: Optional[Settings] = None, cancel: Optional[threading.Event] = None,
+                       progress: Optional[Callable[[float], None]] = None,
+                       seeds: Optional[List[int]] = None) -> List[Image.Image]:
+        """Генерирует n_per_prompt изображений на каждый промпт батчами за один проход UNet
+
+        init_image - исходник для img2img; если не задан, читается INPUT_PATH.
+        Список исходников задаёт свой исходник каждому промпту (так
+        планировщик склеивает задачи с разными картинками в один батч).
+        save=False оставляет сохранение вызывающему (например, фоновой стадии).
+        settings - параметры этого вызова (по умолчанию self.settings), так что
+        параллельные клиенты не перетирают настройки друг друга.
+        cancel прерывает денойзинг на ближайшем шаге (GenerationCancelled),
+        progress получает долю выполненной работы от 0 до 1.
+        seeds - seed каждого изображения (по умолчанию от settings.seed), он же
+        лежит в image.info["seed"]. Изображение с теми же параметрами и seed
+        отдаётся из кэша результатов без вызова пайплайна.
+        """
+        settings = settings or self.settings
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        if neg_prompts is None:
+            neg_prompts = NEGATIVE_PROMPT
+        if isinstance(neg_prompts, str):
+            neg_prompts = [neg_prompts] * len(prompts)
+        if len(neg_prompts) != len(prompts):
+            raise ValueError("Количество негативных промптов не совпадает с количеством промптов")
+        if isinstance(init_image, list) and len(init_image) != len(prompts):
+            raise ValueError("Количество исходников не совпадает с количеством промптов")
+        if seeds is None:
+            seeds = self.seeds(settings.seed, len(prompts) * n_per_prompt)
+        if len(seeds) != len(prompts) * n_per_prompt:
+            raise ValueError("Количество seed не совпадает с количеством изображений")
+
+        with tracer.span("generate", gpu=True, mode=mode) as span:
+            images, rendered = self._generate(prompts, neg_prompts, n_per_prompt, mode, init_image, settings, seeds,
+                                              cancel, progress)
+            span["images"] = len(images)
+
+        if save:
+            # попадания в кэш результатов уже сохранены, когда их сгенерировали впервые
+            self.save_images(rendered, mode)
+        return images
+
+    def _generate(self, prompts, neg_prompts, n_per_prompt: int, mode: str, init_image,
+                  settings: Settings, seeds: List[int], cancel: Optional[threading.Event],
+                  progress: Optional[Callable[[float], None]]) -> Tuple[List[Image.Image], List[Image.Image]]:
+        """Возвращает (все изображения по порядку, только что сгенерированные из них)"""
+        sources = [None] * len(prompts)
+        if mode == "img2img":
+            if init_image is None:
+                init_image = load_resized(INPUT_PATH, (settings.width, settings.height))
+                print(f"Загружено входное изображение: {INPUT_PATH}")
+            if isinstance(init_image, list):
+                prepared = {id(image): self.prepare_init_image(image, settings) for image in init_image}
+                sources = [prepared[id(image)] for image in init_image]
+            else:
+                sources = [self.prepare_init_image(init_image, settings)] * len(prompts)
+        jobs = [(p, n, s) for p, n, s in zip(prompts, neg_prompts, sources) for _ in range(n_per_prompt)]
+
+        # кэш результатов проверяется до загрузки пайплайна: попадание отдаётся сразу
+        with tracer.span("result_cache", images=len(jobs)) as span:
+            identity = self.pipelines.content_identity(self.lora_path)
+            digests = {id(s): image_digest(s) for s in sources if s is not None}
+            keys = [
+                self.result_cache.key(mode, p, n, settings, seed, digests.get(id(s)), identity)
+                for (p, n, s), seed in zip(jobs, seeds)
+            ]
+            images = [self.result_cache.get(key) for key in keys]
+            todo = [i for i, image in enumerate(images) if image is None]
+            span["hits"] = len(jobs) - len(todo)
+        if not todo:
+            print(f"Все {len(jobs)} изображений взяты из кэша результатов")
+            return images, []
+
+        rendered = self._render([jobs[i] for i in todo], [seeds[i] for i in todo], mode, settings, cancel, progress)
+        for i, image in zip(todo, rendered):
+            images[i] = image
+            self.result_cache.put(keys[i], image)
+        return images, rendered
+
+    def _render(self, jobs, seeds: List[int], mode: str, settings: Settings, cancel: Optional[threading.Event],
+                progress: Optional[Callable[[float], None]]) -> List[Image.Image]:
+        pipe = self.pipelines.get(mode, self.lora_path)
+        plan = self.memory_plan(pipe, settings, len(jobs))
+        self.pipelines.apply_memory(plan.mode, self.lora_path)
+        self.pipelines.set_scheduler(settings.scheduler, self.lora_path)
+        self.apply_lora(settings)
+
+        kwargs = dict(
+            num_inference_steps=settings.num_inference_steps,
+            guidance_scale=settings.guidance_scale,
         )
-        
-        del pipe
-        torch.cuda.empty_cache()
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = os.path.join(self.output_dir, f"txt2img{timestamp}.png")
-        result.images[0].save(filename)
-        print(f"Сохранено: {filename}\n")
-        
-        return result.images[0]
+        if mode == "img2img":
+            kwargs["strength"] = settings.strength
+        else:
+            kwargs["height"] = settings.height
+            kwargs["width"] = settings.width
+
+        batch_size = plan.batch_size
+        chunks = (len(jobs) + batch_size - 1) // batch_size
+        budget = f"{plan.budget_bytes / 2**20:.0f} MB" if plan.budget_bytes else "неизвестен"
+        print(
+            f"Генерация {mode}: {len(jobs)} изображений, батч {batch_size}, память {plan.mode} "
+            f"(оценка пика {plan.peak_bytes / 2**20:.0f} MB, бюджет {budget})"
+        )
+
+        images = []
+        started = time.perf_counter()
+        for start in range(0, len(jobs), batch_size):
+            chunk = jobs[start:start + batch_size]
+            chunk_seeds = seeds[start:start + batch_size]
+            # свой генератор на изображение: картинка зависит только от своего seed, а не от соседей по батчу
+            generators = [torch.Generator(device=self.pipelines.device).manual_seed(seed) for seed in chunk_seeds]
+            with tracer.span("encode", gpu=True, prompts=len(chunk)):
+                embeds = self.prompt_cache.encode_batch(
+                    pipe, [p for p, _, _ in chunk], [n for _, n, _ in chunk], self.pipelines.identity(self.lora_path),
+                    cfg=settings.guidance_scale > 1,
+                )
+            call_kwargs = dict(kwargs)
+            if mode == "img2img":
+                # латенты исходника из кэша вместо повторного прохода VAE энкодера
+                chunk_sources = [s for _, _, s in chunk]
+                vae_key, dtype = self.pipelines.vae_identity(self.lora_path), embeds["prompt_embeds"].dtype
+                with tracer.span("vae_encode", gpu=True, sources=len(set(map(id, chunk_sources)))):
+                    if all(s is chunk_sources[0] for s in chunk_sources):
+                        # один исходник на весь батч: одно обращение к кэшу, шум от каждого генератора
+                        call_kwargs["image"] = self.latent_cache.init_latents(
+                            pipe, chunk_sources[0], generators, vae_key, dtype
+                        )
+                    else:
+                        call_kwargs["image"] = torch.cat([
+                            self.latent_cache.init_latents(pipe, source, generator, vae_key, dtype)
+                            for source, generator in zip(chunk_sources, generators)
+                        ])
+            if cancel is not None and cancel.is_set():
+                raise GenerationCancelled()
+            chunk_progress = None
+            if progress is not None:
+                done = start // batch_size
+                chunk_progress = lambda fraction, done=done: progress((done + fraction) / chunks)
+            timer = StepTimer(self.pipelines.device, cancel, chunk_progress)
+            result = pipe(
+                generator=generators,
+                callback_on_step_end=timer,
+                **embeds,
+                **call_kwargs
+            )
+            timer.finish(batch=len(chunk), memory=plan.mode, scheduler=settings.scheduler)
+            if cancel is not None and cancel.is_set():
+                # прерванный денойзинг всё равно декодируется - такие картинки не отдаём
+                raise GenerationCancelled()
+            for image, seed in zip(result.images, chunk_seeds):
+                image.info["seed"] = seed
+            images.extend(result.images)
+        elapsed = time.perf_counter() - started
+        print(f"Сгенерировано {len(images)} за {elapsed:.2f} с ({len(images) / elapsed:.2f} изобр/с)")
+        return images
+
+    def prepare_init_image(self, image: Image.Image, settings: Optional[Settings] = None) -> Image.Image:
+        settings = settings or self.settings
+        size = (settings.width, settings.height)
+        # Image.open ленив: без load() подходящая по размеру картинка вернулась бы
+        # непрочитанной и сломалась бы после закрытия файла в with у вызывающего
+        image.load()
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if image.size != size:
+            image = image.resize(size, Image.BICUBIC, reducing_gap=REDUCING_GAP)
+        return image
+
+    def save_images(self, images, mode: str) -> List[str]:
+        """Отдаёт изображения фоновому писателю, возвращает пути файлов"""
+        return [self.writer.submit(image, mode) for image in images]
+
+    def generate_text2img(self, prompt, neg_prompt):
+        return self.generate_batch([prompt], [neg_prompt], mode="txt2img")[0]
         
     def generate(self, prompt, neg_prompt):
-        
-        pipe = StableDiffusionXLImg2ImgPipeline.from_pretrained(
-            "stabilityai/stable-diffusion-xl-base-1.0",
-            torch_dtype=torch.float16,
-            use_safetensors=True,
-            cache_dir=CACHE_DIR,
-            variant="fp16"
-        ).to("cuda")
-        
-        pipe.safety_checker = None
-        pipe.load_lora_weights(LORA_PATH)
-        
-        init_image = Image.open(INPUT_PATH).convert("RGB").resize((self.settings.width, self.settings.height))
-        print(f"Загружено входное изображение: {INPUT_PATH}")
-        
-        seed = torch.seed()
-        generator = torch.Generator(device="cuda").manual_seed(seed)
-        
         print(f"Prompt: {prompt}")
-        print("Генерация img2img...")
-        
-        result = pipe(
-            prompt=prompt,
-            image=init_image,
-            negative_prompt=neg_prompt,
-            strength=self.settings.strength,
-            num_inference_steps=self.settings.num_inference_steps,
-            guidance_scale=self.settings.guidance_scale,
-            generator=generator,
-            cross_attention_kwargs={"scale": self.settings.lora_scale}
-        )
-        
-        del pipe
-        torch.cuda.empty_cache()
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = os.path.join(self.output_dir, f"img2img{timestamp}.png")
-        result.images[0].save(filename)
-        print(f"Сохранено: {filename}\n")
-        
-        return result.images[0]
\ No newline at end of file
+        return self.generate_batch([prompt], [neg_prompt], mode="img2img")[0]
@@ -0,0 +1,176 @@
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from config import OUT_DIR, INPUT_PREFETCH
+from parsers.download_index import shared_index
+from tracing import tracer
+
+# resize сначала уменьшает целочисленным reduce(), пока картинка больше цели в reducing_gap раз
+REDUCING_GAP = 2.0
+POLL_INTERVAL = 2.0
+
+Size = Tuple[int, int]
+
+
+def load_resized(src, size: Size) -> Image.Image:
+    """Декодирует сразу под размер генерации: JPEG draft (масштаб в DCT) и reduce перед resize"""
+    with Image.open(src) as img:
+        img.draft("RGB", size)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if img.size != size:
+            return img.resize(size, Image.BICUBIC, reducing_gap=REDUCING_GAP)
+        return img.copy()
+
+
+@dataclass
+class InputImage:
+    path: str
+    size: Size
+    image: Image.Image
+    source: str  # "pin" или "upload"
+
+
+class InputQueue:
+    """Очередь исходников img2img прямо из папки загрузок, без input.png
+
+    Следующие prefetch пинов берутся из DownloadIndex и декодируются в фоне
+    сразу в размер генерации. Текущий пин помечается использованным, а его
+    файл удаляется, когда исходником становится следующий.
+    """
+
+    def __init__(self, folder: str = OUT_DIR, size: Size = (512, 512), prefetch: int = INPUT_PREFETCH,
+                 delete_used: bool = True):
+        self.index = shared_index(folder)
+        self.size = size
+        self.delete_used = delete_used
+        self.current: Optional[InputImage] = None
+        self._ready = queue.Queue(maxsize=max(1, prefetch))
+        self._claimed = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.served = 0
+        self.prefetch_hits = 0
+        self.decoded = 0
+        self.decode_s = 0.0
+        self.redecoded = 0
+        self._thread = threading.Thread(target=self._run, name="input-prefetch", daemon=True)
+        self._thread.start()
+
+    def set_size(self, size: Size):
+        self.size = (int(size[0]), int(size[1]))
+
+    def advance(self) -> Optional[InputImage]:
+        """Делает текущим следующий пин; None, если новых картинок нет"""
+        with tracer.span("source_move") as span:
+            try:
+                item = self._ready.get_nowait()
+                self.prefetch_hits += 1
+                span["prefetched"] = True
+            except queue.Empty:
+                path = self._claim()
+                if path is None:
+                    return None
+                item = self._load(path, "pin")
+            if item.size != self.size:
+                item = self._resized(item, self.size)
+            self._set_current(item)
+        return item
+
+    def push_upload(self, path: str) -> InputImage:
+        """Загруженный пользователем файл сразу становится текущим исходником"""
+        item = self._load(path, "upload")
+        self._set_current(item)
+        return item
+
+    def current_image(self, size: Optional[Size] = None) -> Optional[Image.Image]:
+        """Текущий исходник в размере size (по умолчанию - текущий размер очереди)"""
+        item = self.current
+        if item is None:
+            return None
+        size = size or self.size
+        if item.size != size:
+            item = self._resized(item, size)
+            self.current = item
+        return item.image
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=5)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self._ready.qsize(),
+            "served": self.served,
+            "prefetch_hits": self.prefetch_hits,
+            "decoded": self.decoded,
+            "redecoded": self.redecoded,
+            "avg_decode_s": self.decode_s / self.decoded if self.decoded else 0.0,
+        }
+
+    def _set_current(self, item: InputImage):
+        previous = self.current
+        self.current = item
+        if item.source == "pin":
+            self.index.mark_used(item.path)
+            with self._lock:
+                self._claimed.discard(item.path)
+        if (previous is not None and previous.source == "pin" and self.delete_used
+                and previous.path != item.path and os.path.exists(previous.path)):
+            os.remove(previous.path)
+        self.served += 1
+        self._wake.set()
+
+    def _claim(self) -> Optional[str]:
+        with self._lock:
+            path = self.index.next_unused(exclude=self._claimed)
+            if path is not None:
+                self._claimed.add(path)
+        return path
+
+    def _load(self, path: str, source: str, size: Optional[Size] = None) -> InputImage:
+        size = size or self.size
+        started = time.perf_counter()
+        with tracer.span("source_decode", source=source):
+            image = load_resized(path, size)
+        self.decode_s += time.perf_counter() - started
+        self.decoded += 1
+        return InputImage(path=path, size=size, image=image, source=source)
+
+    def _resized(self, item: InputImage, size: Size) -> InputImage:
+        # размер поменяли после предзагрузки - декодируем заново из файла
+        self.redecoded += 1
+        try:
+            return self._load(item.path, item.source, size)
+        except OSError:
+            image = item.image.resize(size, Image.BICUBIC)
+            return InputImage(path=item.path, size=size, image=image, source=item.source)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._ready.full():
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            path = self._claim()
+            if path is None:
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            try:
+                item = self._load(path, "pin")
+            except OSError as e:
+                print(f"Не удалось декодировать {path}: {e}")
+                self.index.mark_used(path)
+                with self._lock:
+                    self._claimed.discard(path)
+                continue
+            self._ready.put(item)
@@ -2,47 +2,111 @@ import gradio as gr
 import os
 import subprocess
 import platform
-from imggenerator import BreakcoreGenerator, Settings
-from parsers.pinterest import PinterestDownloader, Options
-from pin_to_input import ImageMover
+import threading
+import time
+from settings import MEMORY_MODES, SCHEDULERS, GenerationCancelled, Settings
+from input_queue import InputQueue
 from pompt_generator import PromptGenerator
+from local_prompt_generator import LocalPromptGenerator
+from prompt_pool import PromptPool
+from staged_pipeline import StagedGenerationLoop
+from tracing import tracer, serve_metrics
+from service_client import ServiceClient
 
-from config import NEGATIVE_PROMPT, OUT_DIR, INPUT_PATH, READY_FOLDER
+from config import NEGATIVE_PROMPT, OUT_DIR, READY_FOLDER, BULK_LIMIT, SERVICE_URL, SERVICE_START_TIMEOUT, OUTPUT_FORMAT, OUTPUT_QUALITY
 
 
-settings = Settings(
-    height=512,
-    width=512,
-    num_inference_steps=40,
-    guidance_scale=7.5,
-    strength=0.3,
-    lora_scale=0.8
-)
+client = ServiceClient(SERVICE_URL)
+service_ready = threading.Event()
+service_error = None
+service_thread = None
+service_lock = threading.Lock()
 
-processor = BreakcoreGenerator(settings)
-mover = ImageMover()
-prompt_gen = PromptGenerator()
+def start_service(timeout: float = SERVICE_START_TIMEOUT):
+    """Подключается к сервису генерации, а если по SERVICE_URL никто не отвечает - поднимает его в этом процессе.
+    Запускается в фоне: torch и diffusers импортируются, пока UI уже открыт"""
+    global service_error
+    try:
+        if client.available():
+            print(f"Подключено к сервису генерации: {SERVICE_URL}")
+            return
+        from api import serve_in_thread
+        serve_in_thread()
+        deadline = time.perf_counter() + timeout
+        while not client.available():
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"Сервис генерации не поднялся: {SERVICE_URL}")
+            time.sleep(0.2)
+        print(f"Сервис генерации запущен внутри интерфейса: {SERVICE_URL}")
+    except Exception as e:
+        service_error = e
+        print(f"Сервис генерации недоступен: {e}")
+    finally:
+        service_ready.set()
+
+def warm_up_service():
+    """Запускает start_service в фоновом потоке (один раз)"""
+    global service_thread
+    with service_lock:
+        if service_thread is None:
+            service_thread = threading.Thread(target=start_service, name="service-start", daemon=True)
+            service_thread.start()
+
+def service() -> ServiceClient:
+    """Клиент сервиса; при первом обращении дожидается фонового старта"""
+    warm_up_service()
+    if not service_ready.wait(SERVICE_START_TIMEOUT):
+        raise RuntimeError("Сервис генерации ещё запускается")
+    if service_error is not None:
+        raise RuntimeError(f"Сервис генерации недоступен: {service_error}")
+    return client
+
+inputs = None
+inputs_lock = threading.Lock()
+
+def input_queue() -> InputQueue:
+    """Очередь исходников; индекс загрузок и фоновая подгрузка создаются при первом обращении"""
+    global inputs
+    with inputs_lock:
+        if inputs is None:
+            inputs = InputQueue(OUT_DIR, size=(512, 512))
+        return inputs
+
+prompt_generators = {
+    "OpenAI": PromptPool(PromptGenerator()),
+    "Локальный": LocalPromptGenerator()
+}
 
 def get_current_image():
     """Получить текущее изображение для отображения"""
-    if os.path.exists(INPUT_PATH):
-        return INPUT_PATH
+    current = input_queue().current
+    if current is not None and os.path.exists(current.path):
+        return current.path
     return None
 
-def move_image_action(url):
+def move_image_action(url, height, width):
     """Переместить изображение и вернуть следующее"""
-    options = Options(url=url, out_dir=OUT_DIR)
+    from parsers.pinterest import PinterestDownloader, Options
+    options = Options(url=url, out_dir=OUT_DIR, target_size=(int(width), int(height)))
     downloader = PinterestDownloader(options)
     exit_code = downloader.run()
     print(f"Загрузка завершена, код: {exit_code}")
-    mover.move_first_image()
+    input_queue().set_size((width, height))
+    input_queue().advance()
     return get_current_image()
 
+def bulk_download_action(url, height, width, limit):
+    """Скачать сразу много пинов в папку загрузок"""
+    from parsers.pinterest import PinterestDownloader, Options
+    options = Options(url=url, out_dir=OUT_DIR, target_size=(int(width), int(height)))
+    downloader = PinterestDownloader(options)
+    result = downloader.run_bulk(limit=int(limit))
+    return result.summary()
+
 def upload_user_image(image_file):
     """Загрузить пользовательское изображение"""
     if image_file is not None:
-        with open(image_file, "rb") as f:
-            mover.move_user_image(f)
+        input_queue().push_upload(image_file)
         print("Пользовательское изображение загружено")
         return get_current_image()
     return None
@@ -78,62 +142,146 @@ def update_mode_visibility(mode):
         upload_btn: gr.update(visible=is_img2img)
     }
 
-def run_pipeline(mode, url, height, width, steps, guidance, strength, lora_scale, use_custom_prompt, custom_prompt, use_custom_negative, custom_negative):
-    """Основной цикл загрузки и генерации"""
-    
-    custom_settings = Settings(
+def build_settings(height, width, steps, guidance, strength, lora_scale, fuse_lora, memory_mode, scheduler, seed):
+    return Settings(
         height=height,
         width=width,
         num_inference_steps=steps,
         guidance_scale=guidance,
         strength=strength,
-        lora_scale=lora_scale
+        lora_scale=lora_scale,
+        fuse_lora=fuse_lora,
+        memory_mode=memory_mode,
+        scheduler=scheduler,
+        seed=None if seed is None else int(seed)
     )
-    processor.settings = custom_settings
 
+def with_seeds(images):
+    """Подписи галереи: seed каждого изображения, чтобы его можно было повторить"""
+    return [(image, f"seed {image.info.get('seed')}") for image in images]
+
+def apply_scheduler_preset(scheduler):
+    """Рекомендуемые шаги и guidance для выбранного планировщика"""
+    preset = SCHEDULERS[scheduler]
+    return gr.update(value=preset.steps), gr.update(value=preset.guidance_scale)
+
+def choose_prompt(use_custom_prompt, custom_prompt, prompt_engine):
     if use_custom_prompt and custom_prompt.strip():
-        prompt = custom_prompt.strip()
-    else:
-        prompt = prompt_gen.generate_prompt()
+        return custom_prompt.strip()
+    with tracer.span("prompt", engine=prompt_engine):
+        return prompt_generators[prompt_engine].generate_prompt()
 
+def choose_negative(use_custom_negative, custom_negative):
     if use_custom_negative and custom_negative.strip():
-        negative_prompt = custom_negative.strip()
-    else:
-        negative_prompt = NEGATIVE_PROMPT
-    
-    print(f"Промпт: {prompt}")
-    print(f"Негативный промпт: {negative_prompt}")
+        return custom_negative.strip()
+    return NEGATIVE_PROMPT
+
+def acquire_source(url, fresh, size):
+    """Исходник для img2img: новый пин с Pinterest или текущий из очереди, уже в размере генерации"""
+    if fresh:
+        move_image_action(url, size[1], size[0])
+    image = input_queue().current_image(size)
+    if image is None:
+        raise ValueError("Нет исходного изображения: скачайте пин или загрузите своё")
+    return image
+
+def run_pipeline(mode, url, height, width, steps, guidance, strength, lora_scale, fuse_lora, memory_mode, scheduler, seed, n_images, use_custom_prompt, custom_prompt, prompt_engine, use_custom_negative, custom_negative, request: gr.Request):
+    """Основной цикл загрузки и генерации, возвращает список изображений"""
     
-    if mode == "img2img":
-        
-        result_image = processor.generate(prompt, negative_prompt)
-    else:
-        result_image = processor.generate_text2img(prompt, negative_prompt)
+    settings = build_settings(height, width, steps, guidance, strength, lora_scale, fuse_lora, memory_mode, scheduler, seed)
+
+    with tracer.span("run_pipeline", mode=mode):
+        prompt = choose_prompt(use_custom_prompt, custom_prompt, prompt_engine)
+        negative_prompt = choose_negative(use_custom_negative, custom_negative)
+
+        print(f"Промпт: {prompt}")
+        print(f"Негативный промпт: {negative_prompt}")
+
+        init_image = acquire_source(url, False, (int(width), int(height))) if mode == "img2img" else None
+        result_images = service().generate(
+            [prompt], [negative_prompt], settings, mode=mode, n_per_prompt=int(n_images), init_image=init_image,
+            owner=request.session_hash
+        )
     
     print(f"Готово")
     
-    return result_image
+    return with_seeds(result_images)
 
-def start_infinite_generation(mode, url, height, width, steps, guidance, strength, lora_scale, use_custom_prompt, custom_prompt, use_custom_negative, custom_negative):
-    """Запустить бесконечную генерацию"""
+def start_infinite_generation(mode, url, height, width, steps, guidance, strength, lora_scale, fuse_lora, memory_mode, scheduler, seed, n_images, use_custom_prompt, custom_prompt, prompt_engine, use_custom_negative, custom_negative, fresh_source, queue_depth, request: gr.Request):
+    """Запустить бесконечную генерацию: промпты и исходники готовятся в фоне, сохранение тоже (OutputWriter)"""
+    
+    settings = build_settings(height, width, steps, guidance, strength, lora_scale, fuse_lora, memory_mode, scheduler, seed)
+    negative_prompt = choose_negative(use_custom_negative, custom_negative)
+    size = (int(width), int(height))
+
+    loop = StagedGenerationLoop(
+        prompt_fn=lambda: choose_prompt(use_custom_prompt, custom_prompt, prompt_engine),
+        source_fn=(lambda: acquire_source(url, fresh_source, size)) if mode == "img2img" else None,
+        depth=int(queue_depth)
+    )
     
     generation_count = 0
+    image_count = 0
     
-    while True:
-        generation_count += 1
-        print(f"\n{'='*50}")
-        print(f"Генерация #{generation_count}")
-        print(f"{'='*50}\n")
-
-        result_image = run_pipeline(
-            mode, url, height, width, steps, guidance, strength, lora_scale,
-            use_custom_prompt, custom_prompt, use_custom_negative, custom_negative
-        )
+    try:
+        while True:
+            generation_count += 1
+            print(f"\n{'='*50}")
+            print(f"Генерация #{generation_count}")
+            print(f"{'='*50}\n")
+
+            try:
+                prompt, source = loop.next_job()
+            except GenerationCancelled:
+                break
+            except Exception as e:
+                # продюсер промптов или исходников стабильно падает - показываем причину вместо вечного ожидания
+                print(f"Бесконечная генерация остановлена: {e}")
+                yield gr.update(), f"Генерация остановлена: {e}\n{loop.format_stats()}", tracer.format_summary(), gr.update(interactive=True), gr.update(interactive=False)
+                break
+            print(f"Промпт: {prompt}")
+            try:
+                result_images = loop.denoise(
+                    service().generate, [prompt], [negative_prompt], settings,
+                    mode=mode, n_per_prompt=int(n_images), init_image=source, owner=request.session_hash
+                )
+            except GenerationCancelled:
+                break
 
-        yield result_image, f"Сгенерировано изображений: {generation_count}", gr.update(interactive=False), gr.update(interactive=True)
+            image_count += len(result_images)
+            service_stats = service().stats()
+            writer = service_stats["writer"]
+            latents = service_stats["latent_cache"]
+            results = service_stats["result_cache"]
+            jobs = service_stats["jobs"]
+            status = (
+                f"Сгенерировано изображений: {image_count}\n{loop.format_stats()}\n"
+                f"save: записано {writer['written']}, в очереди {writer['pending']}, "
+                f"в среднем {writer['avg_write_s']:.2f} с\n"
+                f"батчинг: {jobs['jobs_per_batch']:.1f} задач на вызов, заполнение {jobs['fill_ratio']:.0%}, "
+                f"ожидание в очереди {jobs['queue_delay_avg_s']:.2f} с (p95 {jobs['queue_delay_p95_s']:.2f})"
+            )
+            if results["hits"]:
+                status += f"\nкэш результатов: попаданий {results['hits']}, {results['mb']:.0f} MB на диске"
+            memory = service_stats["pipelines"]["memory"]
+            if memory:
+                status += f"\nрежим памяти: {', '.join(sorted(set(memory.values())))}"
+            if mode == "img2img":
+                status += (
+                    f"\nvae: попаданий {latents['hit_rate']:.0%} ({latents['hits']}/{latents['hits'] + latents['misses']}), "
+                    f"сэкономлено {latents['saved_s']:.1f} с"
+                )
+            yield with_seeds(result_images), status, tracer.format_summary(), gr.update(interactive=False), gr.update(interactive=True)
+    finally:
+        loop.stop()
 
-def reset_buttons():
-    """Сбросить состояние кнопок"""
+def set_output_format(output_format, quality):
+    """Поменять формат сохранения готовых изображений"""
+    service().set_output(output_format, int(quality))
+
+def reset_buttons(request: gr.Request):
+    """Сбросить состояние кнопок и отменить задачу этой вкладки, которая сейчас генерируется"""
+    client.cancel_active(request.session_hash)
     return gr.update(interactive=True), gr.update(interactive=False), "Генерация остановлена"
 
 with gr.Blocks(title="Breakcore Generator") as demo:
@@ -162,14 +310,36 @@ with gr.Blocks(title="Breakcore Generator") as demo:
         width_slider = gr.Slider(label="Ширина", minimum=256, maximum=1024, step=64, value=512)
     
     with gr.Row():
-        steps_slider = gr.Slider(label="Шаги инференса", minimum=10, maximum=100, step=5, value=40)
+        scheduler_dropdown = gr.Dropdown(
+            label="Планировщик (подставляет рекомендуемые шаги)",
+            choices=[(f"{name} ({preset.steps} шагов)", name) for name, preset in SCHEDULERS.items()],
+            value="default"
+        )
+        steps_slider = gr.Slider(label="Шаги инференса", minimum=1, maximum=100, step=1, value=40)
         guidance_slider = gr.Slider(label="Guidance Scale", minimum=1.0, maximum=20.0, step=0.5, value=7.5)
     
     with gr.Row():
         strength_slider = gr.Slider(label="Strength", minimum=0.1, maximum=1.0, step=0.1, value=0.3)
         lora_scale_slider = gr.Slider(label="LoRA Scale", minimum=0.0, maximum=2.0, step=0.1, value=0.8)
+        fuse_lora_checkbox = gr.Checkbox(label="Вшить LoRA в UNet (быстрее, пересборка при смене масштаба)", value=False)
+
+    with gr.Row():
+        n_images_slider = gr.Slider(label="Изображений за запуск", minimum=1, maximum=16, step=1, value=1)
+        memory_mode_dropdown = gr.Dropdown(
+            label="Режим памяти (auto - самый быстрый, который влезает)",
+            choices=["auto", *MEMORY_MODES],
+            value="auto"
+        )
+        seed_input = gr.Number(label="Seed (пусто - случайный, следующие изображения +1)", value=None, precision=0)
 
     gr.Markdown("### Промпты")
+
+    with gr.Row():
+        prompt_engine_radio = gr.Radio(
+            choices=list(prompt_generators),
+            value="OpenAI",
+            label="Генератор промптов"
+        )
     
     with gr.Row():
         use_custom_prompt_checkbox = gr.Checkbox(label="Использовать свой промпт", value=False)
@@ -187,14 +357,27 @@ with gr.Blocks(title="Breakcore Generator") as demo:
             lines=2
         )
 
+    with gr.Row():
+        fresh_source_checkbox = gr.Checkbox(label="Бесконечная: новое изображение с Pinterest на каждую генерацию", value=False)
+        queue_depth_slider = gr.Slider(label="Глубина очереди фоновых стадий", minimum=1, maximum=8, step=1, value=2)
+
     with gr.Row():
         generate_btn = gr.Button("Запустить генерацию", variant="primary", size="lg")
         infinite_generate_btn = gr.Button("Бесконечная генерация", variant="primary", size="lg")
         stop_btn = gr.Button("Остановить", variant="stop", size="lg", interactive=False)
     
-    output_image = gr.Image(label="Результат")
+    output_image = gr.Gallery(label="Результат", columns=4)
 
     generation_status = gr.Textbox(label="Статус генерации", value="", visible=True)
+
+    with gr.Accordion("Трассировка стадий", open=False):
+        trace_panel = gr.Textbox(label="Где уходят секунды (скользящее окно)", value=tracer.format_summary, lines=10)
+        trace_timer = gr.Timer(5)
+        trace_timer.tick(fn=tracer.format_summary, outputs=trace_panel)
+    
+    with gr.Row():
+        output_format_dropdown = gr.Dropdown(label="Формат сохранения", choices=["png", "webp", "jpeg"], value=OUTPUT_FORMAT)
+        output_quality_slider = gr.Slider(label="Качество webp/jpeg", minimum=50, maximum=100, step=1, value=OUTPUT_QUALITY)
     
     open_folder_btn = gr.Button("Открыть папку с скачеными готовыми изображениями", variant="secondary")
     folder_status = gr.Textbox(label="Статус", visible=False)
@@ -205,6 +388,11 @@ with gr.Blocks(title="Breakcore Generator") as demo:
     
     with gr.Row():
         move_btn = gr.Button("Скачать и поставить следующее изображение")
+
+    with gr.Row():
+        bulk_limit_slider = gr.Slider(label="Пинов за раз", minimum=10, maximum=1000, step=10, value=BULK_LIMIT)
+        bulk_btn = gr.Button("Скачать пачку пинов")
+    bulk_status = gr.Textbox(label="Массовая загрузка", value="", lines=2)
     
     gr.Markdown("**Или загрузите свое изображение:**")
     
@@ -214,16 +402,32 @@ with gr.Blocks(title="Breakcore Generator") as demo:
     
     move_btn.click(
         fn=move_image_action,
-        inputs=url_input,
+        inputs=[url_input, height_slider, width_slider],
         outputs=source_image
     )
     
+    bulk_btn.click(
+        fn=bulk_download_action,
+        inputs=[url_input, height_slider, width_slider, bulk_limit_slider],
+        outputs=bulk_status
+    )
+
     upload_btn.click(
         fn=upload_user_image,
         inputs=upload_image,
         outputs=source_image
     )
     
+    output_format_dropdown.change(
+        fn=set_output_format,
+        inputs=[output_format_dropdown, output_quality_slider]
+    )
+
+    output_quality_slider.change(
+        fn=set_output_format,
+        inputs=[output_format_dropdown, output_quality_slider]
+    )
+    
     open_folder_btn.click(
         fn=open_ready_folder,
         outputs=folder_status
@@ -235,6 +439,12 @@ with gr.Blocks(title="Breakcore Generator") as demo:
         outputs=[source_image, move_btn, url_input, upload_image, upload_btn]
     )
 
+    scheduler_dropdown.change(
+        fn=apply_scheduler_preset,
+        inputs=scheduler_dropdown,
+        outputs=[steps_slider, guidance_slider]
+    )
+
     generate_btn.click(
         fn=run_pipeline,
         inputs=[
@@ -246,8 +456,14 @@ with gr.Blocks(title="Breakcore Generator") as demo:
             guidance_slider, 
             strength_slider, 
             lora_scale_slider,
+            fuse_lora_checkbox,
+            memory_mode_dropdown,
+            scheduler_dropdown,
+            seed_input,
+            n_images_slider,
             use_custom_prompt_checkbox,
             custom_prompt_input,
+            prompt_engine_radio,
             use_custom_negative_checkbox,
             custom_negative_input
         ],
@@ -265,12 +481,20 @@ with gr.Blocks(title="Breakcore Generator") as demo:
             guidance_slider, 
             strength_slider, 
             lora_scale_slider,
+            fuse_lora_checkbox,
+            memory_mode_dropdown,
+            scheduler_dropdown,
+            seed_input,
+            n_images_slider,
             use_custom_prompt_checkbox,
             custom_prompt_input,
+            prompt_engine_radio,
             use_custom_negative_checkbox,
-            custom_negative_input
+            custom_negative_input,
+            fresh_source_checkbox,
+            queue_depth_slider
         ],
-        outputs=[output_image, generation_status, infinite_generate_btn, stop_btn]
+        outputs=[output_image, generation_status, trace_panel, infinite_generate_btn, stop_btn]
     )
 
     stop_btn.click(
@@ -281,4 +505,7 @@ with gr.Blocks(title="Breakcore Generator") as demo:
 
     demo.load(fn=get_current_image, outputs=source_image)
 
-demo.launch()
\ No newline at end of file
+if __name__ == "__main__":
+    warm_up_service()
+    serve_metrics()
+    demo.launch()
\ No newline at end of file
@@ -0,0 +1,293 @@
+import statistics
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, asdict
+from typing import List, Optional
+
+from PIL import Image
+
+from config import JOB_HISTORY, BATCH_MAX_IMAGES, BATCH_MAX_WAIT_S
+from imggenerator import BreakcoreGenerator, GenerationCancelled, Settings
+from tracing import tracer
+
+FINISHED = ("done", "failed", "cancelled")
+# столько последних задержек в очереди держим для p95
+DELAY_WINDOW = 200
+
+
+@dataclass
+class Job:
+    mode: str
+    prompts: List[str]
+    negative_prompts: List[str]
+    settings: Settings = field(default_factory=Settings)
+    n_per_prompt: int = 1
+    init_image: Optional[Image.Image] = None
+    priority: int = 0  # больше - раньше
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued"  # queued / running / done / failed / cancelled
+    progress: float = 0.0
+    error: Optional[str] = None
+    images: List[Image.Image] = field(default_factory=list)
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    batch_size: Optional[int] = None  # сколько изображений было в склеенном вызове
+    cancel: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def image_count(self) -> int:
+        return len(self.prompts) * self.n_per_prompt
+
+    def info(self) -> dict:
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "status": self.status,
+            "priority": self.priority,
+            "progress": self.progress,
+            "error": self.error,
+            "images": len(self.images),
+            "seeds": [image.info.get("seed") for image in self.images],
+            "settings": asdict(self.settings),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "batch_size": self.batch_size,
+        }
+
+
+def batch_key(job: Job) -> tuple:
+    """Задачи с одинаковым ключом можно генерировать одним вызовом пайплайна"""
+    s = job.settings
+    if job.mode == "img2img":
+        # без своего исходника задача берёт INPUT_PATH - такие склеиваются только между собой
+        return (job.mode, s.height, s.width, s.num_inference_steps, s.guidance_scale, s.strength,
+                s.lora_scale, s.fuse_lora, s.memory_mode, s.memory_budget_mb, s.scheduler, job.init_image is None)
+    return (job.mode, s.height, s.width, s.num_inference_steps, s.guidance_scale, s.lora_scale, s.fuse_lora,
+            s.memory_mode, s.memory_budget_mb, s.scheduler)
+
+
+class GroupCancel:
+    """cancel для склеенного вызова: прерываем, только когда отменены все задачи группы"""
+
+    def __init__(self, jobs: List[Job]):
+        self.jobs = jobs
+
+    def is_set(self) -> bool:
+        return all(job.cancel.is_set() for job in self.jobs)
+
+
+class JobQueue:
+    """Очередь задач генерации с приоритетами и динамическим батчингом
+
+    Воркер берёт задачу с наибольшим приоритетом (при равном - самую старую)
+    и до max_wait_s от её постановки ждёт совместимых задач (batch_key), пока
+    суммарно не наберётся max_batch изображений. Группа уходит в генератор
+    одним вызовом, результаты раздаются по задачам.
+
+    Отмена ещё не начатой задачи просто помечает её, а начатой - выставляет
+    job.cancel: задача получает статус cancelled, а денойзинг прерывается,
+    когда отменена вся группа. Завершённые задачи с картинками хранятся до
+    history штук.
+    """
+
+    def __init__(self, generator: BreakcoreGenerator, history: int = JOB_HISTORY,
+                 max_batch: int = BATCH_MAX_IMAGES, max_wait_s: float = BATCH_MAX_WAIT_S):
+        self.generator = generator
+        self.history = history
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_s
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._delays = deque(maxlen=DELAY_WINDOW)
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.busy_s = 0.0
+        self.batches = 0
+        self.batched_jobs = 0
+        self.batched_images = 0
+        self._thread = threading.Thread(target=self._run, name="job-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, job: Job) -> Job:
+        with self._changed:
+            self._jobs[job.id] = job
+            self._changed.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        job.cancel.set()
+        with self._changed:
+            if job.status != "queued":
+                return job
+            # воркер больше не увидит задачу среди ожидающих
+            job.status = "cancelled"
+            self._changed.notify()
+        self._finish(job, "cancelled")
+        return job
+
+    def position(self, job: Job) -> Optional[int]:
+        """Сколько задач в очереди будет взято раньше этой (None - не в очереди)"""
+        if job.status != "queued":
+            return None
+        with self._lock:
+            queued = self._queued()
+        return sum(1 for j in queued if self._order(j) < self._order(job))
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def stop(self):
+        self._stop.set()
+        with self._changed:
+            self._changed.notify()
+        self._thread.join(timeout=5)
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+            delays = list(self._delays)
+        return {
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "busy_s": self.busy_s,
+            "batches": self.batches,
+            "jobs_per_batch": self.batched_jobs / self.batches if self.batches else 0.0,
+            "images_per_batch": self.batched_images / self.batches if self.batches else 0.0,
+            "fill_ratio": self.batched_images / (self.batches * self.max_batch) if self.batches else 0.0,
+            "queue_delay_avg_s": statistics.fmean(delays) if delays else 0.0,
+            "queue_delay_p95_s": sorted(delays)[int(0.95 * (len(delays) - 1))] if delays else 0.0,
+        }
+
+    @staticmethod
+    def _order(job: Job) -> tuple:
+        return (-job.priority, job.created)
+
+    def _queued(self) -> List[Job]:
+        # вызывается под self._lock
+        return sorted((j for j in self._jobs.values() if j.status == "queued"), key=self._order)
+
+    def _group(self, lead: Job) -> List[Job]:
+        # вызывается под self._lock; ведущая задача входит всегда, даже если одна больше max_batch
+        key, group, images = batch_key(lead), [lead], lead.image_count
+        for job in self._queued():
+            if job is lead or batch_key(job) != key:
+                continue
+            if images + job.image_count > self.max_batch:
+                continue
+            group.append(job)
+            images += job.image_count
+        return group
+
+    def _take_group(self) -> Optional[List[Job]]:
+        """Ждёт задачу и попутчиков для неё; возвращает группу, уже помеченную running"""
+        with self._changed:
+            while not self._stop.is_set():
+                queued = self._queued()
+                if not queued:
+                    self._changed.wait(0.5)
+                    continue
+                lead = queued[0]
+                group = self._group(lead)
+                wait_s = lead.created + self.max_wait_s - time.time()
+                if sum(job.image_count for job in group) >= self.max_batch or wait_s <= 0:
+                    for job in group:
+                        job.status = "running"
+                    return group
+                self._changed.wait(wait_s)
+        return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            group = self._take_group()
+            if group:
+                self._execute(group)
+
+    def _execute(self, group: List[Job]):
+        started = time.time()
+        images = sum(job.image_count for job in group)
+        with self._lock:
+            self.batches += 1
+            self.batched_jobs += len(group)
+            self.batched_images += images
+            for job in group:
+                job.started = started
+                job.batch_size = images
+                self._delays.append(started - job.created)
+        for job in group:
+            tracer.record("queue_wait", started - job.created, started_at=job.created, job=job.id)
+
+        # seed у каждой задачи свой: склеиваются и задачи с разными seed
+        prompts, negatives, sources, seeds = [], [], [], []
+        for job in group:
+            seeds += self.generator.seeds(job.settings.seed, job.image_count)
+            for prompt, negative in zip(job.prompts, job.negative_prompts):
+                prompts += [prompt] * job.n_per_prompt
+                negatives += [negative] * job.n_per_prompt
+                sources += [job.init_image] * job.n_per_prompt
+        init_image = sources if group[0].init_image is not None else None
+
+        def report(fraction: float):
+            for job in group:
+                job.progress = fraction
+
+        try:
+            with tracer.span("batch", jobs=len(group), images=images, fill=images / self.max_batch):
+                results = self.generator.generate_batch(
+                    prompts, negatives, n_per_prompt=1, mode=group[0].mode, init_image=init_image,
+                    settings=group[0].settings, cancel=GroupCancel(group), progress=report,
+                    seeds=seeds,
+                )
+        except GenerationCancelled:
+            for job in group:
+                self._finish(job, "cancelled")
+        except Exception as e:
+            print(f"Группа из {len(group)} задач упала: {e}")
+            for job in group:
+                job.error = f"{type(e).__name__}: {e}"
+                self._finish(job, "failed")
+        else:
+            offset = 0
+            for job in group:
+                job.images = results[offset:offset + job.image_count]
+                offset += job.image_count
+                if job.cancel.is_set():
+                    job.images = []
+                    self._finish(job, "cancelled")
+                else:
+                    job.progress = 1.0
+                    self._finish(job, "done")
+        finally:
+            self.busy_s += time.time() - started
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished = time.time()
+        job.init_image = None
+        with self._lock:
+            if status == "done":
+                self.completed += 1
+            elif status == "failed":
+                self.failed += 1
+            else:
+                self.cancelled += 1
+            finished = [j for j in self._jobs.values() if j.status in FINISHED]
+            for old in finished[:max(0, len(finished) - self.history)]:
+                del self._jobs[old.id]
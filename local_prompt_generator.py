@@ -0,0 +1,143 @@
+import math
+import random
+import re
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from config import PROMPT_TOKEN_BUDGET, PROMPT_DEDUPE_WINDOW, ESSENTIAL_TAGS
+
+Vocabulary = Dict[str, List[Tuple[str, float]]]
+
+# словарь из системного промпта PromptGenerator, вес - частота выбора
+VOCABULARY: Vocabulary = {
+    "subject": [
+        ("anime girl", 3.0), ("1girl, anime style", 2.0), ("anime girl portrait", 1.5),
+        ("anime girl close-up", 1.0), ("full body anime girl", 0.7),
+    ],
+    "hair": [
+        ("pink hair", 2.0), ("long silver hair", 1.0), ("cyan twin tails", 1.0),
+        ("messy black hair", 1.0), ("white hair with neon streaks", 1.0), ("short blue bob", 0.8),
+    ],
+    "eyes": [
+        ("glowing cyan eyes", 1.5), ("heterochromia", 1.0), ("empty stare", 1.0),
+        ("teary eyes", 0.8), ("red eyes", 0.8),
+    ],
+    "expression": [
+        ("blank expression", 1.0), ("melancholic expression", 1.0), ("smirk", 0.7),
+        ("crying", 0.6), ("dead-eyed stare", 0.8),
+    ],
+    "glitch": [
+        ("datamoshing", 1.5), ("pixel sorting", 1.5), ("RGB split", 1.5), ("scan lines", 1.2),
+        ("VHS distortion", 1.0), ("glitch artifacts", 0.8),
+    ],
+    "corruption": [
+        ("compression artifacts", 1.2), ("digital noise", 1.0), ("bit crushed", 1.0),
+        ("corrupted data", 1.0), ("distortion", 0.7), ("jpeg artifacts", 0.6),
+    ],
+    "layers": [
+        ("code overlay", 1.2), ("terminal windows", 1.2), ("error messages", 1.0),
+        ("overlapping UI elements", 1.0), ("digital text", 0.8), ("matrix-style digital rain", 0.8),
+        ("cyberpunk UI elements", 0.8),
+    ],
+    "palette": [
+        ("neon cyan", 1.2), ("lime green", 1.0), ("hot pink", 1.2), ("electric blue", 1.0),
+        ("harsh whites", 0.6), ("deep blacks", 0.8),
+    ],
+    "contrast": [
+        ("crushed blacks", 1.0), ("blown highlights", 0.8), ("overexposed", 0.6),
+    ],
+    "atmosphere": [
+        ("cyberpunk", 1.2), ("digital chaos", 1.0), ("net art", 0.8), ("cybercore", 1.0),
+        ("webcore", 0.8), ("Y2K aesthetic", 0.8), ("terminal aesthetic", 0.6),
+        ("heavy post-processing", 0.6),
+    ],
+}
+
+# порядок слотов в промпте и сколько терминов брать из каждого (min, max)
+SLOTS: Sequence[Tuple[str, int, int]] = (
+    ("subject", 1, 1),
+    ("hair", 1, 1),
+    ("eyes", 1, 1),
+    ("expression", 0, 1),
+    ("glitch", 2, 3),
+    ("corruption", 1, 2),
+    ("layers", 1, 2),
+    ("palette", 2, 3),
+    ("contrast", 1, 1),
+    ("atmosphere", 1, 2),
+)
+
+# в порядке убывания важности: при нехватке бюджета отбрасываются с конца
+PRIORITY = ("subject", "glitch", "palette", "hair", "eyes", "layers", "corruption",
+            "contrast", "atmosphere", "expression")
+
+TOKEN_PATTERN = re.compile(r"[a-z]+|\d|[^\sa-z\d]", re.IGNORECASE)
+
+
+def approx_clip_tokens(text: str) -> int:
+    """Грубая оценка числа CLIP токенов без токенайзера (длинные слова - несколько BPE кусков)"""
+    return sum(max(1, math.ceil(len(t) / 7)) for t in TOKEN_PATTERN.findall(text))
+
+
+class LocalPromptGenerator:
+    """Офлайн генератор промптов: взвешенная выборка из словаря breakcore эстетики"""
+
+    def __init__(self, seed: Optional[int] = None, token_budget: int = PROMPT_TOKEN_BUDGET,
+                 dedupe_window: int = PROMPT_DEDUPE_WINDOW, vocabulary: Optional[Vocabulary] = None,
+                 count_tokens: Callable[[str], int] = approx_clip_tokens, max_attempts: int = 20):
+        self.rng = random.Random(seed)
+        self.token_budget = token_budget
+        self.vocabulary = vocabulary or VOCABULARY
+        self.count_tokens = count_tokens
+        self.max_attempts = max_attempts
+        self._recent = deque(maxlen=dedupe_window)
+        self._recent_set = set()
+        self.duplicates = 0
+
+    def generate_prompt(self) -> str:
+        """
+        Генерирует промпт
+        """
+        for _ in range(self.max_attempts):
+            prompt = self._compose()
+            if prompt not in self._recent_set:
+                break
+            self.duplicates += 1
+        self._remember(prompt)
+        return prompt
+
+    def _compose(self) -> str:
+        picked = {
+            slot: self._sample(self.vocabulary.get(slot, []), self.rng.randint(lo, hi))
+            for slot, lo, hi in SLOTS
+        }
+        essential = ", ".join(ESSENTIAL_TAGS)
+        used = self.count_tokens(essential)
+
+        kept = {slot: [] for slot in picked}
+        for slot in PRIORITY:
+            for term in picked.get(slot, []):
+                cost = self.count_tokens(term) + 1
+                if used + cost > self.token_budget:
+                    continue
+                kept[slot].append(term)
+                used += cost
+
+        terms = [term for slot, _, _ in SLOTS for term in kept[slot]]
+        return ", ".join(terms + [essential])
+
+    def _sample(self, weighted: List[Tuple[str, float]], k: int) -> List[str]:
+        """Взвешенная выборка без повторов (ключи Эфраимидиса-Спиракиса)"""
+        if k <= 0 or not weighted:
+            return []
+        keyed = [(self.rng.random() ** (1.0 / w), term) for term, w in weighted if w > 0]
+        keyed.sort(reverse=True)
+        return [term for _, term in keyed[:k]]
+
+    def _remember(self, prompt: str):
+        if self._recent.maxlen == 0 or prompt in self._recent_set:
+            return
+        if len(self._recent) == self._recent.maxlen:
+            self._recent_set.discard(self._recent[0])
+        self._recent.append(prompt)
+        self._recent_set.add(prompt)
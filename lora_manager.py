@@ -0,0 +1,203 @@
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict
+
+from config import FUSED_LORA_DIR
+
+LORA_COMPONENTS = ("unet", "text_encoder", "text_encoder_2")
+
+
+@dataclass
+class LoraAdapter:
+    name: str
+    path: str
+    weight: float = 1.0
+    scaled: bool = True  # False - вклад не зависит от lora_scale (служебные LoRA вроде LCM)
+
+    def contribution(self, scale: float) -> float:
+        return self.weight * scale if self.scaled else self.weight
+
+
+def checkpoint_name(model_id: str, lora_path: str) -> str:
+    """Имя файла/папки для пары модель + LoRA"""
+    model_name = model_id.strip("/\\").replace("/", "--").replace("\\", "--").replace(":", "")
+    lora_name = os.path.splitext(os.path.basename(lora_path))[0]
+    return f"{model_name}__{lora_name}"
+
+
+def fused_checkpoint_path(model_id: str, lora_path: str) -> str:
+    """Путь к чекпоинту с уже вшитой LoRA для пары модель + LoRA"""
+    return os.path.join(FUSED_LORA_DIR, checkpoint_name(model_id, lora_path) + ".safetensors")
+
+
+class LoraManager:
+    """Загружает LoRA адаптеры один раз и меняет их масштаб на месте
+
+    Итоговый вклад адаптера = weight * lora_scale (или просто weight, если
+    scaled=False). Если в веса модели уже вшита
+    LoRA (load_fused), применяется только разница с вшитым вкладом.
+    """
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.adapters: Dict[str, LoraAdapter] = {}
+        self.baked: Dict[str, float] = {}
+        self._loaded = set()
+        self._fused = False
+        self._state = None
+        self.metrics = {
+            "adapter_loads": 0,
+            "adapter_load_time_s": 0.0,
+            "scale_changes": 0,
+            "reuses": 0,
+            "fuses": 0,
+            "unfuses": 0,
+        }
+
+    def add(self, name: str, path: str, weight: float = 1.0, scaled: bool = True):
+        """Регистрирует адаптер; веса читаются с диска при первом использовании"""
+        adapter = self.adapters.get(name)
+        if adapter is not None and adapter.path != path:
+            raise ValueError(f"Адаптер {name} уже загружен из {adapter.path}")
+        if adapter is None:
+            self.adapters[name] = LoraAdapter(name, path, weight, scaled)
+        elif (adapter.weight, adapter.scaled) == (weight, scaled):
+            return
+        else:
+            adapter.weight = weight
+            adapter.scaled = scaled
+        self._state = None
+
+    def set_weight(self, name: str, weight: float):
+        if name not in self.adapters:
+            raise KeyError(f"Нет адаптера {name}")
+        if self.adapters[name].weight != weight:
+            self.adapters[name].weight = weight
+            self._state = None
+
+    def remove(self, name: str):
+        if name not in self.adapters:
+            return
+        self._unfuse()
+        if name in self._loaded:
+            self.pipe.delete_adapters(name)
+            self._loaded.discard(name)
+        del self.adapters[name]
+        self._state = None
+
+    def prepare(self, scale: float, fuse: bool = False):
+        """Приводит адаптеры к масштабу scale; fuse=True вшивает их в веса UNet"""
+        weights = {
+            name: adapter.contribution(scale) - self.baked.get(name, 0.0)
+            for name, adapter in self.adapters.items()
+        }
+        active = {name: w for name, w in weights.items() if abs(w) > 1e-6}
+        state = (tuple(sorted(active.items())), fuse)
+        if state == self._state:
+            self.metrics["reuses"] += 1
+            return
+
+        self._unfuse()
+        for name in active:
+            self._ensure_loaded(name)
+
+        if active:
+            names = sorted(self._loaded)
+            self.pipe.enable_lora()
+            self.pipe.set_adapters(names, adapter_weights=[weights.get(n, 0.0) for n in names])
+            if fuse:
+                self.pipe.fuse_lora(lora_scale=1.0, adapter_names=sorted(active))
+                self._fused = True
+                self.metrics["fuses"] += 1
+        elif self._loaded:
+            self.pipe.disable_lora()
+
+        self._state = state
+        self.metrics["scale_changes"] += 1
+
+    @property
+    def signature(self) -> tuple:
+        """Текущее состояние адаптеров - часть ключа кэшей, зависящих от весов"""
+        return (self._state, tuple(sorted(self.baked.items())))
+
+    def export_fused(self, path: str, scale: float):
+        """Сохраняет веса с вшитой LoRA в safetensors, чтобы холодный старт пропускал слияние"""
+        from safetensors.torch import save_file
+
+        self.prepare(scale, fuse=True)
+        tensors = {}
+        for component in LORA_COMPONENTS:
+            module = getattr(self.pipe, component, None)
+            if module is None:
+                continue
+            for key, value in module.state_dict().items():
+                if "lora_" in key:
+                    continue
+                key = key.replace(".base_layer.", ".")
+                tensors[f"{component}.{key}"] = value.detach().contiguous().cpu()
+
+        contributions = self.contributions(scale)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        save_file(tensors, path, metadata={"lora_contributions": json.dumps(contributions)})
+        print(f"Чекпоинт с вшитой LoRA сохранён: {path}")
+        return path
+
+    def contributions(self, scale: float) -> Dict[str, float]:
+        """Вклад адаптеров в веса после вшивания при масштабе scale"""
+        contributions = dict(self.baked)
+        contributions.update({name: a.contribution(scale) for name, a in self.adapters.items()})
+        return contributions
+
+    def set_baked(self, contributions: Dict[str, float]):
+        """Отмечает вклад LoRA, уже вшитый в загруженные веса (чекпоинт или бандл)"""
+        self.baked = {k: float(v) for k, v in contributions.items()}
+        self._state = None
+
+    def load_fused(self, path: str):
+        """Загружает веса с вшитой LoRA поверх базовой модели"""
+        from safetensors import safe_open
+        from safetensors.torch import load_file
+
+        if self._loaded:
+            raise RuntimeError("Вшитый чекпоинт нужно грузить до адаптеров")
+
+        started = time.perf_counter()
+        with safe_open(path, framework="pt") as f:
+            metadata = f.metadata() or {}
+        state = load_file(path)
+        for component in LORA_COMPONENTS:
+            module = getattr(self.pipe, component, None)
+            prefix = f"{component}."
+            part = {k[len(prefix):]: v for k, v in state.items() if k.startswith(prefix)}
+            if module is not None and part:
+                module.load_state_dict(part)
+
+        self.set_baked(json.loads(metadata.get("lora_contributions", "{}")))
+        print(f"Вшитая LoRA загружена за {time.perf_counter() - started:.2f} с: {path}")
+
+    def stats(self) -> dict:
+        stats = dict(self.metrics)
+        stats["loaded"] = sorted(self._loaded)
+        stats["fused"] = self._fused
+        stats["baked"] = dict(self.baked)
+        return stats
+
+    def _ensure_loaded(self, name: str):
+        if name in self._loaded:
+            return
+        adapter = self.adapters[name]
+        started = time.perf_counter()
+        self.pipe.load_lora_weights(adapter.path, adapter_name=name)
+        self._loaded.add(name)
+        self.metrics["adapter_loads"] += 1
+        self.metrics["adapter_load_time_s"] += time.perf_counter() - started
+        print(f"LoRA {name} загружена: {adapter.path}")
+
+    def _unfuse(self):
+        if self._fused:
+            self.pipe.unfuse_lora()
+            self._fused = False
+            self.metrics["unfuses"] += 1
+            self._state = None
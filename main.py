@@ -2,9 +2,10 @@ from imggenerator import BreakcoreGenerator, Settings
 from parsers.pinterest import PinterestDownloader, Options
 from pin_to_input import ImageMover
 from pompt_generator import PromptGenerator
-from config import OUT_DIR
+from local_prompt_generator import LocalPromptGenerator
+from config import OUT_DIR, BULK_LIMIT
 
-from config import NEGATIVE_PROMPT, TEST_PROMPT
+from config import NEGATIVE_PROMPT, TEST_PROMPT, SEED
 
 def main():
     
@@ -26,6 +27,8 @@ def main():
     # processor.settings = settings
     # processor.generate_text2img(TEST_PROMPT, NEGATIVE_PROMPT)
     
+    # processor.export_fused_lora()
+    
     # ################################
     # mover = ImageMover()
     
@@ -36,6 +39,10 @@ def main():
     # prompt_gen = PromptGenerator()
     
     # prompt_gen.generate_prompt()
+    
+    # local_prompt_gen = LocalPromptGenerator(seed=SEED)
+    
+    # local_prompt_gen.generate_prompt()
     # ################################
     # options = Options(
     # url="https://ru.pinterest.com/search/pins/?q=breackcore%20anime&rs=typed",
@@ -43,6 +50,8 @@ def main():
     # )
     # downloader = PinterestDownloader(options)
     # downloader.run()    
+    
+    # downloader.run_bulk(limit=BULK_LIMIT)
     # ###############################
     
     print("Мейн запущен, раскомментируйте строки для проверки функций")
@@ -0,0 +1,122 @@
+"""Оценка пика памяти генерации по режимам MEMORY_MODES и выбор режима под бюджет"""
+import itertools
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from config import BATCH_MEMORY_PER_PIXEL, VAE_MEMORY_PER_PIXEL, ATTENTION_SLICING_FACTOR, MEMORY_HEADROOM
+from settings import MEMORY_MODES, MemoryPolicy, Settings
+
+COMPONENTS = ("text_encoder", "text_encoder_2", "unet", "vae")
+
+
+@dataclass
+class MemoryPlan:
+    mode: str
+    policy: MemoryPolicy
+    batch_size: int
+    peak_bytes: int
+    budget_bytes: Optional[int]
+
+
+def module_bytes(module, recurse: bool = True) -> int:
+    tensors = itertools.chain(module.parameters(recurse=recurse), module.buffers(recurse=recurse))
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def weight_bytes(pipe) -> Dict[str, int]:
+    """Размер весов по компонентам и самого крупного слоя - столько держит последовательная выгрузка"""
+    sizes = {name: module_bytes(getattr(pipe, name)) for name in COMPONENTS if getattr(pipe, name, None) is not None}
+    sizes["largest_layer"] = max(
+        module_bytes(module, recurse=False)
+        for name in COMPONENTS if getattr(pipe, name, None) is not None
+        for module in getattr(pipe, name).modules()
+    )
+    return sizes
+
+
+def resident_bytes(pipe, sizes: Dict[str, int], device: str) -> int:
+    """Сколько весов пайплайна сейчас лежит на device"""
+    total = 0
+    for name in COMPONENTS:
+        module = getattr(pipe, name, None)
+        param = next(module.parameters(), None) if module is not None else None
+        if param is not None and param.device.type == device.split(":")[0]:
+            total += sizes[name]
+    return total
+
+
+def estimate_peak(policy: MemoryPolicy, sizes: Dict[str, int], width: int, height: int, batch: int,
+                  dtype_bytes: int = 2, tile: Optional[int] = None, sdpa: bool = True) -> int:
+    """Грубая оценка пика: веса на устройстве + самая тяжёлая стадия (UNet или декод VAE)
+
+    Коэффициенты на пиксель заданы для fp16 в config. С SDPA (torch 2) матрица
+    внимания целиком не строится, и attention slicing памяти не экономит.
+    """
+    pixels = width * height
+    scale = dtype_bytes / 2
+    unet = batch * pixels * BATCH_MEMORY_PER_PIXEL * scale
+    if policy.attention_slicing and not sdpa:
+        unet *= ATTENTION_SLICING_FACTOR
+    decode_batch = 1 if policy.vae_slicing else batch
+    decode_pixels = pixels
+    if policy.vae_tiling and tile and max(width, height) > tile:
+        decode_pixels = tile * tile
+    vae = decode_batch * decode_pixels * VAE_MEMORY_PER_PIXEL * scale
+
+    encoders = sizes.get("text_encoder", 0) + sizes.get("text_encoder_2", 0)
+    if policy.offload == "model":
+        # на устройстве только текущий компонент
+        return int(max(encoders, sizes["unet"] + unet, sizes["vae"] + vae))
+    if policy.offload == "sequential":
+        return int(sizes["largest_layer"] + max(unet, vae))
+    return int(encoders + sizes["unet"] + sizes["vae"] + max(unet, vae))
+
+
+def plan_memory(sizes: Dict[str, int], settings: Settings, device: str, n_images: int,
+                budget_bytes: Optional[int], dtype_bytes: int = 2, tile: Optional[int] = None,
+                sdpa: bool = True) -> MemoryPlan:
+    """Режим памяти и размер батча для вызова
+
+    memory_mode="auto" перебирает MEMORY_MODES от быстрого к экономному и берёт
+    первый, где помещается весь батч (не больше batch_size и n_images). Если
+    полный батч не влезает нигде, берётся режим с самым большим батчем.
+    Последовательная выгрузка - только когда без неё не влезает ни одно изображение.
+    Выгрузка на CPU имеет смысл только для cuda.
+    """
+    wanted = max(1, min(settings.batch_size, n_images))
+    on_cuda = device.startswith("cuda")
+    if settings.memory_mode == "auto":
+        names = [name for name, p in MEMORY_MODES.items() if p.offload == "none" or on_cuda]
+    elif settings.memory_mode not in MEMORY_MODES:
+        raise ValueError(f"Неизвестный режим памяти: {settings.memory_mode}")
+    elif MEMORY_MODES[settings.memory_mode].offload != "none" and not on_cuda:
+        raise ValueError(f"Режим {settings.memory_mode} работает только на cuda")
+    else:
+        names = [settings.memory_mode]
+
+    def estimate(policy: MemoryPolicy, batch: int) -> int:
+        return estimate_peak(policy, sizes, settings.width, settings.height, batch, dtype_bytes, tile, sdpa)
+
+    plans = []
+    for name in names:
+        policy = MEMORY_MODES[name]
+        batch = wanted
+        if budget_bytes is not None:
+            limit = budget_bytes * MEMORY_HEADROOM
+            while batch > 0 and estimate(policy, batch) > limit:
+                batch -= 1
+        plan = MemoryPlan(name, policy, batch, estimate(policy, max(batch, 1)), budget_bytes)
+        if batch == wanted and (policy.offload != "sequential" or not any(p.batch_size for p in plans)):
+            return plan
+        plans.append(plan)
+
+    # последовательная выгрузка в разы медленнее: лучше батч поменьше без неё
+    fitting = ([plan for plan in plans if plan.batch_size > 0 and plan.policy.offload != "sequential"]
+               or [plan for plan in plans if plan.batch_size > 0])
+    if fitting:
+        return max(fitting, key=lambda plan: plan.batch_size)
+    # не влезает даже одно изображение: самый экономный режим, дальше решит устройство
+    plan = min(plans, key=lambda plan: plan.peak_bytes)
+    plan.batch_size = 1
+    print(f"Оценка памяти {plan.peak_bytes / 2**20:.0f} MB больше бюджета {budget_bytes / 2**20:.0f} MB даже в режиме {plan.mode}")
+    return plan
@@ -0,0 +1,266 @@
+"""Локальное хранилище моделей: закреплённые снапшоты и готовые бандлы без обращений к хабу
+
+python model_store.py pin                 # скачать и закрепить снапшот MODEL_ID
+python model_store.py bundle --scale 0.8  # собрать бандл с вшитой LORA_PATH
+python model_store.py list
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import torch
+
+from config import MODEL_ID, MODEL_VARIANT, CACHE_DIR, LORA_PATH, LORA_NAME, MODEL_STORE_DIR, MODEL_OFFLINE
+from lora_manager import LoraManager, checkpoint_name
+
+BUNDLE_META = "bundle.json"
+
+_hub_login_lock = threading.Lock()
+_hub_logged_in = False
+
+
+def hub_login():
+    """Логин в Hugging Face Hub - один раз и только перед настоящим скачиванием"""
+    global _hub_logged_in
+    from dotenv import load_dotenv
+    from huggingface_hub import login
+
+    with _hub_login_lock:
+        if _hub_logged_in:
+            return
+        load_dotenv()
+        token = os.getenv("HUGGINGFACE_TOKEN")
+        if token:
+            login(token=token)
+        _hub_logged_in = True
+
+
+def file_stamp(path: Optional[str]) -> Optional[tuple]:
+    """(путь, размер, mtime) - меняется, если файл пересобрали; None для отсутствующего"""
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+def snapshot_patterns(variant: Optional[str]) -> list:
+    # только веса пайплайна по папкам компонентов: без single-file чекпоинтов, onnx и openvino
+    weights = f"*/*.{variant}.safetensors" if variant else "*/*.safetensors"
+    return ["model_index.json", "*/*.json", "*/*.txt", weights]
+
+
+class ModelStore:
+    """Закреплённые локальные снапшоты моделей и бандлы с вшитой LoRA
+
+    manifest.json связывает model_id с папкой снапшота конкретной ревизии,
+    поэтому загрузка не резолвит ревизию на хабе. При offline=True модель
+    грузится только с диска (local_files_only), а скачать её можно явно
+    через pin. Safetensors читаются через mmap (по умолчанию в diffusers) с
+    low_cpu_mem_usage, на устройство веса переносит уже PipelineManager.
+
+    Бандл - готовый к запуску пайплайн: базовая модель с вшитой LoRA и
+    выбранным планировщиком, сохранённый через save_pretrained. Вшитый
+    вклад LoRA пишется в bundle.json, чтобы LoraManager применял только
+    разницу с ним.
+    """
+
+    def __init__(self, root: str = MODEL_STORE_DIR, cache_dir: Optional[str] = CACHE_DIR,
+                 offline: bool = MODEL_OFFLINE):
+        self.root = root
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self._lock = threading.Lock()
+        self._seen = set()
+        self.metrics = {
+            "cold_loads": 0,
+            "cold_load_s": 0.0,
+            "warm_loads": 0,
+            "warm_load_s": 0.0,
+            "bundle_loads": 0,
+            "pins": 0,
+        }
+
+    def manifest(self) -> Dict[str, dict]:
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def pin(self, model_id: str = MODEL_ID, variant: Optional[str] = MODEL_VARIANT,
+            revision: Optional[str] = None, local_only: bool = False) -> str:
+        """Закрепляет снапшот модели (скачивая его, если local_only=False) и возвращает путь"""
+        if os.path.isdir(model_id):
+            return model_id
+        from huggingface_hub import snapshot_download
+
+        kwargs = dict(revision=revision, cache_dir=self.cache_dir, allow_patterns=snapshot_patterns(variant))
+        if local_only:
+            path = snapshot_download(model_id, local_files_only=True, **kwargs)
+        else:
+            hub_login()
+            path = snapshot_download(model_id, **kwargs)
+        with self._lock:
+            manifest = self.manifest()
+            manifest[model_id] = {
+                "path": os.path.abspath(path),
+                "revision": os.path.basename(os.path.normpath(path)),
+                "variant": variant,
+                "pinned_at": time.time(),
+            }
+            self._write_json(self.manifest_path, manifest)
+        self.metrics["pins"] += 1
+        print(f"Снапшот {model_id} закреплён: {path}")
+        return path
+
+    def resolve(self, model_id: str = MODEL_ID, variant: Optional[str] = MODEL_VARIANT) -> str:
+        """Локальная папка модели; без закреплённого снапшота берёт уже скачанный кэш"""
+        if os.path.isdir(model_id):
+            return model_id
+        entry = self.manifest().get(model_id)
+        if entry is not None and os.path.isdir(entry["path"]):
+            return entry["path"]
+        try:
+            return self.pin(model_id, variant, local_only=True)
+        except (OSError, ValueError):
+            pass
+        if self.offline:
+            raise FileNotFoundError(
+                f"{model_id} нет на диске, а хранилище работает офлайн. "
+                f"Скачайте снапшот: python model_store.py pin {model_id}"
+            )
+        print(f"{model_id} нет локально, скачиваем с Hugging Face Hub")
+        return self.pin(model_id, variant)
+
+    def bundle_path(self, model_id: str, lora_path: str) -> str:
+        return os.path.join(self.root, "bundles", checkpoint_name(model_id, lora_path))
+
+    def find_bundle(self, model_id: str, lora_path: Optional[str]) -> Optional[str]:
+        """Папка бандла для lora_path; None, если его нет или LoRA пересобрали после сборки"""
+        if not lora_path:
+            return None
+        path = self.bundle_path(model_id, lora_path)
+        try:
+            with open(os.path.join(path, BUNDLE_META), encoding="utf-8") as f:
+                stamp = json.load(f).get("lora_stamp")
+        except FileNotFoundError:
+            return None
+        if stamp is None or tuple(stamp) != file_stamp(lora_path):
+            # вшитый вклад старой LoRA не совпадёт с разницей, которую посчитает LoraManager
+            print(f"Бандл {path} собран с другой версией {lora_path}, грузим снапшот")
+            return None
+        return path
+
+    def load(self, pipeline_class, model_id: str = MODEL_ID, dtype: torch.dtype = torch.float32,
+             variant: Optional[str] = MODEL_VARIANT, lora_path: Optional[str] = None) -> Tuple[object, Optional[dict]]:
+        """Загружает пайплайн с диска: бандл для lora_path, если он собран, иначе снапшот
+
+        Возвращает (пайплайн, метаданные бандла или None).
+        """
+        bundle = self.find_bundle(model_id, lora_path)
+        if bundle is not None:
+            path, variant = bundle, None
+            with open(os.path.join(bundle, BUNDLE_META), encoding="utf-8") as f:
+                meta = json.load(f)
+        else:
+            path, meta = self.resolve(model_id, variant), None
+
+        started = time.perf_counter()
+        pipe = pipeline_class.from_pretrained(
+            path, torch_dtype=dtype, variant=variant, use_safetensors=True,
+            local_files_only=True, low_cpu_mem_usage=True,
+        )
+        elapsed = time.perf_counter() - started
+
+        # первая загрузка папки в процессе - холодная, дальше файлы уже в page cache
+        kind = "warm" if path in self._seen else "cold"
+        self._seen.add(path)
+        self.metrics[f"{kind}_loads"] += 1
+        self.metrics[f"{kind}_load_s"] += elapsed
+        self.metrics["bundle_loads"] += meta is not None
+        print(f"{'Бандл' if meta else 'Снапшот'} загружен за {elapsed:.2f} с ({kind}): {path}")
+        return pipe, meta
+
+    def build_bundle(self, model_id: str = MODEL_ID, lora_path: str = LORA_PATH, lora_scale: float = 0.8,
+                     scheduler: Optional[str] = None, dtype: Optional[torch.dtype] = None,
+                     variant: Optional[str] = MODEL_VARIANT) -> str:
+        """Собирает бандл: снапшот + LoRA, вшитая при lora_scale, + планировщик (ключ SCHEDULERS)"""
+        from diffusers import StableDiffusionXLPipeline
+
+        if dtype is None:
+            dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+        started = time.perf_counter()
+        pipe = StableDiffusionXLPipeline.from_pretrained(
+            self.resolve(model_id, variant), torch_dtype=dtype, variant=variant, use_safetensors=True,
+            local_files_only=True, low_cpu_mem_usage=True,
+        )
+        lora = LoraManager(pipe)
+        lora.add(LORA_NAME, lora_path)
+        lora.prepare(lora_scale, fuse=True)
+        contributions = lora.contributions(lora_scale)
+        # после fuse_lora веса уже в базовых слоях, LoRA слои больше не нужны
+        pipe.unload_lora_weights()
+        if scheduler:
+            from pipeline_manager import make_scheduler
+
+            pipe.scheduler = make_scheduler(scheduler, pipe.scheduler)
+
+        path = self.bundle_path(model_id, lora_path)
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        pipe.save_pretrained(tmp, safe_serialization=True)
+        self._write_json(os.path.join(tmp, BUNDLE_META), {
+            "model_id": model_id,
+            "lora_path": lora_path,
+            "lora_stamp": file_stamp(lora_path),
+            "lora_contributions": contributions,
+            "scheduler": scheduler or "default",
+            "dtype": str(dtype).replace("torch.", ""),
+            "built_at": time.time(),
+        })
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        print(f"Бандл собран за {time.perf_counter() - started:.2f} с: {path}")
+        return path
+
+    def stats(self) -> dict:
+        stats = dict(self.metrics)
+        stats["pinned"] = sorted(self.manifest())
+        return stats
+
+    @staticmethod
+    def _write_json(path: str, data: dict):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["pin", "bundle", "list"])
+    parser.add_argument("model_id", nargs="?", default=MODEL_ID)
+    parser.add_argument("--variant", default=MODEL_VARIANT)
+    parser.add_argument("--revision", default=None)
+    parser.add_argument("--lora", default=LORA_PATH)
+    parser.add_argument("--scale", type=float, default=0.8)
+    parser.add_argument("--scheduler", default=None, help="пресет планировщика из settings.SCHEDULERS, например unipc")
+    args = parser.parse_args()
+
+    store = ModelStore()
+    if args.command == "pin":
+        store.pin(args.model_id, args.variant, args.revision)
+    elif args.command == "bundle":
+        store.build_bundle(args.model_id, args.lora, args.scale, args.scheduler, variant=args.variant)
+    else:
+        print(json.dumps(store.manifest(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
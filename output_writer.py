@@ -0,0 +1,152 @@
+import atexit
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
+
+from PIL import Image
+
+from tracing import tracer
+from config import OUTPUT_DIR, OUTPUT_FORMAT, OUTPUT_QUALITY, PNG_COMPRESS_LEVEL, WEBP_LOSSLESS
+
+FORMAT_EXTENSIONS = {"png": "png", "webp": "webp", "jpeg": "jpg"}
+
+
+@dataclass
+class OutputOptions:
+    format: str = OUTPUT_FORMAT
+    png_compress_level: int = PNG_COMPRESS_LEVEL
+    quality: int = OUTPUT_QUALITY
+    webp_lossless: bool = WEBP_LOSSLESS
+
+    def save_kwargs(self) -> dict:
+        if self.format == "png":
+            return {"format": "PNG", "compress_level": self.png_compress_level}
+        if self.format == "webp":
+            return {"format": "WEBP", "quality": self.quality, "lossless": self.webp_lossless}
+        if self.format == "jpeg":
+            return {"format": "JPEG", "quality": self.quality}
+        raise ValueError(f"Неизвестный формат: {self.format}")
+
+
+class OutputWriter:
+    """Сохраняет изображения в пуле потоков, не задерживая генерацию
+
+    Имя файла резервируется сразу (в памяти, файл на диске появляется только
+    готовым), поэтому два изображения, готовые в одну секунду, не перезапишут
+    друг друга.
+    """
+
+    def __init__(self, output_dir: str = OUTPUT_DIR, options: OutputOptions = None,
+                 max_workers: int = 2, max_pending: int = 16):
+        self.output_dir = output_dir
+        self.options = options or OutputOptions()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="writer")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = set()
+        self._reserved = set()
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._closed = False
+        self.written = 0
+        self.bytes_written = 0
+        self.write_time_s = 0.0
+        self.errors = 0
+        atexit.register(self.close)
+
+    def submit(self, image: Image.Image, prefix: str) -> str:
+        """Ставит изображение в очередь на запись, возвращает будущий путь"""
+        if self._closed:
+            raise RuntimeError("OutputWriter уже закрыт")
+        options = OutputOptions(**vars(self.options))
+        path = self._reserve(prefix, FORMAT_EXTENSIONS[options.format])
+        self._slots.acquire()
+        future = self._executor.submit(self._write, image, path, options)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return path
+
+    def flush(self, timeout: float = None):
+        """Дожидается записи всех поставленных изображений"""
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending, timeout=timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "written": self.written,
+            "pending": pending,
+            "errors": self.errors,
+            "bytes": self.bytes_written,
+            "avg_write_s": self.write_time_s / self.written if self.written else 0.0,
+        }
+
+    def _reserve(self, prefix: str, ext: str):
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        with self._lock:
+            while True:
+                path = os.path.join(self.output_dir, f"{prefix}{timestamp}_{next(self._counter):04d}.{ext}")
+                if path not in self._reserved and not os.path.exists(path):
+                    self._reserved.add(path)
+                    return path
+
+    def _write(self, image: Image.Image, path: str, options: OutputOptions):
+        """Пишет во временный файл рядом и связывает его с зарезервированным именем -
+        недописанных и пустых файлов в папке не бывает, чужой файл не перезаписывается"""
+        started = time.perf_counter()
+        tmp_path = f"{path}.part"
+        try:
+            with tracer.span("save", format=options.format):
+                if options.format == "jpeg" and image.mode != "RGB":
+                    image = image.convert("RGB")
+                with open(tmp_path, "wb") as f:
+                    image.save(f, **options.save_kwargs())
+                self._publish(tmp_path, path)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"Ошибка сохранения {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        finally:
+            with self._lock:
+                self._reserved.discard(path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self.write_time_s += time.perf_counter() - started
+            self.bytes_written += size
+            self.written += 1
+        print(f"Сохранено: {path}")
+
+    @staticmethod
+    def _publish(tmp_path: str, path: str):
+        try:
+            # жёсткая ссылка не создаётся, если имя уже занято
+            os.link(tmp_path, path)
+        except FileExistsError:
+            raise
+        except OSError:
+            # ФС без жёстких ссылок: имя и так зарезервировано в памяти
+            os.replace(tmp_path, path)
+        else:
+            os.remove(tmp_path)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+        self._slots.release()
@@ -0,0 +1,224 @@
+import glob
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from config import USER_AGENT, BULK_MAX_WORKERS, BULK_RATE_PER_HOST, BULK_MAX_RETRIES
+from parsers.download_index import DownloadIndex
+
+# на эти коды повторять тот же URL бессмысленно - сразу следующий размер
+NEXT_VARIANT_STATUSES = {403, 404, 410}
+IMAGE_HEADERS = {
+    "Referer": "https://www.pinterest.com/",
+    "User-Agent": USER_AGENT,
+    "Accept": "image/webp,image/apng,image/*,*/*;q=0.8",
+}
+
+
+class HostRateLimiter:
+    """Не чаще rate запросов в секунду на каждый хост"""
+
+    def __init__(self, rate: float = BULK_RATE_PER_HOST):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.waited_s = 0.0
+
+    def wait(self, url: str):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.interval
+            delay = slot - now
+            self.waited_s += delay
+        if delay > 0:
+            time.sleep(delay)
+
+
+@dataclass
+class BulkResult:
+    requested: int = 0
+    downloaded: int = 0
+    skipped: int = 0
+    duplicates: int = 0
+    failed: int = 0
+    bytes: int = 0
+    original_bytes: int = 0 #сколько весили бы /originals/ тех пинов, чей размер известен
+    measured_bytes: int = 0 #сколько реально скачано по тем же пинам
+    measured: int = 0
+    requests: int = 0
+    retries: int = 0
+    elapsed_s: float = 0.0
+    rate_wait_s: float = 0.0
+    variants: Dict[str, int] = field(default_factory=dict)
+    paths: List[str] = field(default_factory=list)
+
+    def summary(self) -> str:
+        elapsed = max(self.elapsed_s, 1e-9)
+        variants = ", ".join(f"{k}: {v}" for k, v in sorted(self.variants.items())) or "-"
+        summary = (
+            f"Скачано {self.downloaded}/{self.requested} (пропущено {self.skipped}, "
+            f"дубликатов {self.duplicates}, ошибок {self.failed}) "
+            f"за {self.elapsed_s:.1f} с: {self.downloaded / elapsed:.1f} файлов/с, "
+            f"{self.bytes / 2**20 / elapsed:.2f} MB/с, {self.bytes / 2**20:.1f} MB всего\n"
+            f"HTTP запросов {self.requests}, повторов {self.retries}, "
+            f"ожидание лимита {self.rate_wait_s:.1f} с; размеры: {variants}"
+        )
+        if self.measured:
+            # размер /originals/ известен, только если он скачан сам или включён measure_savings
+            summary += (
+                f"\nСэкономлено относительно /originals/: {self.bytes_saved / 2**20:.1f} MB "
+                f"({self.bytes_saved / max(self.original_bytes, 1):.0%}) по {self.measured} пинам"
+            )
+        return summary
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.measured_bytes
+
+
+class BulkDownloader:
+    """Параллельная загрузка многих пинов через общий пул соединений
+
+    Каждый пин пробуется по цепочке размеров (originals -> 736x -> 564x -> ...),
+    временные ошибки повторяются с экспоненциальной задержкой, файл появляется
+    в out_dir только целиком (запись во временный файл и os.replace).
+    С индексом известные URL пропускаются до сети, а визуальные дубликаты
+    удаляются сразу после загрузки.
+    """
+
+    def __init__(self, downloader, max_workers: int = BULK_MAX_WORKERS,
+                 rate_per_host: float = BULK_RATE_PER_HOST, max_retries: int = BULK_MAX_RETRIES,
+                 timeout: int = 30, index: Optional[DownloadIndex] = None):
+        self.downloader = downloader
+        self.session: requests.Session = downloader.session
+        self.max_workers = max(1, max_workers)
+        self.limiter = HostRateLimiter(rate_per_host)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.index = index
+        self._lock = threading.Lock()
+
+    def download_all(self, urls: List[str], out_dir: str, limit: Optional[int] = None) -> BulkResult:
+        os.makedirs(out_dir, exist_ok=True)
+        originals = list(dict.fromkeys(self.downloader.upgrade_to_original(u) for u in urls))
+        if limit is not None:
+            originals = originals[:limit]
+        result = BulkResult(requested=len(originals))
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pin-dl") as pool:
+            futures = {pool.submit(self._download_one, url, out_dir, result): url for url in originals}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    with self._lock:
+                        result.failed += 1
+                    print(f"Не удалось скачать {futures[future]}: {e}")
+        result.elapsed_s = time.perf_counter() - started
+        result.rate_wait_s = self.limiter.waited_s
+        print(result.summary())
+        return result
+
+    def _download_one(self, url: str, out_dir: str, result: BulkResult):
+        stem = os.path.splitext(self.downloader.filename_for(url))[0]
+        if self.index is not None:
+            known = self.index.has_url(url)
+        else:
+            known = bool(glob.glob(os.path.join(glob.escape(out_dir), f"{stem}.*")))
+        if known:
+            with self._lock:
+                result.skipped += 1
+            return
+        last_error = None
+        for variant in self.downloader.size_variants(url, self.downloader.opts.target_size):
+            try:
+                path, size = self._fetch(variant, out_dir, stem, result)
+            except (requests.HTTPError, ValueError) as e:
+                last_error = e
+                continue
+            if self.index is not None and self.index.add(path, urls=(url, variant)).duplicate:
+                with self._lock:
+                    result.duplicates += 1
+                return
+            original = size if variant == url else self._original_size(url)
+            with self._lock:
+                if original:
+                    result.measured += 1
+                    result.original_bytes += original
+                    result.measured_bytes += size
+                result.downloaded += 1
+                result.bytes += size
+                result.paths.append(path)
+                key = variant.split("/")[3] if variant.count("/") > 3 else "?"
+                result.variants[key] = result.variants.get(key, 0) + 1
+            return
+        raise last_error or ValueError("нет вариантов URL")
+
+    def _original_size(self, url: str) -> Optional[int]:
+        if not self.downloader.opts.measure_savings:
+            return None
+        self.limiter.wait(url)
+        return self.downloader.original_size(url)
+
+    def _fetch(self, url: str, out_dir: str, stem: str, result: BulkResult):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait(url)
+            with self._lock:
+                result.requests += 1
+            try:
+                with self.session.get(url, headers=IMAGE_HEADERS, stream=True, timeout=self.timeout) as r:
+                    if r.status_code in NEXT_VARIANT_STATUSES:
+                        raise requests.HTTPError(f"{r.status_code} для {url}", response=r)
+                    if r.status_code == 429 or r.status_code >= 500:
+                        raise requests.ConnectionError(f"{r.status_code} для {url}", response=r)
+                    r.raise_for_status()
+                    content_type = r.headers.get("Content-Type", "")
+                    if not content_type.startswith("image/"):
+                        raise ValueError(f"Не картинка: {url} (Content-Type={content_type})")
+                    ext = os.path.splitext(self.downloader.filename_for(url, content_type))[1]
+                    path = os.path.join(out_dir, f"{stem}{ext}")
+                    return path, write_atomic(path, r.iter_content(chunk_size=65536))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    result.retries += 1
+                time.sleep(backoff_delay(attempt, getattr(e, "response", None)))
+
+
+def backoff_delay(attempt: int, response: Optional[requests.Response] = None) -> float:
+    """Экспоненциальная задержка с джиттером; Retry-After сервера важнее"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+    return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+
+
+def write_atomic(path: str, chunks) -> int:
+    """Пишет во временный файл рядом и переименовывает - недокачанных файлов в папке не бывает"""
+    tmp_path = f"{path}.{threading.get_ident()}.part"
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                if chunk:
+                    f.write(chunk)
+                    size += len(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size
@@ -0,0 +1,260 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageStat
+
+from config import DOWNLOAD_INDEX_NAME, DEDUP_MAX_DISTANCE, DEDUP_MIN_CONTRAST
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    sha256 TEXT NOT NULL UNIQUE,
+    dhash INTEGER,
+    bytes INTEGER NOT NULL,
+    added_at REAL NOT NULL,
+    used_at REAL
+);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    image_id INTEGER NOT NULL REFERENCES images(id)
+);
+CREATE INDEX IF NOT EXISTS images_unused ON images(used_at, added_at);
+"""
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def dhash(path: str, size: int = 8, min_contrast: float = DEDUP_MIN_CONTRAST) -> Optional[int]:
+    """Разностный хэш: size*size бит, устойчив к пересжатию и смене размера
+
+    Для почти однотонных картинок возвращает None: их градиенты - шум сжатия,
+    и хэши разных картинок совпадают.
+    """
+    try:
+        with Image.open(path) as img:
+            img.draft("L", (size * 8, size * 8))
+            gray = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+            pixels = list(gray.getdata())
+    except (OSError, ValueError):
+        return None
+    if ImageStat.Stat(gray).stddev[0] < min_contrast:
+        return None
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    # SQLite хранит знаковые 64-битные числа
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hamming(a: int, b: int) -> int:
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
+
+
+@dataclass
+class IndexedImage:
+    path: str
+    duplicate: bool = False
+    reason: str = ""
+
+
+class DownloadIndex:
+    """SQLite индекс скачанных пинов в папке загрузок
+
+    URL (и все его варианты размеров) -> файл, плюс SHA-256 содержимого и dHash
+    для поиска визуальных дубликатов. Файлы хранятся по имени относительно папки.
+    Записи не удаляются после использования картинки, чтобы тот же пин не
+    скачивался повторно.
+    """
+
+    def __init__(self, folder: str, name: str = DOWNLOAD_INDEX_NAME, max_distance: int = DEDUP_MAX_DISTANCE):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(folder, name), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._hashes: List[Tuple[int, int]] = [
+            (row[0], row[1]) for row in self._conn.execute("SELECT id, dhash FROM images WHERE dhash IS NOT NULL")
+        ]
+        self.url_hits = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def has_url(self, url: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM urls WHERE url = ?", (url,)).fetchone()
+        if row:
+            self.url_hits += 1
+        return row is not None
+
+    def add(self, path: str, urls: Tuple[str, ...] = (), owned: bool = True) -> IndexedImage:
+        """Регистрирует скачанный файл; дубликат удаляется, а его URL привязываются к оригиналу
+
+        owned=False - файл положили в папку в обход загрузчика: он никогда не
+        удаляется, точная копия только не попадает в индекс, а похожая по dHash
+        индексируется как отдельная картинка.
+        """
+        name = os.path.basename(path)
+        sha = file_sha256(path)
+        phash = dhash(path)
+        with self._lock:
+            row = self._conn.execute("SELECT id, name FROM images WHERE sha256 = ?", (sha,)).fetchone()
+            reason = "sha256"
+            if row is None and phash is not None and owned:
+                row = self._nearest(phash)
+                reason = "dhash"
+            if row is not None and row[1] != name:
+                self._link_urls(row[0], urls)
+                self._conn.commit()
+                if reason == "sha256":
+                    self.exact_duplicates += 1
+                else:
+                    self.near_duplicates += 1
+                if owned:
+                    os.remove(path)
+                return IndexedImage(path=os.path.join(self.folder, row[1]), duplicate=True, reason=reason)
+            if row is None:
+                image_id = self._upsert(name, sha, phash, os.path.getsize(path))
+            else:
+                image_id = row[0]
+            self._link_urls(image_id, urls)
+            self._conn.commit()
+        return IndexedImage(path=os.path.join(self.folder, name))
+
+    def next_unused(self, exclude=()) -> Optional[str]:
+        """Самая старая неиспользованная картинка не из exclude; папка сканируется, только если индекс пуст"""
+        path = self._first_unused(exclude)
+        if path is None and self.sync():
+            path = self._first_unused(exclude)
+        return path
+
+    def mark_used(self, path: str):
+        with self._lock:
+            self._conn.execute("UPDATE images SET used_at = ? WHERE name = ?", (time.time(), os.path.basename(path)))
+            self._conn.commit()
+
+    def sync(self) -> int:
+        """Добавляет в индекс файлы, положенные в папку в обход загрузчика; ничего не удаляет"""
+        with self._lock:
+            known = {row[0] for row in self._conn.execute("SELECT name FROM images")}
+        added = 0
+        for entry in os.scandir(self.folder):
+            if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if entry.name not in known and not self.add(entry.path, owned=False).duplicate:
+                added += 1
+        if added:
+            print(f"В индекс загрузок добавлено файлов: {added}")
+        return added
+
+    def stats(self) -> dict:
+        with self._lock:
+            images, unused = self._conn.execute(
+                "SELECT COUNT(*), COUNT(*) - COUNT(used_at) FROM images"
+            ).fetchone()
+            urls = self._conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+        return {
+            "images": images,
+            "unused": unused,
+            "urls": urls,
+            "url_hits": self.url_hits,
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _first_unused(self, exclude=()) -> Optional[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name FROM images WHERE used_at IS NULL ORDER BY added_at, id"
+            ).fetchall()
+        for (name,) in rows:
+            path = os.path.join(self.folder, name)
+            if path in exclude:
+                continue
+            if os.path.exists(path):
+                return path
+            # файл удалили руками - больше не предлагаем
+            self.mark_used(path)
+        return None
+
+    def _nearest(self, phash: int):
+        best = None
+        for image_id, other in self._hashes:
+            distance = hamming(phash, other)
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, image_id)
+        if best is None:
+            return None
+        return self._conn.execute("SELECT id, name FROM images WHERE id = ?", (best[1],)).fetchone()
+
+    def _upsert(self, name: str, sha: str, phash: Optional[int], size: int) -> int:
+        # то же имя могло остаться от использованной и удалённой картинки
+        row = self._conn.execute("SELECT id FROM images WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            cur = self._conn.execute(
+                "INSERT INTO images (name, sha256, dhash, bytes, added_at) VALUES (?, ?, ?, ?, ?)",
+                (name, sha, phash, size, time.time()),
+            )
+            image_id = cur.lastrowid
+        else:
+            image_id = row[0]
+            self._conn.execute(
+                "UPDATE images SET sha256 = ?, dhash = ?, bytes = ?, added_at = ?, used_at = NULL WHERE id = ?",
+                (sha, phash, size, time.time(), image_id),
+            )
+            self._hashes = [(i, h) for i, h in self._hashes if i != image_id]
+        if phash is not None:
+            self._hashes.append((image_id, phash))
+        return image_id
+
+    def _link_urls(self, image_id: int, urls):
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO urls (url, image_id) VALUES (?, ?)",
+            [(url, image_id) for url in urls],
+        )
+
+
+_indexes: Dict[str, DownloadIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def shared_index(folder: str, name: str = DOWNLOAD_INDEX_NAME) -> DownloadIndex:
+    """Один индекс (соединение sqlite и таблица dHash) на папку на весь процесс"""
+    key = os.path.abspath(os.path.join(folder, name))
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = DownloadIndex(folder, name)
+        return index
+
+
+@atexit.register
+def close_all():
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+        _indexes.clear()
+    for index in indexes:
+        index.close()
@@ -0,0 +1,133 @@
+import atexit
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+from config import DRIVER_POOL_SIZE, DRIVER_MAX_PAGES
+
+
+class PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+
+class DriverPool:
+    """Держит прогретые Chrome драйверы между вызовами run()
+
+    Драйвер пересоздаётся после max_pages страниц или если он упал.
+    Таймаут ожидания (медленная страница) падением не считается.
+    """
+
+    def __init__(self, factory: Callable, size: int = DRIVER_POOL_SIZE, max_pages: int = DRIVER_MAX_PAGES):
+        self.factory = factory
+        self.max_pages = max_pages
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._all = set()
+        self._closed = False
+        self.created = 0
+        self.recycled = 0
+        self.crashed = 0
+        self.reused = 0
+        self.timeouts = 0
+
+    @contextmanager
+    def driver(self):
+        """Выдаёт драйвер из пула; при падении драйвер выбрасывается, а не возвращается"""
+        if self._closed:
+            raise RuntimeError("Пул драйверов закрыт")
+        self._slots.acquire()
+        pooled = None
+        try:
+            pooled = self._take()
+            yield pooled.driver
+        except TimeoutException:
+            # подкласс WebDriverException, но драйвер жив - возвращаем его в пул
+            self.timeouts += 1
+            raise
+        except WebDriverException:
+            self.crashed += 1
+            self._discard(pooled)
+            pooled = None
+            raise
+        finally:
+            if pooled is not None:
+                pooled.pages += 1
+                if pooled.pages >= self.max_pages or self._closed:
+                    self.recycled += 1
+                    self._discard(pooled)
+                else:
+                    self._idle.put(pooled)
+            self._slots.release()
+
+    def shutdown(self):
+        """Закрывает все драйверы"""
+        self._closed = True
+        with self._lock:
+            drivers = list(self._all)
+        for pooled in drivers:
+            self._discard(pooled)
+
+    def stats(self) -> dict:
+        return {
+            "alive": len(self._all),
+            "created": self.created,
+            "reused": self.reused,
+            "recycled": self.recycled,
+            "crashed": self.crashed,
+            "timeouts": self.timeouts,
+        }
+
+    def _take(self) -> PooledDriver:
+        try:
+            pooled = self._idle.get_nowait()
+            self.reused += 1
+            return pooled
+        except queue.Empty:
+            pass
+        print("Запуск нового Chrome для пула")
+        pooled = PooledDriver(self.factory())
+        with self._lock:
+            self._all.add(pooled)
+        self.created += 1
+        return pooled
+
+    def _discard(self, pooled):
+        if pooled is None:
+            return
+        with self._lock:
+            if pooled not in self._all:
+                return
+            self._all.discard(pooled)
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            print(f"Не удалось закрыть драйвер: {e}")
+
+
+_pools: Dict[bool, DriverPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_driver_pool(factory: Callable, headless: bool = True) -> DriverPool:
+    """Общий пул на процесс (отдельный для headless и обычного режима)"""
+    with _pools_lock:
+        pool = _pools.get(headless)
+        if pool is None:
+            pool = DriverPool(factory)
+            _pools[headless] = pool
+        return pool
+
+
+@atexit.register
+def shutdown_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
@@ -0,0 +1,107 @@
+import json
+import re
+from html.parser import HTMLParser
+from typing import Iterable, List
+
+from config import PINIMG_HOSTS
+
+HOST_PATTERN = re.compile("|".join(re.escape(host) for host in PINIMG_HOSTS))
+SIZE_PATTERN = re.compile(r'/\d{2,3}x\d{2,3}/')
+SKIP_WORDS_PATTERN = re.compile(r'avatar|icon|logo')
+PWS_DATA_ID = "__PWS_DATA__"
+TAG_NAME_PATTERN = re.compile(r'<([a-zA-Z][^\t\n\r\f />\x00]*)')
+PIN_MEDIA_PATTERN = re.compile(r'data-pin-media', re.I)
+# теги, которые надо разбирать полностью: интересные нам и меняющие режим парсера
+FULL_PARSE_TAGS = frozenset({
+    "img", "script", "style", "textarea", "title", "xmp", "iframe",
+    "noembed", "noframes", "noscript", "plaintext",
+})
+
+
+class PinimgExtractor(HTMLParser):
+    """Один потоковый проход по HTML без построения DOM
+
+    Собирает pinimg URL из <img src/data-src/srcset>, из data-pin-media любых
+    тегов и JSON из первого <script id="__PWS_DATA__">.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.img_urls: List[str] = []
+        self.media_urls: List[str] = []
+        self.pws_chunks: List[str] = []
+        self._pws_seen = False
+        self._in_pws = False
+
+    def parse_starttag(self, i):
+        # атрибуты div/span/a и прочих тегов без data-pin-media не нужны - пропускаем их разбор
+        end = self.check_for_whole_start_tag(i)
+        if end < 0:
+            return end
+        match = TAG_NAME_PATTERN.match(self.rawdata, i, end)
+        if (match and match.group(1).lower() not in FULL_PARSE_TAGS
+                and not PIN_MEDIA_PATTERN.search(self.rawdata, i, end)):
+            return end
+        return super().parse_starttag(i)
+
+    def handle_starttag(self, tag, attrs):
+        attr_map = dict(attrs)
+        if tag == "img":
+            for name in ("src", "data-src"):
+                value = attr_map.get(name)
+                if value and HOST_PATTERN.search(value):
+                    self.img_urls.append(value)
+            srcset = attr_map.get("srcset")
+            if srcset:
+                for candidate in srcset.split(","):
+                    u = candidate.strip().split(" ")[0]
+                    if HOST_PATTERN.search(u):
+                        self.img_urls.append(u)
+        elif tag == "script" and not self._pws_seen and attr_map.get("id") == PWS_DATA_ID:
+            self._pws_seen = True
+            self._in_pws = True
+        media = attr_map.get("data-pin-media")
+        if media and HOST_PATTERN.search(media):
+            self.media_urls.append(media)
+
+    def handle_endtag(self, tag):
+        if tag == "script":
+            self._in_pws = False
+
+    def handle_data(self, data):
+        if self._in_pws:
+            self.pws_chunks.append(data)
+
+    def pws_urls(self) -> List[str]:
+        text = "".join(self.pws_chunks)
+        if not text:
+            return []
+        urls = []
+        data = json.loads(text)
+        pins = data.get("props", {}).get("initialReduxState", {}).get("pins", {})
+        for _, pin_data in pins.items():
+            images = pin_data.get("images", {})
+            for size in images.values():
+                if isinstance(size, dict) and "url" in size:
+                    urls.append(size["url"])
+        return urls
+
+
+def filter_urls(urls: Iterable[str]) -> List[str]:
+    return [
+        url for url in set(urls)
+        if not SIZE_PATTERN.search(url) and not SKIP_WORDS_PATTERN.search(url.lower())
+    ]
+
+
+def extract_image_urls_stream(chunks: Iterable[str]) -> List[str]:
+    """То же, что extract_image_urls, но по кускам (например, из iter_content)"""
+    parser = PinimgExtractor()
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+    return filter_urls(parser.pws_urls() + parser.img_urls + parser.media_urls)
+
+
+def extract_image_urls(html: str) -> List[str]:
+    return extract_image_urls_stream((html,))
@@ -3,19 +3,23 @@ import json
 import os
 import random
 import re
-import time
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options as ChromeOptions
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
+from config import USER_AGENT, PINIMG_HOSTS, MIN_HTTP_PINS, BULK_MAX_WORKERS, BULK_RATE_PER_HOST, PIN_VARIANT_WIDTHS
+from parsers.bulk import BulkDownloader, BulkResult, IMAGE_HEADERS, write_atomic
+from parsers.download_index import shared_index
+from parsers.extract import extract_image_urls
+from tracing import tracer
+
+if TYPE_CHECKING:
+    from selenium import webdriver
+
+PWS_SCRIPT_PATTERN = re.compile(r'<script\b[^>]*\bid=["\']__PWS_DATA__["\'][^>]*>(.*?)</script>', re.S | re.I)
 
-from config import USER_AGENT, PINIMG_HOSTS
 @dataclass
 class Options:
     url: str
@@ -23,12 +27,25 @@ class Options:
     timeout: int = 20
     cookie: Optional[str] = None
     proxy: Optional[str] = None
+    http_first: bool = True
+    min_http_pins: int = MIN_HTTP_PINS
+    record_dir: Optional[str] = None
+    max_workers: int = BULK_MAX_WORKERS
+    rate_per_host: float = BULK_RATE_PER_HOST
+    use_index: bool = True
+    target_size: Optional[Tuple[int, int]] = None #(width, height) генерации; None - всегда /originals/
+    measure_savings: bool = False #диагностика: лишний HEAD к /originals/ на пин, чтобы посчитать сэкономленные байты
 
 
 class PinterestDownloader:
+    source_counts = {"http": 0, "selenium": 0}
+
     def __init__(self, opts: Options):
         self.opts = opts
         self.session = self.make_session()
+        self.last_source: Optional[str] = None
+        self.index = shared_index(opts.out_dir) if opts.use_index else None
+        self.last_variant: Optional[str] = None
 
     def make_session(self) -> requests.Session:
         s = requests.Session()
@@ -43,13 +60,20 @@ class PinterestDownloader:
         if self.opts.cookie:
             headers["Cookie"] = self.opts.cookie
         s.headers.update(headers)
+        # соединений на хост столько же, сколько потоков массовой загрузки
+        adapter = HTTPAdapter(pool_connections=len(PINIMG_HOSTS) + 1, pool_maxsize=max(1, self.opts.max_workers))
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
         if self.opts.proxy:
             s.proxies.update({"http": self.opts.proxy, "https": self.opts.proxy})
         s.timeout = self.opts.timeout
         return s
 
     @staticmethod
-    def setup_chrome_driver(headless: bool = True) -> webdriver.Chrome:
+    def setup_chrome_driver(headless: bool = True) -> "webdriver.Chrome":
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options as ChromeOptions
+
         chrome_options = ChromeOptions()
         if headless:
             chrome_options.add_argument("--headless=new")
@@ -74,64 +98,93 @@ class PinterestDownloader:
         driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
         return driver
 
+    def fetch_html(self, url: str) -> str:
+        """Сначала обычный GET + __PWS_DATA__, браузер - только если данных мало"""
+        with tracer.span("pinterest_fetch") as span:
+            html = self._fetch_html(url)
+            span["source"] = self.last_source
+            span["chars"] = len(html)
+        return html
+
+    def _fetch_html(self, url: str) -> str:
+        if self.opts.http_first:
+            try:
+                html = self.fetch_html_http(url)
+                pins = self.count_pws_pins(html)
+                if pins >= self.opts.min_http_pins:
+                    return self._served(url, html, "http")
+                print(f"В HTTP ответе мало пинов ({pins}), переходим на Selenium")
+            except (requests.RequestException, ValueError) as e:
+                print(f"HTTP загрузка не удалась ({e}), переходим на Selenium")
+        return self._served(url, self.fetch_html_selenium(url), "selenium")
+
+    def fetch_html_http(self, url: str) -> str:
+        r = self.session.get(url, timeout=self.opts.timeout)
+        r.raise_for_status()
+        return r.text
+
+    @staticmethod
+    def count_pws_pins(html: str) -> int:
+        match = PWS_SCRIPT_PATTERN.search(html)
+        if not match:
+            return 0
+        data = json.loads(match.group(1))
+        # неожиданная форма страницы - это ноль пинов (и переход на Selenium), а не падение
+        for key in ("props", "initialReduxState", "pins"):
+            if not isinstance(data, dict):
+                return 0
+            data = data.get(key)
+        return len(data) if isinstance(data, dict) else 0
+
+    def _served(self, url: str, html: str, source: str) -> str:
+        self.last_source = source
+        PinterestDownloader.source_counts[source] += 1
+        print(f"Страница получена через {source}")
+        if self.opts.record_dir:
+            os.makedirs(self.opts.record_dir, exist_ok=True)
+            name = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+            with open(os.path.join(self.opts.record_dir, f"{source}_{name}.html"), "w", encoding="utf-8") as f:
+                f.write(html)
+        return html
+
     @classmethod
     def fetch_html_selenium(cls, url: str, headless: bool = True, max_retries: int = 3) -> str:
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from parsers.driver_pool import get_driver_pool
+
+        pool = get_driver_pool(lambda: cls.setup_chrome_driver(headless), headless)
         for attempt in range(max_retries):
-            driver = cls.setup_chrome_driver(headless)
             print(f"Попытка {attempt + 1}: Загружаем страницу...")
-            driver.get(url)
-            wait = WebDriverWait(driver, 15)
-            wait.until(lambda d: d.find_element(By.TAG_NAME, "img") or d.find_element(By.ID, "__PWS_DATA__"))
-            driver.execute_script("window.scrollTo(0, document.body.scrollHeight/2);")
-            time.sleep(2)
-            driver.execute_script("window.scrollTo(0, 0);")
-            time.sleep(1)
-            html = driver.page_source
-            driver.quit()
+            try:
+                with pool.driver() as driver:
+                    driver.get(url)
+                    wait = WebDriverWait(driver, 15)
+                    wait.until(lambda d: d.execute_script("return document.readyState") == "complete")
+                    wait.until(lambda d: d.find_element(By.TAG_NAME, "img") or d.find_element(By.ID, "__PWS_DATA__"))
+                    images = driver.execute_script("return document.images.length")
+                    driver.execute_script("window.scrollTo(0, document.body.scrollHeight/2);")
+                    try:
+                        WebDriverWait(driver, 3, poll_frequency=0.2).until(
+                            lambda d: d.execute_script("return document.images.length") > images
+                        )
+                    except TimeoutException:
+                        pass
+                    driver.execute_script("window.scrollTo(0, 0);")
+                    html = driver.page_source
+            except WebDriverException as e:
+                print(f"Драйвер упал: {e}")
+                if attempt == max_retries - 1:
+                    raise
+                continue
             if len(html) < 1000:
                 raise ValueError("Получена слишком короткая страница")
             return html
 
     @staticmethod
     def extract_image_urls(html: str) -> List[str]:
-        soup = BeautifulSoup(html, "html.parser")
-        urls: List[str] = []
-        data_script = soup.find("script", {"id": "__PWS_DATA__"})
-        if data_script and data_script.string:
-            data = json.loads(data_script.string)
-            pins = data.get("props", {}).get("initialReduxState", {}).get("pins", {})
-            for _, pin_data in pins.items():
-                images = pin_data.get("images", {})
-                for size in images.values():
-                    if isinstance(size, dict) and "url" in size:
-                        urls.append(size["url"])
-        for img in soup.find_all("img"):
-            if img.has_attr("src"):
-                src = img["src"]
-                if any(host in src for host in PINIMG_HOSTS):
-                    urls.append(src)
-            if img.has_attr("data-src"):
-                data_src = img["data-src"]
-                if any(host in data_src for host in PINIMG_HOSTS):
-                    urls.append(data_src)
-            if img.has_attr("srcset"):
-                for candidate in img["srcset"].split(","):
-                    u = candidate.strip().split(" ")[0]
-                    if any(host in u for host in PINIMG_HOSTS):
-                        urls.append(u)
-        for element in soup.find_all(attrs={"data-pin-media": True}):
-            media_url = element.get("data-pin-media")
-            if media_url and any(host in media_url for host in PINIMG_HOSTS):
-                urls.append(media_url)
-        unique_urls = list(set(urls))
-        filtered_urls = []
-        for url in unique_urls:
-            if re.search(r'/\d{2,3}x\d{2,3}/', url):
-                continue
-            if any(word in url.lower() for word in ['avatar', 'icon', 'logo']):
-                continue
-            filtered_urls.append(url)
-        return filtered_urls
+        return extract_image_urls(html)
 
     @staticmethod
     def upgrade_to_original(url: str) -> str:
@@ -139,6 +192,54 @@ class PinterestDownloader:
         url = re.sub(r'/\d{2,4}x/', '/originals/', url)
         return url
 
+    @staticmethod
+    def required_width(target_size: Optional[Tuple[int, int]]) -> Optional[int]:
+        """Ширина варианта, которой хватит на target_size
+
+        Картинка потом растягивается ровно до width x height, а пины почти всегда
+        вертикальные или квадратные, поэтому берём большую из сторон.
+        """
+        if not target_size:
+            return None
+        return max(target_size)
+
+    @classmethod
+    def size_variants(cls, url: str, target_size: Optional[Tuple[int, int]] = None) -> List[str]:
+        """Цепочка URL одного пина, затем исходный URL
+
+        Без target_size - от оригинала к меньшим размерам. С target_size - от
+        наименьшего варианта, покрывающего разрешение, вверх до /originals/, а
+        после него меньшие варианты, чтобы хоть что-то скачать.
+        """
+        original_url = cls.upgrade_to_original(url)
+        need = cls.required_width(target_size)
+        if need is None:
+            urls_to_try = [
+                original_url,
+                re.sub(r'/originals/', '/736x/', original_url),
+                re.sub(r'/originals/', '/564x/', original_url),
+                url
+            ]
+        else:
+            covering = [w for w in PIN_VARIANT_WIDTHS if w >= need]
+            smaller = [w for w in reversed(PIN_VARIANT_WIDTHS) if w < need]
+            urls_to_try = (
+                [original_url.replace('/originals/', f'/{w}x/', 1) for w in covering]
+                + [original_url]
+                + [original_url.replace('/originals/', f'/{w}x/', 1) for w in smaller]
+                + [url]
+            )
+        return list(dict.fromkeys(urls_to_try))
+
+    def original_size(self, original_url: str) -> Optional[int]:
+        """Размер /originals/ по HEAD, для отчёта о сэкономленных байтах"""
+        try:
+            r = self.session.head(original_url, headers=IMAGE_HEADERS, timeout=self.opts.timeout, allow_redirects=True)
+        except requests.RequestException:
+            return None
+        length = r.headers.get("Content-Length", "")
+        return int(length) if r.ok and length.isdigit() else None
+
     @classmethod
     def pick_random(cls, urls: List[str]) -> Optional[str]:
         pinimg_urls = [u for u in urls if any(host in u for host in PINIMG_HOSTS)]
@@ -184,35 +285,69 @@ class PinterestDownloader:
             raise ValueError(f"Не картинка: {url} (Content-Type={content_type})")
         fname = self.filename_for(url, content_type)
         path = os.path.join(out_dir, fname)
-        with open(path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-        print(f"Скачано: {fname} ({os.path.getsize(path)} bytes)")
+        size = write_atomic(path, r.iter_content(chunk_size=65536))
+        print(f"Скачано: {fname} ({size} bytes)")
         return path
 
     def try_download_with_fallback(self, url: str, out_dir: str) -> str:
-        original_url = self.upgrade_to_original(url)
-        urls_to_try = [
-            original_url,
-            re.sub(r'/originals/', '/736x/', original_url),
-            re.sub(r'/originals/', '/564x/', original_url),
-            url
-        ]
-        for attempt_url in urls_to_try:
-            return self.download_image(attempt_url, out_dir)
+        last_error = None
+        for attempt_url in self.size_variants(url, self.opts.target_size):
+            try:
+                path = self.download_image(attempt_url, out_dir)
+                self.last_variant = attempt_url
+                return path
+            except (requests.HTTPError, ValueError) as e:
+                print(f"Не получилось {attempt_url}: {e}")
+                last_error = e
+        raise last_error
+
+    def run_bulk(self, limit: Optional[int] = None) -> BulkResult:
+        """Скачивает первые limit (или все) найденные пины параллельно"""
+        print(f"Массовая загрузка: {self.opts.url}")
+        html = self.fetch_html(self.opts.url)
+        urls = [u for u in self.traced_extract(html) if any(host in u for host in PINIMG_HOSTS)]
+        print(f"Найдено URL изображений: {len(urls)}")
+        bulk = BulkDownloader(self, max_workers=self.opts.max_workers, rate_per_host=self.opts.rate_per_host,
+                              index=self.index)
+        with tracer.span("pinterest_download", bulk=True) as span:
+            result = bulk.download_all(urls, self.opts.out_dir, limit=limit)
+            span["downloaded"] = result.downloaded
+            span["bytes"] = result.bytes
+        return result
+
+    def traced_extract(self, html: str) -> List[str]:
+        with tracer.span("pinterest_extract") as span:
+            urls = self.extract_image_urls(html)
+            span["urls"] = len(urls)
+        return urls
 
     def run(self) -> int:
         print(f"Начинаем обработку: {self.opts.url}")
-        html = self.fetch_html_selenium(self.opts.url)
-        print(f"HTML загружен, размер: {len(html)} символов")
-        urls = self.extract_image_urls(html)
+        html = self.fetch_html(self.opts.url)
+        print(f"HTML загружен ({self.last_source}), размер: {len(html)} символов")
+        urls = self.traced_extract(html)
         print(f"Найдено URL изображений: {len(urls)}")
         print("Примеры найденных URL:")
         for i, url in enumerate(urls[:5]):
             print(f"  {i+1}. {url}")
-        random_url = self.pick_random(urls)
-        print(f"Выбрано для скачивания: {random_url}")
-        out_path = self.try_download_with_fallback(random_url, self.opts.out_dir)
-        print(f"Успешно скачано: {out_path}")
+        if self.index is not None:
+            urls = [u for u in urls if not self.index.has_url(self.upgrade_to_original(u))]
+            print(f"Из них ещё не скачанных: {len(urls)}")
+        while True:
+            random_url = self.pick_random(urls)
+            if random_url is None:
+                raise ValueError("Не осталось новых изображений для скачивания")
+            print(f"Выбрано для скачивания: {random_url}")
+            with tracer.span("pinterest_download", bulk=False):
+                out_path = self.try_download_with_fallback(random_url, self.opts.out_dir)
+            if self.index is None or not self.index.add(out_path, urls=(random_url,)).duplicate:
+                break
+            print("Такая картинка уже есть, выбираем другую")
+            urls = [u for u in urls if self.upgrade_to_original(u) != random_url]
+        print(f"Успешно скачано: {out_path} ({self.last_variant})")
+        if self.opts.measure_savings and self.last_variant != random_url:
+            original = self.original_size(random_url)
+            if original:
+                saved = original - os.path.getsize(out_path)
+                print(f"Сэкономлено относительно /originals/: {saved / 2**10:.0f} KB ({saved / original:.0%})")
         return 0
\ No newline at end of file
@@ -1,12 +1,14 @@
 import os
 import shutil
 from PIL import Image
+from config import OUT_DIR, INPUT_FOLDER
+from parsers.download_index import shared_index
 
 class ImageMover:
-    def __init__(self):
-        self.source_folder = "D:/ttcreate/pin_downloads"
-        self.target_folder = "D:/ttcreate/input_folder"
-        self.image_extensions = ['.png', '.jpg', '.jpeg']
+    def __init__(self, source_folder: str = OUT_DIR, target_folder: str = INPUT_FOLDER):
+        self.source_folder = source_folder
+        self.target_folder = target_folder
+        self.index = shared_index(self.source_folder)
 
     def clear_target_folder(self):
         """Полностью очищает папку назначения."""
@@ -27,27 +29,26 @@ class ImageMover:
 
 
     def move_first_image(self):
-        """Перемещает и конвертирует первое найденное изображение в PNG"""
+        """Перемещает и конвертирует самое старое неиспользованное изображение из индекса в PNG"""
         self.clear_target_folder()
 
-        files = os.listdir(self.source_folder)
+        old_path = self.index.next_unused()
+        if old_path is None:
+            print(f"В {self.source_folder} нет новых изображений")
+            return
 
-        for file in sorted(files):
-            file_lower = file.lower()
-            if any(file_lower.endswith(ext) for ext in self.image_extensions):
-                old_path = os.path.join(self.source_folder, file)
-                new_path = os.path.join(self.target_folder, "input.png")
+        new_path = os.path.join(self.target_folder, "input.png")
 
-                with Image.open(old_path) as img:
-                    if img.mode not in ("RGB", "RGBA"):
-                        img = img.convert("RGBA")
-                    img.save(new_path, format="PNG")
+        with Image.open(old_path) as img:
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+            img.save(new_path, format="PNG")
 
-                if os.path.exists(new_path):
-                    os.remove(old_path)
+        if os.path.exists(new_path):
+            self.index.mark_used(old_path)
+            os.remove(old_path)
 
-                print(f"перемещено -> input.png")
-                return
+        print(f"перемещено -> input.png")
             
     def move_user_image(self, image_file):
         """Принимает файл изображения и конвертирует его в PNG
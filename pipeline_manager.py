@@ -0,0 +1,276 @@
+import gc
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import torch
+from diffusers import StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline
+
+from config import MODEL_ID, MODEL_VARIANT, CACHE_DIR, LORA_PATH, LORA_NAME, DEVICE
+from lora_manager import LoraManager, fused_checkpoint_path
+from model_store import BUNDLE_META, ModelStore, file_stamp
+from settings import MEMORY_MODES, SCHEDULERS
+from tracing import tracer
+
+PIPELINE_CLASSES = {
+    "txt2img": StableDiffusionXLPipeline,
+    "img2img": StableDiffusionXLImg2ImgPipeline,
+}
+
+
+def resolve_device(device: str = DEVICE) -> str:
+    """auto - cuda, если она есть, иначе cpu"""
+    if device == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return device
+
+
+def make_scheduler(name: str, base):
+    """Планировщик пресета SCHEDULERS на основе планировщика модели base"""
+    if name not in SCHEDULERS:
+        raise ValueError(f"Неизвестный планировщик: {name}")
+    preset = SCHEDULERS[name]
+    if preset.cls is None:
+        return base
+    import diffusers
+
+    return getattr(diffusers, preset.cls).from_config(base.config, **dict(preset.options))
+
+
+@dataclass(frozen=True)
+class PipelineKey:
+    model_id: str
+    mode: str
+    lora_path: Optional[str]
+    dtype: str
+    device: str
+
+    @property
+    def base(self) -> tuple:
+        """Ключ общих компонентов (UNet/VAE/энкодеры) - всё, кроме режима"""
+        return (self.model_id, self.lora_path, self.dtype, self.device)
+
+
+class PipelineManager:
+    """Держит загруженные SDXL пайплайны в памяти между генерациями"""
+
+    def __init__(self, model_id: str = MODEL_ID, device: str = DEVICE,
+                 dtype: Optional[torch.dtype] = None, cache_dir: Optional[str] = CACHE_DIR,
+                 variant: Optional[str] = MODEL_VARIANT, store: Optional[ModelStore] = None):
+        device = resolve_device(device)
+        if dtype is None:
+            dtype = torch.float16 if device.startswith("cuda") else torch.float32
+        self.model_id = model_id
+        self.device = device
+        self.dtype = dtype
+        self.cache_dir = cache_dir
+        self.variant = variant
+        self.store = store or ModelStore(cache_dir=cache_dir)
+        self._pipelines: Dict[PipelineKey, object] = {}
+        self._loras: Dict[tuple, LoraManager] = {}
+        self._load_ids: Dict[tuple, int] = {}
+        self._memory: Dict[tuple, str] = {}
+        self._schedulers: Dict[tuple, dict] = {}
+        self._lock = threading.RLock()
+        self.metrics = {
+            "loads": 0,
+            "load_time_s": 0.0,
+            "last_load_s": None,
+            "derived": 0,
+            "hits": 0,
+            "misses": 0,
+        }
+
+    def key_for(self, mode: str, lora_path: Optional[str] = LORA_PATH) -> PipelineKey:
+        if mode not in PIPELINE_CLASSES:
+            raise ValueError(f"Неизвестный режим: {mode}")
+        dtype_name = str(self.dtype).replace("torch.", "")
+        return PipelineKey(self.model_id, mode, lora_path, dtype_name, self.device)
+
+    def get(self, mode: str, lora_path: Optional[str] = LORA_PATH):
+        """Возвращает тёплый пайплайн, загружая его только при первом обращении"""
+        key = self.key_for(mode, lora_path)
+        with self._lock:
+            pipe = self._pipelines.get(key)
+            if pipe is not None:
+                self.metrics["hits"] += 1
+                return pipe
+
+            self.metrics["misses"] += 1
+            sibling = self._find_sibling(key)
+            if sibling is not None:
+                pipe = PIPELINE_CLASSES[key.mode](**sibling.components)
+                pipe.safety_checker = None
+                self.metrics["derived"] += 1
+                print(f"Пайплайн {key.mode} собран из уже загруженных компонентов")
+            else:
+                pipe = self._load(key)
+            self._pipelines[key] = pipe
+            return pipe
+
+    def lora(self, lora_path: Optional[str] = LORA_PATH) -> Optional[LoraManager]:
+        """LoRA менеджер общих компонентов (None, пока модель не загружена)"""
+        return self._loras.get(self.key_for("txt2img", lora_path).base)
+
+    def identity(self, lora_path: Optional[str] = LORA_PATH) -> tuple:
+        """Идентичность загруженных весов (модель, номер загрузки, состояние LoRA) для ключей кэшей"""
+        base = self.key_for("txt2img", lora_path).base
+        lora = self._loras.get(base)
+        return base + (self._load_ids.get(base), lora.signature if lora is not None else None)
+
+    def content_identity(self, lora_path: Optional[str] = LORA_PATH) -> tuple:
+        """Идентичность весов, стабильная между перезапусками, - для дискового кэша результатов
+
+        Вместо номера загрузки - ревизия снапшота и размер/mtime файлов LoRA,
+        вшитого чекпоинта и бандла: пересборка любого из них меняет ключ.
+        Пайплайн для этого грузить не нужно.
+        """
+        base = self.key_for("txt2img", lora_path).base
+        revision = self.store.manifest().get(self.model_id, {}).get("revision")
+        files = [preset.lora for preset in SCHEDULERS.values() if preset.lora]
+        if lora_path:
+            files += [
+                lora_path,
+                fused_checkpoint_path(self.model_id, lora_path),
+                os.path.join(self.store.bundle_path(self.model_id, lora_path), BUNDLE_META),
+            ]
+        return base + (revision,) + tuple(file_stamp(path) for path in files)
+
+    def vae_identity(self, lora_path: Optional[str] = LORA_PATH) -> tuple:
+        """Как identity, но без состояния LoRA - VAE она не меняет"""
+        base = self.key_for("txt2img", lora_path).base
+        return base + (self._load_ids.get(base),)
+
+    def apply_memory(self, mode: str, lora_path: Optional[str] = LORA_PATH):
+        """Включает режим памяти MEMORY_MODES на общих компонентах загруженных пайплайнов
+
+        Пайплайн грузится на CPU, на устройство веса переносит первый вызов:
+        целиком (.to) или через хуки выгрузки, если все веса не влезают.
+        """
+        policy = MEMORY_MODES[mode]
+        key = self.key_for("txt2img", lora_path)
+        with self._lock:
+            current = self._memory.get(key.base)
+            siblings = [pipe for k, pipe in self._pipelines.items() if k.base == key.base]
+            if not siblings:
+                return
+            self._memory[key.base] = mode
+            if current == mode:
+                return
+            pipe = siblings[0]
+            if policy.attention_slicing:
+                pipe.enable_attention_slicing()
+            else:
+                pipe.disable_attention_slicing()
+            if policy.vae_slicing:
+                pipe.vae.enable_slicing()
+            else:
+                pipe.vae.disable_slicing()
+            if policy.vae_tiling:
+                pipe.vae.enable_tiling()
+            else:
+                pipe.vae.disable_tiling()
+            if current is None or policy.offload != MEMORY_MODES[current].offload:
+                # хуки висят на общих модулях, но список хуков хранит пайплайн, который их ставил
+                for sibling in siblings:
+                    sibling.remove_all_hooks()
+                if policy.offload == "model":
+                    pipe.enable_model_cpu_offload(device=self.device)
+                elif policy.offload == "sequential":
+                    pipe.enable_sequential_cpu_offload(device=self.device)
+                else:
+                    pipe.to(self.device)
+        print(f"Режим памяти: {current or 'cpu'} -> {mode}")
+
+    def set_scheduler(self, name: str, lora_path: Optional[str] = LORA_PATH):
+        """Ставит планировщик пресета на тёплые пайплайны без перезагрузки весов"""
+        key = self.key_for("txt2img", lora_path)
+        with self._lock:
+            schedulers = self._schedulers.get(key.base)
+            if schedulers is None or schedulers["active"] == name:
+                return
+            scheduler = schedulers.get(name)
+            if scheduler is None:
+                scheduler = schedulers[name] = make_scheduler(name, schedulers["default"])
+            for k, pipe in self._pipelines.items():
+                if k.base == key.base:
+                    pipe.scheduler = scheduler
+            schedulers["active"] = name
+        print(f"Планировщик: {name} ({type(scheduler).__name__})")
+
+    def warmup(self, modes=("txt2img", "img2img"), lora_path: Optional[str] = LORA_PATH) -> float:
+        """Заранее загружает пайплайны, возвращает затраченное время"""
+        started = time.perf_counter()
+        for mode in modes:
+            self.get(mode, lora_path)
+        return time.perf_counter() - started
+
+    def release(self, mode: Optional[str] = None, lora_path: Optional[str] = LORA_PATH):
+        """Выгружает пайплайн режима (или все, если режим не указан)"""
+        with self._lock:
+            if mode is None:
+                self._pipelines.clear()
+                self._loras.clear()
+                self._memory.clear()
+                self._schedulers.clear()
+            else:
+                key = self.key_for(mode, lora_path)
+                self._pipelines.pop(key, None)
+                if self._find_sibling(key) is None:
+                    self._loras.pop(key.base, None)
+                    self._memory.pop(key.base, None)
+                    self._schedulers.pop(key.base, None)
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.metrics)
+            stats["resident"] = [f"{k.mode}:{k.model_id}" for k in self._pipelines]
+            stats["lora"] = {str(base[1]): lora.stats() for base, lora in self._loras.items()}
+            stats["store"] = self.store.stats()
+            stats["memory"] = {str(base[1]): mode for base, mode in self._memory.items()}
+            stats["scheduler"] = {str(base[1]): s["active"] for base, s in self._schedulers.items()}
+        return stats
+
+    def _find_sibling(self, key: PipelineKey):
+        for other_key, pipe in self._pipelines.items():
+            if other_key.base == key.base:
+                return pipe
+        return None
+
+    def _load(self, key: PipelineKey):
+        with tracer.span("pipeline_load", gpu=True, mode=key.mode, model=key.model_id):
+            return self._load_pipeline(key)
+
+    def _load_pipeline(self, key: PipelineKey):
+        print(f"Загрузка пайплайна {key.mode}: {key.model_id} ({key.dtype}, {key.device})")
+        started = time.perf_counter()
+
+        pipe, bundle = self.store.load(PIPELINE_CLASSES[key.mode], key.model_id, self.dtype,
+                                       self.variant, key.lora_path)
+        # на устройство веса переносит apply_memory: с выгрузкой они туда целиком не попадают
+
+        pipe.safety_checker = None
+        lora = LoraManager(pipe)
+        if key.lora_path:
+            fused_path = fused_checkpoint_path(key.model_id, key.lora_path)
+            if bundle is not None:
+                lora.set_baked(bundle["lora_contributions"])
+            elif os.path.exists(fused_path):
+                lora.load_fused(fused_path)
+            lora.add(LORA_NAME, key.lora_path)
+        self._loras[key.base] = lora
+        # планировщики пресетов строятся от конфига планировщика модели (или бандла)
+        self._schedulers[key.base] = {"active": "default", "default": pipe.scheduler}
+        self._load_ids[key.base] = self.metrics["loads"] + 1
+
+        elapsed = time.perf_counter() - started
+        self.metrics["loads"] += 1
+        self.metrics["load_time_s"] += elapsed
+        self.metrics["last_load_s"] = elapsed
+        print(f"Пайплайн загружен за {elapsed:.2f} с")
+        return pipe
@@ -1,21 +1,15 @@
+import json
 import os
-from dotenv import load_dotenv
-from openai import OpenAI
-
+import random
+import re
+import time
+from typing import List
 
-class PromptGenerator:
-    """генератор промптов"""
+from dotenv import load_dotenv
 
-    def __init__(self):
-        load_dotenv()
-        self.api_key = os.getenv("OPENAI_API_KEY")
-        self.client = OpenAI(api_key=self.api_key)
+from config import OPENAI_MODEL, OPENAI_MAX_RETRIES, ESSENTIAL_TAGS
 
-    def generate_prompt(self) -> str:
-        """
-        Генерирует промпт
-        """
-        system_prompt = """You are an expert in generating prompts for Stable Diffusion XL 
+SYSTEM_PROMPT = """You are an expert in generating prompts for Stable Diffusion XL 
 that create breakcore/glitch/datamosh aesthetic images with anime girls.
 
 CRITICAL STYLE ELEMENTS TO INCLUDE:
@@ -35,46 +29,127 @@ high contrast, neon colors, cybercore, webcore
 
 Generate ONE detailed positive prompt mixing these elements."""
 
+USER_PROMPT = (
+    "Generate a detailed Stable Diffusion XL prompt for an anime girl "
+    "with EXTREME breakcore/glitch/datamosh aesthetic.\n\n"
+    "Must include:\n"
+    "1. Specific glitch effects (RGB split, pixel sorting, scan lines)\n"
+    "2. Digital corruption elements (code overlay, terminal windows, UI glitches)\n"
+    "3. Neon color scheme (cyan, lime green, hot pink, electric blue)\n"
+    "4. High contrast with crushed blacks\n"
+    "5. Character details (hair, eyes, expression)\n"
+    "6. Atmosphere (cyberpunk, digital chaos, corrupted data)\n\n"
+    "Style references: datamosh art, net art, cybercore, webcore, Y2K aesthetic\n\n"
+    "Format: single paragraph, comma-separated keywords, no negative prompt."
+)
+
+BATCH_USER_PROMPT = (
+    USER_PROMPT
+    + "\n\nGenerate {count} different prompts. Answer with JSON only: "
+    '{{"prompts": ["prompt 1", "prompt 2", ...]}}'
+)
+
+JSON_LIST_PATTERN = re.compile(r"\[.*\]", re.DOTALL)
+
+
+def parse_prompt_list(text: str) -> List[str]:
+    """Достаёт список промптов из JSON ответа (объект с prompts или просто массив)"""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        match = JSON_LIST_PATTERN.search(text)
+        if not match:
+            return []
+        data = json.loads(match.group(0))
+    if isinstance(data, dict):
+        data = data.get("prompts", [])
+    return [str(p).strip() for p in data if str(p).strip()]
+
+
+def is_transient(error: Exception) -> bool:
+    """Сеть, таймаут, 429 и 5xx стоит повторить; 400/401/404 и прочее - нет"""
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class PromptGenerator:
+    """генератор промптов"""
+
+    def __init__(self, base_url: str = None, max_retries: int = OPENAI_MAX_RETRIES):
+        load_dotenv()
+        self.api_key = os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL") or None
+        self.max_retries = max_retries
+        self._client = None
+
+    @property
+    def client(self):
+        """OpenAI клиент создаётся при первом запросе - импорт openai не тормозит старт"""
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        return self._client
+
+    def generate_prompt(self) -> str:
+        """
+        Генерирует промпт
+        """
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
+            response = self._complete(
                 messages=[
-                    {"role": "system", "content": system_prompt},
-                    {
-                        "role": "user",
-                        "content": (
-                            "Generate a detailed Stable Diffusion XL prompt for an anime girl "
-                            "with EXTREME breakcore/glitch/datamosh aesthetic.\n\n"
-                            "Must include:\n"
-                            "1. Specific glitch effects (RGB split, pixel sorting, scan lines)\n"
-                            "2. Digital corruption elements (code overlay, terminal windows, UI glitches)\n"
-                            "3. Neon color scheme (cyan, lime green, hot pink, electric blue)\n"
-                            "4. High contrast with crushed blacks\n"
-                            "5. Character details (hair, eyes, expression)\n"
-                            "6. Atmosphere (cyberpunk, digital chaos, corrupted data)\n\n"
-                            "Style references: datamosh art, net art, cybercore, webcore, Y2K aesthetic\n\n"
-                            "Format: single paragraph, comma-separated keywords, no negative prompt."
-                        )
-                    }
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": USER_PROMPT}
                 ],
                 max_tokens=250,
                 temperature=0.95
             )
             
             prompt = response.choices[0].message.content.strip()
-
-            essential_tags = [
-                "glitch art", "datamosh", "chromatic aberration", 
-                "high contrast", "neon colors", "digital corruption"
-            ]
-            
-            prompt_lower = prompt.lower()
-            missing_tags = [tag for tag in essential_tags if tag not in prompt_lower]
-            
-            if missing_tags:
-                prompt += ", " + ", ".join(missing_tags)
-            
-            return prompt
+            return self.add_essential_tags(prompt)
             
         except Exception as e:
-            raise Exception(f"ошибка при генерации промпта: {str(e)}")
\ No newline at end of file
+            raise Exception(f"ошибка при генерации промпта: {str(e)}")
+
+    def generate_prompts(self, count: int) -> List[str]:
+        """
+        Генерирует count промптов одним запросом
+        """
+        try:
+            response = self._complete(
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": BATCH_USER_PROMPT.format(count=count)}
+                ],
+                max_tokens=250 * count,
+                temperature=0.95
+            )
+            prompts = parse_prompt_list(response.choices[0].message.content)
+            return [self.add_essential_tags(p) for p in prompts[:count]]
+
+        except Exception as e:
+            raise Exception(f"ошибка при генерации промптов: {str(e)}")
+
+    @staticmethod
+    def add_essential_tags(prompt: str) -> str:
+        prompt_lower = prompt.lower()
+        missing_tags = [tag for tag in ESSENTIAL_TAGS if tag not in prompt_lower]
+        
+        if missing_tags:
+            prompt += ", " + ", ".join(missing_tags)
+        
+        return prompt
+
+    def _complete(self, **kwargs):
+        """Запрос к LLM с повторами и экспоненциальной задержкой со случайным разбросом"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.client.chat.completions.create(model=OPENAI_MODEL, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient(e):
+                    raise
+                delay = min(30.0, 2 ** attempt) * random.uniform(0.5, 1.5)
+                print(f"LLM недоступна ({e}), повтор через {delay:.1f} с")
+                time.sleep(delay)
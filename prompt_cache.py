@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+import torch
+
+from config import PROMPT_CACHE_SIZE
+
+EMBED_NAMES = ("prompt_embeds", "negative_prompt_embeds", "pooled_prompt_embeds", "negative_pooled_prompt_embeds")
+
+
+class PromptEmbeddingCache:
+    """LRU кэш выходов текстовых энкодеров SDXL
+
+    Ключ - (промпт, негативный промпт, идентичность энкодеров, CFG). В идентичность
+    входит загруженная модель и состояние LoRA, потому что LoRA меняет энкодеры.
+    Без CFG (guidance <= 1, например LCM) негативный промпт не кодируется.
+    """
+
+    def __init__(self, max_entries: int = PROMPT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, pipe, prompt: str, negative_prompt: str, encoder_key, cfg: bool = True) -> tuple:
+        """Возвращает 4 тензора эмбеддингов для одного промпта (батч 1); без cfg негативные - None"""
+        if not cfg:
+            negative_prompt = None
+        key = (prompt, negative_prompt, encoder_key, cfg)
+        with self._lock:
+            embeds = self._entries.get(key)
+            if embeds is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embeds
+            self.misses += 1
+
+        with torch.no_grad():
+            prompt_embeds, negative_embeds, pooled, negative_pooled = pipe.encode_prompt(
+                prompt=prompt,
+                device=pipe._execution_device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=cfg,
+                negative_prompt=negative_prompt,
+            )
+        embeds = (prompt_embeds, negative_embeds, pooled, negative_pooled)
+
+        with self._lock:
+            self._entries[key] = embeds
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return embeds
+
+    def encode_batch(self, pipe, prompts: List[str], negative_prompts: List[str], encoder_key,
+                     cfg: bool = True) -> Dict[str, torch.Tensor]:
+        """Собирает аргументы prompt_embeds/... для вызова пайплайна на весь батч
+
+        cfg - включён ли classifier-free guidance (guidance_scale > 1) в этом вызове.
+        """
+        rows = [self.encode(pipe, p, n, encoder_key, cfg) for p, n in zip(prompts, negative_prompts)]
+        return {
+            name: torch.cat([row[i] for row in rows])
+            for i, name in enumerate(EMBED_NAMES)
+            if rows[0][i] is not None
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
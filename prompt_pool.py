@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+from collections import deque
+from typing import List, Optional
+
+from config import PROMPT_POOL_SIZE, PROMPT_POOL_LOW_WATER, PROMPT_POOL_CACHE
+from pompt_generator import PromptGenerator
+
+
+class PromptPool:
+    """Пул промптов от LLM: просит по batch_size штук за запрос и пополняется в фоне
+
+    Неиспользованные промпты хранятся на диске и переживают перезапуск.
+    Реализует тот же generate_prompt(), что и PromptGenerator.
+    """
+
+    def __init__(self, generator=None, batch_size: int = PROMPT_POOL_SIZE,
+                 low_water: int = PROMPT_POOL_LOW_WATER, cache_path: Optional[str] = PROMPT_POOL_CACHE):
+        if generator is None:
+            generator = PromptGenerator()
+        self.generator = generator
+        self.batch_size = batch_size
+        self.low_water = max(1, low_water)
+        self.cache_path = cache_path
+        self._prompts = deque(self._load())
+        self._lock = threading.Lock()
+        self._refill_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.requests = 0
+        self.served = 0
+        self.errors = 0
+
+    def generate_prompt(self) -> str:
+        """
+        Отдаёт промпт из пула; ждёт LLM, только если пул пуст
+        """
+        prompt = self._pop()
+        if prompt is None:
+            self._refill()
+            prompt = self._pop()
+            if prompt is None:
+                raise Exception("ошибка при генерации промпта: LLM не вернула ни одного промпта")
+        if self.size() < self.low_water:
+            self._refill_async()
+        return prompt
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._prompts)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size(),
+            "requests": self.requests,
+            "served": self.served,
+            "errors": self.errors,
+            "prompts_per_request": self.served / self.requests if self.requests else 0.0,
+        }
+
+    def _pop(self) -> Optional[str]:
+        with self._lock:
+            if not self._prompts:
+                return None
+            prompt = self._prompts.popleft()
+            self.served += 1
+        self._save()
+        return prompt
+
+    def _refill(self):
+        with self._refill_lock:
+            if self.size() >= self.low_water:
+                return
+            prompts = self.generator.generate_prompts(self.batch_size)
+            with self._lock:
+                self._prompts.extend(prompts)
+                self.requests += 1
+            self._save()
+            print(f"Пул промптов пополнен: +{len(prompts)}, всего {self.size()}")
+
+    def _refill_async(self):
+        if self._refill_lock.locked():
+            return
+        threading.Thread(target=self._refill_quietly, name="prompt-pool", daemon=True).start()
+
+    def _refill_quietly(self):
+        try:
+            self._refill()
+        except Exception as e:
+            self.errors += 1
+            print(f"Не удалось пополнить пул промптов: {e}")
+
+    def _load(self) -> List[str]:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return []
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                prompts = json.load(f)
+            print(f"Из кэша загружено промптов: {len(prompts)}")
+            return [p for p in prompts if isinstance(p, str)]
+        except (OSError, ValueError) as e:
+            print(f"Не удалось прочитать кэш промптов {self.cache_path}: {e}")
+            return []
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        with self._save_lock:
+            with self._lock:
+                prompts = list(self._prompts)
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(prompts, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Optional
+
+from PIL import Image, PngImagePlugin
+
+from config import RESULT_CACHE_DIR, RESULT_CACHE_MB
+from settings import Settings
+
+# поля Settings, которые влияют на то, как считать, но не на пиксели
+IGNORED_FIELDS = ("batch_size", "memory_budget_mb", "seed")
+
+
+class ResultCache:
+    """Дисковый LRU кэш готовых изображений по хэшу параметров генерации
+
+    Ключ - sha256 от режима, промптов, значимых полей Settings, seed
+    изображения, хэша исходника и идентичности весов, так что повтор того же
+    запроса (ретрай клиента API) отдаётся с диска без вызова пайплайна.
+    Картинки хранятся в PNG без потерь; при превышении квоты удаляются давно
+    не читанные. Порядок LRU восстанавливается по mtime файлов после
+    перезапуска, попадание обновляет mtime.
+    """
+
+    def __init__(self, root: str = RESULT_CACHE_DIR, max_mb: int = RESULT_CACHE_MB):
+        self.root = root
+        self.max_bytes = max_mb * 2**20
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        if self.max_bytes:
+            self._scan()
+
+    @staticmethod
+    def key(mode: str, prompt: str, negative: str, settings: Settings, seed: int,
+            source_digest: Optional[str], identity: tuple) -> str:
+        fields = {k: v for k, v in asdict(settings).items() if k not in IGNORED_FIELDS}
+        if mode == "txt2img":
+            fields.pop("strength")
+        payload = json.dumps([mode, prompt, negative, fields, seed, source_digest, identity],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        if not self.max_bytes:
+            return None
+        path = self._path(key)
+        with self._lock:
+            known = key in self._entries
+            if known:
+                self._entries.move_to_end(key)
+        image = None
+        if known:
+            try:
+                with Image.open(path) as f:
+                    image = f.convert("RGB")
+                    seed = f.info.get("seed")
+                os.utime(path)
+            except OSError:
+                self._forget(key)
+        with self._lock:
+            if image is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        if seed is not None:
+            image.info["seed"] = int(seed)
+        return image
+
+    def put(self, key: str, image: Image.Image):
+        if not self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+        info = PngImagePlugin.PngInfo()
+        if "seed" in image.info:
+            info.add_text("seed", str(image.info["seed"]))
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            image.save(tmp, format="PNG", compress_level=1, pnginfo=info)
+            os.replace(tmp, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"Не удалось сохранить результат в кэш: {e}")
+            return
+        evicted = []
+        with self._lock:
+            self._entries[key] = size
+            self.bytes += size
+            self.stores += 1
+            while self.bytes > self.max_bytes and self._entries:
+                old, old_size = self._entries.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(self._path(old))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+            self._entries.clear()
+            self.bytes = 0
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "mb": self.bytes / 2**20,
+                "max_mb": self.max_bytes / 2**20,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _path(self, key: str) -> str:
+        # два уровня по префиксу, чтобы не держать десятки тысяч файлов в одной папке
+        return os.path.join(self.root, key[:2], f"{key}.png")
+
+    def _forget(self, key: str):
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self.bytes -= size
+
+    def _scan(self):
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if name.endswith(".tmp"):
+                    os.remove(path)
+                elif name.endswith(".png"):
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime_ns, name[:-4], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.bytes += size
@@ -0,0 +1,122 @@
+import base64
+import io
+import threading
+import time
+from dataclasses import asdict
+from typing import Callable, Dict, List, Optional, Set
+
+import requests
+from PIL import Image
+
+from config import SERVICE_URL
+from settings import GenerationCancelled, Settings
+
+POLL_INTERVAL = 0.25
+
+
+class ServiceClient:
+    """Клиент HTTP сервиса генерации (api.py)"""
+
+    def __init__(self, base_url: str = SERVICE_URL, timeout: float = 30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.active: Dict[Optional[str], Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        try:
+            return self.session.get(f"{self.base_url}/health", timeout=1).ok
+        except requests.RequestException:
+            return False
+
+    def submit(self, prompts: List[str], negative_prompts: List[str], settings: Settings, mode: str = "txt2img",
+               n_per_prompt: int = 1, init_image: Optional[Image.Image] = None, priority: int = 0) -> dict:
+        payload = {
+            "mode": mode,
+            "prompts": prompts,
+            "negative_prompts": negative_prompts,
+            "settings": asdict(settings),
+            "n_per_prompt": n_per_prompt,
+            "priority": priority,
+        }
+        if init_image is not None:
+            buffer = io.BytesIO()
+            init_image.save(buffer, format="PNG")
+            payload["image"] = base64.b64encode(buffer.getvalue()).decode("ascii")
+        return self._call("post", "/jobs", json=payload)
+
+    def status(self, job_id: str) -> dict:
+        return self._call("get", f"/jobs/{job_id}")
+
+    def cancel(self, job_id: str) -> dict:
+        return self._call("delete", f"/jobs/{job_id}")
+
+    def image(self, job_id: str, index: int) -> Image.Image:
+        r = self.session.get(f"{self.base_url}/jobs/{job_id}/images/{index}", timeout=self.timeout)
+        r.raise_for_status()
+        return Image.open(io.BytesIO(r.content)).convert("RGB")
+
+    def wait(self, job_id: str, on_status: Optional[Callable[[dict], None]] = None) -> dict:
+        while True:
+            info = self.status(job_id)
+            if on_status is not None:
+                on_status(info)
+            if info["status"] in ("done", "failed", "cancelled"):
+                return info
+            time.sleep(POLL_INTERVAL)
+
+    def generate(self, prompts: List[str], negative_prompts: List[str], settings: Settings, mode: str = "txt2img",
+                 n_per_prompt: int = 1, init_image: Optional[Image.Image] = None, priority: int = 0,
+                 on_status: Optional[Callable[[dict], None]] = None, owner: Optional[str] = None) -> List[Image.Image]:
+        """Ставит задачу и ждёт картинки; если ожидание прервали, задача отменяется
+
+        owner - кто ждёт задачу (например, сессия интерфейса): cancel_active(owner)
+        отменяет только его задачи.
+        """
+        job = self.submit(prompts, negative_prompts, settings, mode, n_per_prompt, init_image, priority)
+        with self._lock:
+            self.active.setdefault(owner, set()).add(job["id"])
+        finished = False
+        try:
+            info = self.wait(job["id"], on_status)
+            finished = True
+        finally:
+            with self._lock:
+                jobs = self.active.get(owner, set())
+                jobs.discard(job["id"])
+                if not jobs:
+                    self.active.pop(owner, None)
+            if not finished:
+                self.cancel(job["id"])
+        if info["status"] == "cancelled":
+            raise GenerationCancelled()
+        if info["status"] == "failed":
+            raise RuntimeError(f"Генерация не удалась: {info['error']}")
+        images = [self.image(job["id"], i) for i in range(info["images"])]
+        for image, seed in zip(images, info["seeds"]):
+            image.info["seed"] = seed
+        return images
+
+    def cancel_active(self, owner: Optional[str] = None):
+        """Отменяет задачи owner, которых этот клиент сейчас ждёт"""
+        with self._lock:
+            jobs = list(self.active.get(owner, ()))
+        for job_id in jobs:
+            self.cancel(job_id)
+
+    def set_output(self, output_format: str, quality: int) -> dict:
+        return self._call("put", "/output", json={"format": output_format, "quality": quality})
+
+    def stats(self) -> dict:
+        return self._call("get", "/stats")
+
+    def _call(self, method: str, path: str, **kwargs) -> dict:
+        r = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        if not r.ok:
+            try:
+                detail = r.json().get("detail")
+            except ValueError:
+                detail = r.text
+            raise RuntimeError(f"Сервис ответил {r.status_code}: {detail}")
+        return r.json()
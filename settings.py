@@ -0,0 +1,68 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from config import LCM_LORA_PATH
+
+
+@dataclass
+class Settings:
+    height: int = 512
+    width: int = 512
+    num_inference_steps: int = 40
+    guidance_scale: float = 7.5
+    strength: float = 0.3
+    lora_scale: float = 0.8
+    fuse_lora: bool = False
+    batch_size: int = 4
+    memory_mode: str = "auto"  # auto или ключ MEMORY_MODES
+    memory_budget_mb: int = 0  # 0 - вся доступная память устройства
+    scheduler: str = "default"  # ключ SCHEDULERS
+    seed: Optional[int] = None  # seed первого изображения, следующие +1; None - случайный
+
+
+@dataclass(frozen=True)
+class MemoryPolicy:
+    attention_slicing: bool = False
+    vae_slicing: bool = False
+    vae_tiling: bool = False
+    offload: str = "none"  # none / model / sequential
+
+
+# от быстрого к экономному: auto берёт первый режим, в который влезает батч
+MEMORY_MODES = {
+    "fast": MemoryPolicy(),
+    "vae_sliced": MemoryPolicy(vae_slicing=True),
+    "vae_tiled": MemoryPolicy(vae_slicing=True, vae_tiling=True),
+    "attention_sliced": MemoryPolicy(attention_slicing=True, vae_slicing=True, vae_tiling=True),
+    "model_offload": MemoryPolicy(vae_slicing=True, vae_tiling=True, offload="model"),
+    "sequential_offload": MemoryPolicy(vae_slicing=True, vae_tiling=True, offload="sequential"),
+}
+
+
+
+@dataclass(frozen=True)
+class SchedulerPreset:
+    cls: Optional[str] = None  # класс планировщика diffusers; None - планировщик модели
+    options: tuple = ()  # (параметр, значение) поверх конфига планировщика модели
+    steps: int = 40  # рекомендуемое число шагов
+    guidance_scale: float = 7.5  # рекомендуемый guidance
+    lora: Optional[str] = None  # LoRA, без которой пресет не работает (LCM)
+
+
+SCHEDULERS = {
+    "default": SchedulerPreset(steps=40),
+    "euler": SchedulerPreset("EulerDiscreteScheduler", steps=30),
+    "euler_a": SchedulerPreset("EulerAncestralDiscreteScheduler", steps=30),
+    "dpmpp_2m_karras": SchedulerPreset(
+        "DPMSolverMultistepScheduler",
+        (("algorithm_type", "dpmsolver++"), ("solver_order", 2), ("use_karras_sigmas", True)),
+        steps=20,
+    ),
+    "unipc": SchedulerPreset("UniPCMultistepScheduler", steps=15),
+    # LCM без LCM-LoRA выдаёт шум; guidance 1 выключает CFG и вдвое ускоряет шаг
+    "lcm": SchedulerPreset("LCMScheduler", steps=4, guidance_scale=1.0, lora=LCM_LORA_PATH),
+}
+
+
+class GenerationCancelled(Exception):
+    pass
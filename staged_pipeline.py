@@ -0,0 +1,194 @@
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from settings import GenerationCancelled
+
+POLL_INTERVAL = 0.1
+# столько ошибок подряд у продюсера без готовых элементов - и next_job сдаётся
+MAX_CONSECUTIVE_FAILURES = 3
+
+
+class Stage:
+    """Фоновый воркер одной стадии с ограниченной очередью на выходе или входе
+
+    Продюсер (inbox=None) вызывает fn() и кладёт результат в outbox; консюмер
+    (outbox=None) забирает элементы из inbox и передаёт их в fn(item).
+    Полная очередь блокирует продюсера - это и есть backpressure.
+    """
+
+    def __init__(self, name: str, fn: Callable, inbox: Optional[queue.Queue] = None,
+                 outbox: Optional[queue.Queue] = None, retry_delay: float = 1.0):
+        self.name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.retry_delay = retry_delay
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"stage-{name}", daemon=True)
+        self.started_at = None
+        self.items = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_error: Optional[Exception] = None
+        self.busy_s = 0.0
+        self.blocked_s = 0.0
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self, drain: bool = False, timeout: float = 30.0):
+        """Останавливает воркер; drain=True сначала дорабатывает входную очередь"""
+        if drain and self.inbox is not None:
+            deadline = time.perf_counter() + timeout
+            while self.inbox.unfinished_tasks and time.perf_counter() < deadline:
+                time.sleep(POLL_INTERVAL)
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.inbox is not None:
+                try:
+                    item = self.inbox.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+            started = time.perf_counter()
+            try:
+                result = self.fn(item) if self.inbox is not None else self.fn()
+            except Exception as e:
+                self.errors += 1
+                self.consecutive_errors += 1
+                self.last_error = e
+                print(f"Ошибка в стадии {self.name}: {e}")
+                if self.inbox is None:
+                    self._stop.wait(self.retry_delay)
+                continue
+            finally:
+                self.busy_s += time.perf_counter() - started
+                if self.inbox is not None:
+                    self.inbox.task_done()
+            self.items += 1
+            self.consecutive_errors = 0
+            if self.outbox is not None:
+                self._put(result)
+
+    def failing(self, limit: int) -> bool:
+        return self.consecutive_errors >= limit and self.last_error is not None
+
+    def _put(self, result):
+        started = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self.outbox.put(result, timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        self.blocked_s += time.perf_counter() - started
+
+    def stats(self) -> dict:
+        wall = time.perf_counter() - self.started_at if self.started_at else 0.0
+        depth = (self.outbox if self.outbox is not None else self.inbox).qsize()
+        return {
+            "items": self.items,
+            "errors": self.errors,
+            "busy_s": self.busy_s,
+            "blocked_s": self.blocked_s,
+            "utilisation": self.busy_s / wall if wall else 0.0,
+            "queue": depth,
+        }
+
+
+class StagedGenerationLoop:
+    """Конвейер бесконечной генерации: промпты и исходники готовятся заранее,
+    сохранение идёт в фоне, а вызывающий поток занят только денойзингом"""
+
+    def __init__(self, prompt_fn: Callable[[], str], source_fn: Optional[Callable] = None,
+                 save_fn: Optional[Callable] = None, depth: int = 2,
+                 max_failures: int = MAX_CONSECUTIVE_FAILURES):
+        self.depth = depth
+        self.max_failures = max_failures
+        self._stopped = threading.Event()
+        self.prompts = queue.Queue(maxsize=depth)
+        self.sources = queue.Queue(maxsize=depth) if source_fn is not None else None
+        self.results = queue.Queue(maxsize=depth) if save_fn is not None else None
+        self.stages = [Stage("prompt", prompt_fn, outbox=self.prompts)]
+        if source_fn is not None:
+            self.stages.append(Stage("source", source_fn, outbox=self.sources))
+        if save_fn is not None:
+            self.stages.append(Stage("save", save_fn, inbox=self.results))
+        self.started_at = time.perf_counter()
+        self.denoise_items = 0
+        self.denoise_busy_s = 0.0
+        self.denoise_wait_s = 0.0
+        for stage in self.stages:
+            stage.start()
+
+    def next_job(self) -> tuple:
+        """Ждёт готовые промпт и исходник (None в txt2img)
+
+        Если продюсер падает max_failures раз подряд и очередь пуста, поднимает
+        его последнюю ошибку; после stop() поднимает GenerationCancelled.
+        """
+        started = time.perf_counter()
+        try:
+            prompt = self._take(self.prompts, self.stages[0])
+            source = self._take(self.sources, self.stages[1]) if self.sources is not None else None
+        finally:
+            self.denoise_wait_s += time.perf_counter() - started
+        return prompt, source
+
+    def _take(self, inbox: queue.Queue, stage: Stage):
+        while True:
+            if self._stopped.is_set():
+                raise GenerationCancelled()
+            try:
+                return inbox.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                pass
+            if stage.failing(self.max_failures):
+                raise stage.last_error
+
+    def denoise(self, fn: Callable, *args, **kwargs):
+        """Выполняет денойзинг в текущем потоке и учитывает его время"""
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.denoise_busy_s += time.perf_counter() - started
+            self.denoise_items += 1
+
+    def submit_result(self, item):
+        """Отдаёт результат на фоновое сохранение; блокирует, если очередь полна"""
+        if self.results is not None:
+            self.results.put(item)
+
+    def stop(self):
+        self._stopped.set()
+        for stage in self.stages:
+            stage.stop(drain=stage.inbox is not None)
+
+    def stats(self) -> dict:
+        wall = time.perf_counter() - self.started_at
+        stats = {stage.name: stage.stats() for stage in self.stages}
+        stats["denoise"] = {
+            "items": self.denoise_items,
+            "busy_s": self.denoise_busy_s,
+            "wait_s": self.denoise_wait_s,
+            "utilisation": self.denoise_busy_s / wall if wall else 0.0,
+        }
+        return stats
+
+    def format_stats(self) -> str:
+        lines = []
+        for name, s in self.stats().items():
+            line = f"{name}: загрузка {s['utilisation']:.0%}, готово {s['items']}"
+            if "queue" in s:
+                line += f", в очереди {s['queue']}/{self.depth}, ошибок {s['errors']}"
+            if "wait_s" in s:
+                line += f", ожидание входа {s['wait_s']:.1f} с"
+            lines.append(line)
+        return "\n".join(lines)
@@ -2,28 +2,24 @@ import os
 from diffusers import StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline
 import torch
 from datetime import datetime
-from huggingface_hub import login
 from PIL import Image
-from dotenv import load_dotenv
 
-from config import LORA_PATH, CACHE_DIR, TEST_OUTPUT, INPUT_PATH, TEST_PROMPT, NEGATIVE_PROMPT, SEED
-
-load_dotenv()
-api_key = os.getenv("HUGGINGFACE_TOKEN")
-login(token=api_key)
+from config import LORA_PATH, TEST_OUTPUT, INPUT_PATH, TEST_PROMPT, NEGATIVE_PROMPT, SEED
+from model_store import ModelStore
 
 os.makedirs(TEST_OUTPUT, exist_ok=True)
 
+store = ModelStore()
+
+def load_pipeline(pipeline_class):
+    """Пайплайн из закреплённого локального снапшота, без запросов к хабу"""
+    pipe, _ = store.load(pipeline_class, dtype=torch.float16)
+    return pipe.to("cuda")
+
 def test_without_lora():
     """Тест без LoRA"""
     
-    pipe = StableDiffusionXLPipeline.from_pretrained(
-        "stabilityai/stable-diffusion-xl-base-1.0",
-        torch_dtype=torch.float16,
-        use_safetensors=True,
-        cache_dir=CACHE_DIR,
-        variant="fp16"
-    ).to("cuda")
+    pipe = load_pipeline(StableDiffusionXLPipeline)
     
     pipe.safety_checker = None
 
@@ -55,13 +51,7 @@ def test_without_lora():
 def test_with_lora():
     """Тест с LoRA"""
     
-    pipe = StableDiffusionXLPipeline.from_pretrained(
-        "stabilityai/stable-diffusion-xl-base-1.0",
-        torch_dtype=torch.float16,
-        use_safetensors=True,
-        cache_dir=CACHE_DIR,
-        variant="fp16"
-    ).to("cuda")
+    pipe = load_pipeline(StableDiffusionXLPipeline)
     
     pipe.safety_checker = None
 
@@ -105,13 +95,7 @@ def test_img2img_without_lora():
         test_img.save(INPUT_PATH)
         print(f"Создано тестовое изображение: {INPUT_PATH}")
     
-    pipe = StableDiffusionXLImg2ImgPipeline.from_pretrained(
-        "stabilityai/stable-diffusion-xl-base-1.0",
-        torch_dtype=torch.float16,
-        use_safetensors=True,
-        cache_dir=CACHE_DIR,
-        variant="fp16"
-    ).to("cuda")
+    pipe = load_pipeline(StableDiffusionXLImg2ImgPipeline)
     
     pipe.safety_checker = None
 
@@ -153,13 +137,7 @@ def test_img2img_with_lora():
         test_img.save(INPUT_PATH)
         print(f"Создано тестовое изображение: {INPUT_PATH}")
     
-    pipe = StableDiffusionXLImg2ImgPipeline.from_pretrained(
-        "stabilityai/stable-diffusion-xl-base-1.0",
-        torch_dtype=torch.float16,
-        use_safetensors=True,
-        cache_dir=CACHE_DIR,
-        variant="fp16"
-    ).to("cuda")
+    pipe = load_pipeline(StableDiffusionXLImg2ImgPipeline)
     
     pipe.safety_checker = None
 
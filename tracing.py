@@ -0,0 +1,291 @@
+import itertools
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from config import TRACE_PATH, TRACE_MAX_MB, TRACE_WINDOW, METRICS_HOST, METRICS_PORT
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRIC_PREFIX = "ttcreate"
+QUANTILES = {0.5: "p50_s", 0.95: "p95_s"}
+
+
+def rss_bytes() -> Optional[int]:
+    """Текущий RSS процесса (None, если узнать нельзя)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Пиковый RSS процесса с момента запуска"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def cuda_torch():
+    """torch, если он уже импортирован и CUDA инициализирована; ради телеметрии не грузим ни то, ни другое"""
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+        return torch
+    return None
+
+
+def quantile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Span:
+    def __init__(self, name: str, trace: int, parent: Optional["Span"], gpu: bool, attrs: dict):
+        self.name = name
+        self.trace = trace
+        self.parent = parent
+        self.gpu = gpu
+        self.attrs = attrs
+        self.vram_peak = 0
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+
+
+class Tracer:
+    """Спаны по стадиям: JSONL трейс, скользящая сводка и текст для Prometheus
+
+    Вложенные спаны одного потока получают общий trace и parent. Для спанов с
+    gpu=True считается пик VRAM: счётчик пика сбрасывается на входе, а
+    значение внешнего спана сохраняется до сброса, поэтому вложенность не
+    теряет максимум. Дописывать время вручную (например, денойзинг из
+    колбэка пайплайна) можно через record().
+    """
+
+    def __init__(self, path: Optional[str] = TRACE_PATH, window: int = TRACE_WINDOW, max_mb: int = TRACE_MAX_MB):
+        self.path = path
+        self.window = window
+        self.max_bytes = max_mb * 2**20
+        self.started = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._file = None
+        self._recent: Dict[str, deque] = {}
+        self._totals: Dict[str, dict] = {}
+        self.peak_vram = 0
+
+    @contextmanager
+    def span(self, name: str, gpu: bool = False, **attrs):
+        """with tracer.span("encode", gpu=True) as attrs: ...; в attrs можно дописать поля"""
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        span = Span(name, parent.trace if parent else next(self._ids), parent, gpu, attrs)
+        torch = cuda_torch() if gpu else None
+        if torch is not None:
+            if parent is not None:
+                parent.vram_peak = max(parent.vram_peak, torch.cuda.max_memory_allocated())
+            torch.cuda.reset_peak_memory_stats()
+        stack.append(span)
+        error = None
+        try:
+            yield span.attrs
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            stack.pop()
+            if torch is not None:
+                torch.cuda.synchronize()
+                span.vram_peak = max(span.vram_peak, torch.cuda.max_memory_allocated())
+                if parent is not None:
+                    parent.vram_peak = max(parent.vram_peak, span.vram_peak)
+            self._finish(span, time.perf_counter() - span.started, error)
+
+    def record(self, name: str, duration_s: float, started_at: Optional[float] = None, **attrs):
+        """Стадия, время которой измерено снаружи; родитель - текущий спан потока"""
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        span = Span(name, parent.trace if parent else next(self._ids), parent, False, attrs)
+        span.started_at = started_at if started_at is not None else span.started_at - duration_s
+        self._finish(span, duration_s, None)
+
+    def summary(self) -> dict:
+        with self._lock:
+            stages = {}
+            for name, totals in self._totals.items():
+                recent = list(self._recent[name])
+                stages[name] = dict(
+                    totals,
+                    p50_s=quantile(recent, 0.5),
+                    p95_s=quantile(recent, 0.95),
+                    mean_s=statistics.fmean(recent),
+                )
+            return {
+                "uptime_s": time.perf_counter() - self.started,
+                "rss_bytes": rss_bytes(),
+                "peak_rss_bytes": peak_rss_bytes(),
+                "peak_vram_bytes": self.peak_vram,
+                "stages": stages,
+            }
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        if not summary["stages"]:
+            return "Спанов пока нет"
+        uptime = summary["uptime_s"]
+        lines = []
+        ordered = sorted(summary["stages"].items(), key=lambda item: item[1]["total_s"], reverse=True)
+        for name, s in ordered:
+            line = (
+                f"{name}: {s['count']} x {s['mean_s']:.2f} с (p95 {s['p95_s']:.2f}), "
+                f"всего {s['total_s']:.1f} с ({s['total_s'] / uptime:.0%} времени)"
+            )
+            if s["errors"]:
+                line += f", ошибок {s['errors']}"
+            if s["vram_peak_bytes"]:
+                line += f", VRAM пик {s['vram_peak_bytes'] / 2**20:.0f} MB"
+            lines.append(line)
+        memory = []
+        if summary["rss_bytes"] is not None:
+            memory.append(f"RSS {summary['rss_bytes'] / 2**20:.0f} MB")
+        if summary["peak_rss_bytes"] is not None:
+            memory.append(f"пик RSS {summary['peak_rss_bytes'] / 2**20:.0f} MB")
+        if summary["peak_vram_bytes"]:
+            memory.append(f"пик VRAM {summary['peak_vram_bytes'] / 2**20:.0f} MB")
+        if memory:
+            lines.append("память: " + ", ".join(memory))
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        """Текстовый формат экспозиции Prometheus"""
+        summary = self.summary()
+        p = METRIC_PREFIX
+        lines = [
+            f"# HELP {p}_stage_seconds Длительность стадий; квантили по последним {self.window} спанам",
+            f"# TYPE {p}_stage_seconds summary",
+        ]
+        for name, s in summary["stages"].items():
+            for q, key in QUANTILES.items():
+                lines.append(f'{p}_stage_seconds{{stage="{name}",quantile="{q}"}} {s[key]:.6f}')
+            lines.append(f'{p}_stage_seconds_sum{{stage="{name}"}} {s["total_s"]:.6f}')
+            lines.append(f'{p}_stage_seconds_count{{stage="{name}"}} {s["count"]}')
+        lines += [f"# HELP {p}_stage_errors_total Спаны, завершившиеся исключением", f"# TYPE {p}_stage_errors_total counter"]
+        lines += [f'{p}_stage_errors_total{{stage="{name}"}} {s["errors"]}' for name, s in summary["stages"].items()]
+        lines += [f"# HELP {p}_stage_rss_bytes Максимальный RSS на выходе из стадии", f"# TYPE {p}_stage_rss_bytes gauge"]
+        lines += [f'{p}_stage_rss_bytes{{stage="{name}"}} {s["rss_peak_bytes"]}' for name, s in summary["stages"].items()]
+        lines += [f"# HELP {p}_stage_vram_peak_bytes Пик VRAM внутри стадии", f"# TYPE {p}_stage_vram_peak_bytes gauge"]
+        lines += [f'{p}_stage_vram_peak_bytes{{stage="{name}"}} {s["vram_peak_bytes"]}' for name, s in summary["stages"].items()]
+        for metric, key, help_text in (
+            ("rss_bytes", "rss_bytes", "Текущий RSS процесса"),
+            ("rss_peak_bytes", "peak_rss_bytes", "Пиковый RSS процесса"),
+            ("vram_peak_bytes", "peak_vram_bytes", "Пик выделенной VRAM по всем спанам"),
+        ):
+            if summary[key] is not None:
+                lines += [f"# HELP {p}_{metric} {help_text}", f"# TYPE {p}_{metric} gauge", f"{p}_{metric} {summary[key]}"]
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _finish(self, span: Span, duration_s: float, error: Optional[str]):
+        rss = rss_bytes()
+        record = {
+            "ts": round(span.started_at, 6),
+            "trace": span.trace,
+            "span": span.name,
+            "parent": span.parent.name if span.parent else None,
+            "thread": threading.current_thread().name,
+            "duration_s": round(duration_s, 6),
+            "rss_mb": round(rss / 2**20, 1) if rss is not None else None,
+        }
+        if span.gpu and span.vram_peak:
+            record["vram_peak_mb"] = round(span.vram_peak / 2**20, 1)
+        if error is not None:
+            record["error"] = error
+        record.update(span.attrs)
+
+        with self._lock:
+            recent = self._recent.setdefault(span.name, deque(maxlen=self.window))
+            recent.append(duration_s)
+            totals = self._totals.setdefault(
+                span.name, {"count": 0, "total_s": 0.0, "errors": 0, "rss_peak_bytes": 0, "vram_peak_bytes": 0}
+            )
+            totals["count"] += 1
+            totals["total_s"] += duration_s
+            totals["errors"] += error is not None
+            totals["rss_peak_bytes"] = max(totals["rss_peak_bytes"], rss or 0)
+            totals["vram_peak_bytes"] = max(totals["vram_peak_bytes"], span.vram_peak)
+            self.peak_vram = max(self.peak_vram, span.vram_peak)
+            if self.path:
+                self._write(record)
+
+    def _write(self, record: dict):
+        # вызывается под self._lock
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self._file.flush()
+            if self.max_bytes and self._file.tell() > self.max_bytes:
+                # бесконечная генерация: держим один предыдущий файл
+                self._file.close()
+                self._file = None
+                os.replace(self.path, self.path + ".1")
+        except OSError as e:
+            print(f"Не удалось записать трейс {self.path}: {e}")
+            self.path = None
+
+
+tracer = Tracer()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = tracer.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """Поднимает /metrics в фоновом потоке; None, если порт выключен или занят"""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Эндпоинт метрик не поднят ({host}:{port}): {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Метрики Prometheus: http://{host}:{port}/metrics")
+    return server